@@ -0,0 +1,92 @@
+"""Requests/second for the read-heavy routes with and without connection pooling.
+
+Usage (from backend-test/):
+    python bench_db.py [students] [attendance_rows]
+
+Seeds a throwaway database, then drives /api/students and /api/attendance/history
+through the Flask test client for a few seconds each: first with a fresh
+connection per use and no pragma profile (the old get_connection), then with the
+pooled, tuned connections.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import run
+
+DURATION = 3.0
+ROUTES = ["/api/students", "/api/attendance/history?limit=50"]
+
+
+def _seed(students: int, rows: int) -> None:
+    conn = sqlite3.connect(run.DB_PATH)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password_hash TEXT, role TEXT)")
+    conn.execute(
+        """
+        CREATE TABLE attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER NOT NULL, class_id INTEGER NOT NULL,
+            date TEXT NOT NULL, time TEXT, status TEXT NOT NULL, recognized_name TEXT,
+            source TEXT DEFAULT 'manual', remark TEXT, created_at TEXT, updated_at TEXT
+        )
+        """
+    )
+    conn.commit()
+    conn.close()
+    run.init_db()
+    conn = sqlite3.connect(run.DB_PATH)
+    conn.executemany(
+        "INSERT INTO students (name, roll_no, email, username) VALUES (?, ?, ?, ?)",
+        [(f"Student {i}", f"R{i}", f"s{i}@example.com", f"s{i}") for i in range(students)],
+    )
+    conn.execute("INSERT INTO classes (class_name, section, subject) VALUES ('Math', 'A', 'math')")
+    conn.executemany(
+        "INSERT INTO enrollments (class_id, student_id) VALUES (1, ?)", [(i + 1,) for i in range(students)]
+    )
+    conn.executemany(
+        """
+        INSERT INTO attendance (student_id, class_id, date, time, status, source, created_at, updated_at)
+        VALUES (?, 1, ?, '09:00:00', 'present', 'manual', ?, ?)
+        """,
+        [
+            (i % students + 1, f"2026-01-{i // students % 28 + 1:02d}", "2026-01-01T09:00:00", "2026-01-01T09:00:00")
+            for i in range(rows)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _rps(client, route: str) -> float:
+    client.get(route)  # warm-up
+    count = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < DURATION:
+        assert client.get(route).status_code == 200
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def main() -> None:
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    workdir = tempfile.mkdtemp(prefix="bench_db_")
+    run.DB_DIR = workdir
+    run.DB_PATH = os.path.join(workdir, "bench.db")
+    _seed(students, rows)
+    client = run.app.test_client()
+
+    pool_size, pragmas = run.SQLITE_POOL_SIZE, dict(run.SQLITE_PRAGMAS)
+    print(f"{students} students, {rows} attendance rows\n")
+    print(f"{'route':<36} {'before req/s':>13} {'after req/s':>12}")
+    for route in ROUTES:
+        run.SQLITE_POOL_SIZE, run.SQLITE_PRAGMAS = 0, {}
+        before = _rps(client, route)
+        run.SQLITE_POOL_SIZE, run.SQLITE_PRAGMAS = pool_size, pragmas
+        after = _rps(client, route)
+        print(f"{route:<36} {before:>13.0f} {after:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
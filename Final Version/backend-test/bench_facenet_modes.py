@@ -0,0 +1,54 @@
+"""Per-frame embedding latency: facenet over HTTP versus in-process.
+
+Usage (from backend-test/, with facenet_service listening on FACENET_URL):
+    python bench_facenet_modes.py [frames]
+
+Sends every test photo in ../facenet_service/tests through run.py's
+_facenet_embed_from_bytes, first with the pooled HTTP client, then with
+facenet_service imported into this process (FACENET_MODE=inprocess). Both must
+use the same EMBEDDER. Reports median and p95 milliseconds per frame and the
+bytes each frame moves over the wire.
+"""
+import glob
+import os
+import sys
+import time
+
+import numpy as np
+
+import run
+from services.facenet_client import FacenetClient
+from services.facenet_local import LocalFacenet
+
+PHOTOS = os.path.join(run.PROJECT_ROOT, "facenet_service", "tests", "*.jpg")
+
+
+def _time_frames(frames, count):
+    run._facenet_embed_from_bytes(frames[0], "image/jpeg")  # warm-up (connection, lazy import)
+    timings = []
+    for index in range(count):
+        started = time.perf_counter()
+        embedding, _ = run._facenet_embed_from_bytes(frames[index % len(frames)], "image/jpeg")
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return np.asarray(timings), len(embedding)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    frames = [open(path, "rb").read() for path in sorted(glob.glob(PHOTOS))]
+    print(f"{len(frames)} photos, {count} frames, mean jpeg {np.mean([len(f) for f in frames]) / 1024:.1f} KiB\n")
+    print(f"{'mode':<10} {'median ms':>10} {'p95 ms':>8} {'dims':>6} {'reply bytes':>12}")
+
+    run._facenet_local = None
+    run._facenet = FacenetClient(run.FACENET_URL)
+    timings, dims = _time_frames(frames, count)
+    reply = len(run._facenet.post("/embed_upload", files={"image": ("f", frames[0], "image/jpeg")}).content)
+    print(f"{'http':<10} {np.median(timings):>10.2f} {np.percentile(timings, 95):>8.2f} {dims:>6} {reply:>12}")
+
+    run._facenet_local = run._facenet = LocalFacenet(run.FACENET_SERVICE_DIR)
+    timings, dims = _time_frames(frames, count)
+    print(f"{'inprocess':<10} {np.median(timings):>10.2f} {np.percentile(timings, 95):>8.2f} {dims:>6} {0:>12}")
+
+
+if __name__ == "__main__":
+    main()
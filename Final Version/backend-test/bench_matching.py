@@ -0,0 +1,71 @@
+"""Micro-benchmark for attendance matching in run.py.
+
+Usage (from backend-test/):
+    python bench_matching.py [dim]
+
+Times one probe against 1k/10k/100k random unit embeddings: the old per-student
+pure-Python cosine loop (skipped at 100k) versus the normalized matrix-vector
+product with argpartition top-k used by _GalleryCache.
+"""
+import math
+import sys
+import time
+
+import numpy as np
+
+from run import _top_k_similar, _unit_rows
+
+SIZES = [1_000, 10_000, 100_000]
+REPEATS = 20
+
+
+def _python_cosine_distance(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if norm_a == 0 or norm_b == 0:
+        return 1.0
+    return 1.0 - max(min(dot / (norm_a * norm_b), 1.0), -1.0)
+
+
+def _python_best(gallery, probe):
+    best = None
+    for index, vector in enumerate(gallery):
+        distance = _python_cosine_distance(probe, vector)
+        if best is None or distance < best[1]:
+            best = (index, distance)
+    return best
+
+
+def main() -> None:
+    dim = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    rng = np.random.default_rng(0)
+    print(f"dim={dim}\n")
+    print(f"{'students':>9} {'python ms':>10} {'numpy ms':>9} {'speedup':>8} {'margin':>8}")
+    for size in SIZES:
+        matrix = _unit_rows(rng.standard_normal((size, dim)).astype(np.float32))
+        probe = matrix[size // 2] + 0.05 * rng.standard_normal(dim).astype(np.float32)
+        unit_probe = _unit_rows(probe)[0]
+
+        _top_k_similar(matrix, unit_probe, 2)  # warm-up
+        started = time.perf_counter()
+        for _ in range(REPEATS):
+            top = _top_k_similar(matrix, unit_probe, 2)
+        numpy_ms = (time.perf_counter() - started) * 1000.0 / REPEATS
+        assert top[0][0] == size // 2
+        margin = top[0][1] - top[1][1]
+
+        if size <= 10_000:
+            gallery = matrix.tolist()
+            probe_list = probe.tolist()
+            started = time.perf_counter()
+            best = _python_best(gallery, probe_list)
+            python_ms = (time.perf_counter() - started) * 1000.0
+            assert best[0] == size // 2
+            print(f"{size:>9} {python_ms:>10.1f} {numpy_ms:>9.2f} {python_ms / numpy_ms:>7.0f}x {margin:>8.3f}")
+        else:
+            print(f"{size:>9} {'-':>10} {numpy_ms:>9.2f} {'-':>8} {margin:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,35 @@
+import atexit
 import base64
 import csv
+import functools
+import hashlib
 import io
 import json
-import math
 import os
+import queue
+import signal
 import sqlite3
-from collections import Counter
-from contextlib import closing
+import struct
+import sys
+import threading
+import time
+import zipfile
+import zlib
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
 from datetime import datetime, timezone, date
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import requests
-from flask import Flask, Response, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash
 
+from services.facenet_client import FacenetClient
+from services.facenet_local import LocalFacenet
+
 # ----------------------------
 # Config / Paths
 # ----------------------------
@@ -24,17 +39,133 @@ DB_DIR = os.path.join(PROJECT_ROOT, "backend-test", "instance")
 DB_PATH = os.path.join(DB_DIR, "attendance_system.db")  # <- existing DB
 
 FACENET_URL = os.getenv("FACENET_URL", "http://localhost:5001")
+# Shared keep-alive client (services/facenet_client.py): connections kept per
+# process, retries on connection errors / 502-504, and the circuit breaker that
+# fails fast after FACENET_BREAKER_FAILURES consecutive failures for
+# FACENET_BREAKER_RESET seconds.
+FACENET_POOL_SIZE = int(os.getenv("FACENET_POOL_SIZE", "16"))
+FACENET_RETRIES = int(os.getenv("FACENET_RETRIES", "2"))
+FACENET_BREAKER_FAILURES = int(os.getenv("FACENET_BREAKER_FAILURES", "5"))
+FACENET_BREAKER_RESET = float(os.getenv("FACENET_BREAKER_RESET", "10"))
+# FACENET_MODE=inprocess imports facenet_service from FACENET_SERVICE_DIR and calls
+# it directly (single-host deployments); the default "http" talks to FACENET_URL.
+FACENET_MODE = os.getenv("FACENET_MODE", "http").strip().lower()
+FACENET_SERVICE_DIR = os.getenv("FACENET_SERVICE_DIR", os.path.join(PROJECT_ROOT, "facenet_service"))
 MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.4"))
+# The best match must beat the runner-up's cosine distance by at least this much;
+# closer calls are rejected as ambiguous (0 disables the check).
+MATCH_MIN_MARGIN = float(os.getenv("MATCH_MIN_MARGIN", "0"))
 CORS_ORIGIN = os.getenv("CORS_ORIGIN", "http://localhost:3000")
+# Forwarded to facenet_service so it can dedup near-identical webcam frames per device.
+DEVICE_ID_HEADER = os.getenv("DEVICE_ID_HEADER", "X-Device-Id")
 PORT = int(os.getenv("PORT", "5000"))
+# Enrollment photos, stored by SHA-256 so embeddings can be regenerated when
+# the facenet embedder changes.
+PHOTO_STORE_DIR = os.getenv("PHOTO_STORE_DIR", os.path.join(DB_DIR, "photos"))
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "32"))
+REEMBED_WORKERS = int(os.getenv("REEMBED_WORKERS", "4"))
+# Registration flags existing students whose cosine similarity to the new photo
+# is at least DUPLICATE_SIMILARITY (top DUPLICATE_TOP_K candidates).
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.92"))
+DUPLICATE_TOP_K = int(os.getenv("DUPLICATE_TOP_K", "5"))
+# Bulk import (CSV + photo zip): password hashing is CPU-bound but hashlib's scrypt
+# releases the GIL, so it runs on one thread pool shared by all imports; photos go
+# to facenet's /embed_batch with bounded concurrency.
+STUDENT_IMPORT_HASH_WORKERS = int(os.getenv("STUDENT_IMPORT_HASH_WORKERS", str(os.cpu_count() or 1)))
+STUDENT_IMPORT_EMBED_WORKERS = int(os.getenv("STUDENT_IMPORT_EMBED_WORKERS", "4"))
+STUDENT_IMPORT_BATCH_SIZE = int(os.getenv("STUDENT_IMPORT_BATCH_SIZE", "32"))
+STUDENT_IMPORT_MAX_ROWS = int(os.getenv("STUDENT_IMPORT_MAX_ROWS", "5000"))
+STUDENT_IMPORT_MAX_PHOTO_BYTES = int(os.getenv("STUDENT_IMPORT_MAX_PHOTO_BYTES", str(10 * 1024 * 1024)))
+# Student ids plus roll numbers accepted by one /api/classes/<id>/enrollments call.
+ENROLLMENT_MAX_KEYS = int(os.getenv("ENROLLMENT_MAX_KEYS", "20000"))
+# Gallery sync with facenet_service: new and updated embeddings are pushed right
+# after commit, and facenet-side enrollments are pulled every FACENET_SYNC_INTERVAL
+# seconds (0 disables the poller). FACENET_SYNC=0 turns both off. In-process mode
+# has a single gallery (the cache below), so there is nothing to sync.
+FACENET_SYNC = os.getenv("FACENET_SYNC", "1") != "0" and FACENET_MODE != "inprocess"
+FACENET_SYNC_INTERVAL = float(os.getenv("FACENET_SYNC_INTERVAL", "5"))
+FACENET_SYNC_ORIGIN = "backend"
+# Rows of embedding_changes kept at startup; a cache further behind rebuilds.
+EMBEDDING_CHANGES_KEEP = int(os.getenv("EMBEDDING_CHANGES_KEEP", "10000"))
+# Marking with a classId matches only that class's roster; this many rosters keep
+# their embedding submatrix cached (least recently used go first).
+ROSTER_CACHE_SIZE = int(os.getenv("ROSTER_CACHE_SIZE", "256"))
+# Legacy JSON-text embeddings are rewritten as float32 blobs this many rows per transaction.
+EMBEDDING_MIGRATION_BATCH = int(os.getenv("EMBEDDING_MIGRATION_BATCH", "500"))
+# Connection pooling: idle connections kept per pool (write / read-only); 0 disables reuse.
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+# Pragma profile applied once to every new connection.
+SQLITE_PRAGMAS: Dict[str, str] = {
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),  # durable enough under WAL
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-20000"),  # negative = KiB
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+# /api/attendance/history totals are cached per filter set for this many seconds;
+# ?total=exact recounts and ?total=none skips the count.
+HISTORY_COUNT_TTL = float(os.getenv("HISTORY_COUNT_TTL", "30"))
+HISTORY_COUNT_CACHE_SIZE = 256
+# /api/attendance/history/export reads and writes this many rows per chunk.
+HISTORY_EXPORT_CHUNK = int(os.getenv("HISTORY_EXPORT_CHUNK", "1000"))
+# attendance_logs / verification_logs are written by a background thread in batches
+# of up to AUDIT_LOG_BATCH_ROWS rows or every AUDIT_LOG_FLUSH_MS; AUDIT_LOG_ASYNC=0
+# keeps the writes synchronous. Rows the database rejects are kept in the spill file.
+# Rows still queued when the process is killed outright (SIGKILL, OOM, power loss)
+# are lost: at most AUDIT_LOG_QUEUE_SIZE rows, normally one flush interval's worth.
+AUDIT_LOG_ASYNC = os.getenv("AUDIT_LOG_ASYNC", "1") != "0"
+AUDIT_LOG_QUEUE_SIZE = int(os.getenv("AUDIT_LOG_QUEUE_SIZE", "10000"))
+AUDIT_LOG_BATCH_ROWS = int(os.getenv("AUDIT_LOG_BATCH_ROWS", "500"))
+AUDIT_LOG_FLUSH_MS = float(os.getenv("AUDIT_LOG_FLUSH_MS", "200"))
+AUDIT_LOG_SPILL_PATH = os.getenv("AUDIT_LOG_SPILL_PATH", os.path.join(DB_DIR, "audit_log_spill.jsonl"))
+# /api/attendance/stream: the last ATTENDANCE_FEED_REPLAY events are kept for
+# Last-Event-ID resume; a client more than ATTENDANCE_FEED_CLIENT_BUFFER events
+# behind is disconnected (and resumes on reconnect). Idle streams get a comment
+# every ATTENDANCE_FEED_HEARTBEAT seconds so dead connections are noticed.
+ATTENDANCE_FEED_REPLAY = int(os.getenv("ATTENDANCE_FEED_REPLAY", "1000"))
+ATTENDANCE_FEED_CLIENT_BUFFER = int(os.getenv("ATTENDANCE_FEED_CLIENT_BUFFER", "100"))
+ATTENDANCE_FEED_HEARTBEAT = float(os.getenv("ATTENDANCE_FEED_HEARTBEAT", "15"))
+# GET /api/students, /api/classes and /api/class-students responses are cached
+# (RESPONSE_CACHE_SIZE entries, 0 disables) until any connection or process
+# writes students, classes or enrollments.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "512"))
+
+_facenet_local = LocalFacenet(FACENET_SERVICE_DIR) if FACENET_MODE == "inprocess" else None
+_facenet = _facenet_local or FacenetClient(
+    FACENET_URL,
+    pool_size=FACENET_POOL_SIZE,
+    retries=FACENET_RETRIES,
+    failure_threshold=FACENET_BREAKER_FAILURES,
+    reset_timeout=FACENET_BREAKER_RESET,
+)
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": CORS_ORIGIN}})
 
+
+@app.teardown_appcontext
+def _release_request_connection(_exc: Optional[BaseException]) -> None:
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        conn.close()
+
 # ----------------------------
 # DB Helpers
 # ----------------------------
-SCHEMA_INITIALIZED = False
+SCHEMA_INITIALIZED: Optional[str] = None  # DB_PATH ensure_schema() last ran against
+# Secondary indexes behind the hot queries (attendance history filters and
+# student search, students joined or filtered on student_id), created
+# idempotently by init_db. Entries whose table or columns a legacy schema lacks
+# are skipped. test_query_plans.py fails when a hot query falls back to a full
+# table scan.
+MANAGED_INDEXES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("idx_attendance_class_date", "attendance", ("class_id", "date")),
+    ("idx_attendance_date", "attendance", ("date",)),
+    ("idx_attendance_student", "attendance", ("student_id",)),
+    ("idx_students_student_id", "students", ("student_id",)),
+    ("idx_students_roll_no", "students", ("roll_no",)),
+    ("idx_students_rollNo", "students", ("rollNo",)),
+]
 print("Using DB:", DB_PATH)  # right after you compute DB_PATH
 
 
@@ -98,24 +229,202 @@ def ensure_schema(conn: sqlite3.Connection) -> None:
                 continue
         except Exception:
             continue
+    _ensure_attendance_unique_key(cursor)
     conn.commit()
+    _invalidate_schema_cache()
+
+
+# One attendance row per student, class and day; attendance_manual upserts against it.
+# Databases that already hold duplicates keep working without the index (with a
+# warning, and manual attendance updating every duplicate instead of upserting)
+# until `python run.py dedupe-attendance` removes them.
+def _ensure_attendance_unique_key(cursor: sqlite3.Cursor) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_attendance_class_student_date'"
+    )
+    if cursor.fetchone():
+        return True
+    try:
+        duplicates = _attendance_duplicate_count(cursor)
+        if duplicates:
+            print(
+                f"[schema] attendance has {duplicates} duplicate (class_id, student_id, date) rows; "
+                "idx_attendance_class_student_date not created and manual attendance falls back to slower updates. "
+                "Run `python run.py dedupe-attendance` to keep the latest row of each.",
+                flush=True,
+            )
+            return False
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_class_student_date
+            ON attendance (class_id, student_id, date)
+            """
+        )
+    except sqlite3.OperationalError as exc:
+        print(f"[schema] could not create idx_attendance_class_student_date: {exc}", flush=True)
+        return False
+    return True
+
+def _attendance_duplicate_count(cursor: sqlite3.Cursor) -> int:
+    """Rows that would be removed to make (class_id, student_id, date) unique."""
+    cursor.execute(
+        """
+        SELECT COALESCE(SUM(n - 1), 0) FROM (
+            SELECT COUNT(*) AS n FROM attendance GROUP BY class_id, student_id, date HAVING COUNT(*) > 1
+        )
+        """
+    )
+    return cursor.fetchone()[0]
+
+def _dedupe_attendance(cursor: sqlite3.Cursor) -> int:
+    """Delete all but the most recent row of each duplicate group; returns rows deleted."""
+    cursor.execute(
+        """
+        DELETE FROM attendance WHERE id NOT IN (
+            SELECT MAX(id) FROM attendance GROUP BY class_id, student_id, date
+        )
+        """
+    )
+    return cursor.rowcount
+
+def _attendance_has_unique_key(cursor: sqlite3.Cursor) -> bool:
+    key = (DB_PATH, "attendance:unique")
+    present = _schema_cache.get(key)
+    if present is None:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_attendance_class_student_date'"
+        )
+        present = _schema_cache[key] = cursor.fetchone() is not None
+    return present
+
+
+class _PooledConnection(sqlite3.Connection):
+    """A connection whose close() hands it back to its pool (rolled back) instead of closing it."""
+
+    pool: Optional["_ConnectionPool"] = None
+    db_path: Optional[str] = None
 
+    def close(self) -> None:
+        pool = self.pool
+        if pool is None or not pool.release(self):
+            super().close()
 
-def get_connection() -> sqlite3.Connection:
+
+class _ConnectionPool:
+    """Warm connections to DB_PATH with SQLITE_PRAGMAS applied; read-only pools set query_only."""
+
+    def __init__(self, readonly: bool) -> None:
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.idle: List[_PooledConnection] = []
+
+    def acquire(self) -> _PooledConnection:
+        stale: List[_PooledConnection] = []
+        conn = None
+        with self.lock:
+            while self.idle and conn is None:
+                candidate = self.idle.pop()
+                if candidate.db_path == DB_PATH:
+                    conn = candidate
+                else:
+                    stale.append(candidate)
+        for candidate in stale:
+            sqlite3.Connection.close(candidate)
+        return conn if conn is not None else self._open()
+
+    def _open(self) -> _PooledConnection:
+        conn = sqlite3.connect(DB_PATH, factory=_PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in SQLITE_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.readonly:
+            conn.execute("PRAGMA query_only = ON")
+        conn.db_path = DB_PATH
+        conn.pool = self
+        return conn
+
+    def release(self, conn: _PooledConnection) -> bool:
+        """Take `conn` back; False means the caller should really close it."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            return False
+        with self.lock:
+            if any(idle is conn for idle in self.idle):
+                return True
+            if len(self.idle) >= SQLITE_POOL_SIZE or conn.db_path != DB_PATH:
+                return False
+            self.idle.append(conn)
+            return True
+
+
+_write_pool = _ConnectionPool(readonly=False)
+_read_pool = _ConnectionPool(readonly=True)
+
+
+def get_connection(readonly: bool = False) -> sqlite3.Connection:
+    """
+    A pooled connection; use as `with closing(get_connection()) as conn`, which returns it
+    to the pool. readonly=True draws from a separate query_only pool for GET routes.
+    """
     os.makedirs(DB_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
     global SCHEMA_INITIALIZED
-    if not SCHEMA_INITIALIZED:
-        ensure_schema(conn)
-        SCHEMA_INITIALIZED = True
-    return conn
+    if SCHEMA_INITIALIZED != DB_PATH:
+        with closing(_write_pool.acquire()) as conn:
+            ensure_schema(conn)
+        SCHEMA_INITIALIZED = DB_PATH
+    return (_read_pool if readonly else _write_pool).acquire()
+
+
+@contextmanager
+def _request_transaction() -> Iterator[sqlite3.Connection]:
+    """
+    The request's write transaction. One pooled connection is kept on flask.g for
+    the whole request (released at teardown); the block runs inside BEGIN IMMEDIATE,
+    commits on a normal exit and rolls back on an exception. Nested use joins the
+    open transaction.
+    """
+    conn = g.get("db_conn")
+    if conn is None:
+        conn = g.db_conn = get_connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
 
-def _table_columns(cursor: sqlite3.Cursor, table: str) -> set[str]:
-    cursor.execute(f'PRAGMA table_info("{table}")')
-    return {row[1] for row in cursor.fetchall()}
+# Schema descriptor: table columns, the PK / enrollment layout derived from them and
+# the SQL fragments built for each variant. Computed once per database (warmed at
+# the end of init_db) and dropped by _invalidate_schema_cache() whenever a
+# migration may have altered a table; request handlers never hit PRAGMA table_info.
+_schema_cache: Dict[Tuple[str, str], Any] = {}
+_sql_fragments: Dict[Tuple[Any, ...], str] = {}
+
+def _invalidate_schema_cache() -> None:
+    _schema_cache.clear()
+    _sql_fragments.clear()
+
+def _table_columns(cursor: sqlite3.Cursor, table: str) -> frozenset[str]:
+    key = (DB_PATH, table)
+    cols = _schema_cache.get(key)
+    if cols is None:
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        cols = frozenset(row[1] for row in cursor.fetchall())
+        if cols:  # a missing table may be created later; don't pin that
+            _schema_cache[key] = cols
+    return cols
 
 def _students_pk_info(cursor: sqlite3.Cursor) -> dict:
+    key = (DB_PATH, "students:pk")
+    info = _schema_cache.get(key)
+    if info is not None:
+        return info
     cols = _table_columns(cursor, "students")
     has_id = "id" in cols
     has_student_id = "student_id" in cols
@@ -125,28 +434,47 @@ def _students_pk_info(cursor: sqlite3.Cursor) -> dict:
         pk_col = "id"
     else:
         pk_col = None
-    return {"has_id": has_id, "has_student_id": has_student_id, "pk_col": pk_col}
+    info = {"has_id": has_id, "has_student_id": has_student_id, "pk_col": pk_col}
+    if cols:
+        _schema_cache[key] = info
+    return info
 
 def _pk_select_expr(alias: str, info: dict) -> str:
-    if info["has_student_id"] and info["has_id"]:
-        return f"COALESCE({alias}.student_id, {alias}.id)"
-    if info["has_student_id"]:
-        return f"{alias}.student_id"
-    if info["has_id"]:
-        return f"{alias}.id"
-    return "NULL"
+    key = ("select", alias, info["has_id"], info["has_student_id"])
+    fragment = _sql_fragments.get(key)
+    if fragment is None:
+        if info["has_student_id"] and info["has_id"]:
+            fragment = f"COALESCE({alias}.student_id, {alias}.id)"
+        elif info["has_student_id"]:
+            fragment = f"{alias}.student_id"
+        elif info["has_id"]:
+            fragment = f"{alias}.id"
+        else:
+            fragment = "NULL"
+        _sql_fragments[key] = fragment
+    return fragment
 
 def _pk_join_condition(alias_s: str, alias_a: str, info: dict) -> str:
-    if info["has_student_id"] and info["has_id"]:
-        return f"(({alias_s}.student_id = {alias_a}.student_id) OR ({alias_s}.id = {alias_a}.student_id))"
-    if info["has_student_id"]:
-        return f"{alias_s}.student_id = {alias_a}.student_id"
-    if info["has_id"]:
-        return f"{alias_s}.id = {alias_a}.student_id"
-    return "1=0"
+    key = ("join", alias_s, alias_a, info["has_id"], info["has_student_id"])
+    fragment = _sql_fragments.get(key)
+    if fragment is None:
+        if info["has_student_id"] and info["has_id"]:
+            fragment = f"(({alias_s}.student_id = {alias_a}.student_id) OR ({alias_s}.id = {alias_a}.student_id))"
+        elif info["has_student_id"]:
+            fragment = f"{alias_s}.student_id = {alias_a}.student_id"
+        elif info["has_id"]:
+            fragment = f"{alias_s}.id = {alias_a}.student_id"
+        else:
+            fragment = "1=0"
+        _sql_fragments[key] = fragment
+    return fragment
 
 def _enrollment_columns(cursor: sqlite3.Cursor) -> Dict[str, Optional[str]]:
-    cols = _table_columns(cursor, "enrollments") if cursor else set()
+    key = (DB_PATH, "enrollments:layout")
+    layout = _schema_cache.get(key)
+    if layout is not None:
+        return layout
+    cols = _table_columns(cursor, "enrollments") if cursor else frozenset()
     student_col = None
     class_col = None
     if "student_id" in cols:
@@ -157,7 +485,10 @@ def _enrollment_columns(cursor: sqlite3.Cursor) -> Dict[str, Optional[str]]:
         class_col = "class_id"
     elif "classId" in cols:
         class_col = "classId"
-    return {"student": student_col, "class": class_col}
+    layout = {"student": student_col, "class": class_col}
+    if cols:
+        _schema_cache[key] = layout
+    return layout
 
 def _enrollment_join_condition(alias_s: str, alias_e: str, info: dict, enrollment_student_col: str) -> str:
     conditions: List[str] = []
@@ -182,6 +513,177 @@ def _normalize_source(value: Optional[str]) -> str:
         return "recognized"
     return lowered
 
+def _ensure_indexes(cursor: sqlite3.Cursor) -> None:
+    for name, table, columns in MANAGED_INDEXES:
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        existing = {row[1] for row in cursor.fetchall()}
+        if not set(columns) <= existing:
+            continue
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({column_list})')
+    cursor.execute("PRAGMA optimize")
+
+# Student search: a trigram FTS5 index over name, roll number and username, so
+# substring lookups ("%har%") hit an index instead of scanning. Queries shorter
+# than a trigram, or SQLite builds without FTS5, fall back to LIKE.
+STUDENT_SEARCH_MIN_LENGTH = 3
+
+
+def _ensure_student_search(cursor: sqlite3.Cursor) -> None:
+    try:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(name, roll_no, username, tokenize='trigram')"
+        )
+    except sqlite3.OperationalError as exc:
+        print(f"[init_db] student search index unavailable ({exc}); using LIKE")
+        return
+    cursor.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS students_search_insert AFTER INSERT ON students
+        BEGIN
+            INSERT INTO students_fts (rowid, name, roll_no, username)
+            VALUES (NEW.rowid, NEW.name, COALESCE(NEW.roll_no, NEW.rollNo), NEW.username);
+        END;
+        CREATE TRIGGER IF NOT EXISTS students_search_update AFTER UPDATE OF name, roll_no, rollNo, username ON students
+        BEGIN
+            DELETE FROM students_fts WHERE rowid = OLD.rowid;
+            INSERT INTO students_fts (rowid, name, roll_no, username)
+            VALUES (NEW.rowid, NEW.name, COALESCE(NEW.roll_no, NEW.rollNo), NEW.username);
+        END;
+        CREATE TRIGGER IF NOT EXISTS students_search_delete AFTER DELETE ON students
+        BEGIN
+            DELETE FROM students_fts WHERE rowid = OLD.rowid;
+        END;
+        """
+    )
+    # Backfill on first run, and resync if rows were written without the triggers.
+    cursor.execute("SELECT (SELECT COUNT(*) FROM students_fts) = (SELECT COUNT(*) FROM students)")
+    if not cursor.fetchone()[0]:
+        cursor.execute("DELETE FROM students_fts")
+        cursor.execute(
+            """
+            INSERT INTO students_fts (rowid, name, roll_no, username)
+            SELECT rowid, name, COALESCE(roll_no, rollNo), username FROM students
+            """
+        )
+
+def _student_search_sql(cursor: sqlite3.Cursor, text: str) -> Optional[Tuple[str, List[Any]]]:
+    """Subquery selecting the rowids of students matching ``text``, or None when FTS cannot answer it."""
+    if len(text) < STUDENT_SEARCH_MIN_LENGTH or not _table_columns(cursor, "students_fts"):
+        return None
+    phrase = '"' + text.replace('"', '""') + '"'
+    return "SELECT rowid FROM students_fts WHERE students_fts MATCH ?", [phrase]
+
+# attendance_logs totals per (day, source), kept by triggers in the same transaction
+# as every log write, so /api/attendance/summary reads a few rows per day instead
+# of aggregating the whole log. NULL source/day are stored as ''.
+LOG_ROLLUP_KEY = "COALESCE(date({row}.created_at), ''), COALESCE({row}.source, '')"
+LOG_ROLLUP_SUCCESS = "CASE WHEN {row}.matched = 1 THEN 1 ELSE 0 END"
+
+
+def _ensure_log_rollup(cursor: sqlite3.Cursor) -> None:
+    add = f"""
+        INSERT INTO attendance_log_rollup (day, source, attempts, successes)
+        VALUES ({LOG_ROLLUP_KEY.format(row="NEW")}, 1, {LOG_ROLLUP_SUCCESS.format(row="NEW")})
+        ON CONFLICT (day, source) DO UPDATE SET
+            attempts = attempts + 1,
+            successes = successes + excluded.successes;
+    """
+    remove = f"""
+        UPDATE attendance_log_rollup
+        SET attempts = attempts - 1, successes = successes - {LOG_ROLLUP_SUCCESS.format(row="OLD")}
+        WHERE (day, source) = ({LOG_ROLLUP_KEY.format(row="OLD")});
+    """
+    cursor.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS attendance_log_rollup (
+            day TEXT NOT NULL,
+            source TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            successes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, source)
+        ) WITHOUT ROWID;
+        CREATE TRIGGER IF NOT EXISTS attendance_logs_rollup_insert AFTER INSERT ON attendance_logs
+        BEGIN {add} END;
+        CREATE TRIGGER IF NOT EXISTS attendance_logs_rollup_update
+        AFTER UPDATE OF matched, source, created_at ON attendance_logs
+        BEGIN {remove} {add} END;
+        CREATE TRIGGER IF NOT EXISTS attendance_logs_rollup_delete AFTER DELETE ON attendance_logs
+        BEGIN {remove} END;
+        """
+    )
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM attendance_logs) AND NOT EXISTS (SELECT 1 FROM attendance_log_rollup)"
+    )
+    if cursor.fetchone()[0]:
+        _rebuild_log_rollup(cursor)
+
+def _rebuild_log_rollup(cursor: sqlite3.Cursor) -> int:
+    """Recompute attendance_log_rollup from attendance_logs; returns the number of rollup rows."""
+    cursor.execute("DELETE FROM attendance_log_rollup")
+    cursor.execute(
+        f"""
+        INSERT INTO attendance_log_rollup (day, source, attempts, successes)
+        SELECT {LOG_ROLLUP_KEY.format(row="l")}, COUNT(*), SUM({LOG_ROLLUP_SUCCESS.format(row="l")})
+        FROM attendance_logs AS l
+        GROUP BY 1, 2
+        """
+    )
+    return cursor.rowcount
+
+# Per-class roster version, bumped by triggers on every enrollments write (from
+# any connection), so cached class rosters can be revalidated with one lookup.
+def _ensure_roster_versions(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('PRAGMA table_info("enrollments")')
+    cols = {row[1] for row in cursor.fetchall()}
+    class_col = next((col for col in ("class_id", "classId") if col in cols), None)
+    student_col = next((col for col in ("student_id", "studentId") if col in cols), None)
+    if not class_col or not student_col:
+        return
+    bump = """
+        INSERT INTO roster_versions (class_id, version) VALUES ({row}."{col}", 1)
+        ON CONFLICT (class_id) DO UPDATE SET version = version + 1;
+    """
+    cursor.executescript(
+        f"""
+        CREATE TABLE IF NOT EXISTS roster_versions (
+            class_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TRIGGER IF NOT EXISTS enrollments_roster_insert AFTER INSERT ON enrollments
+        BEGIN {bump.format(row="NEW", col=class_col)} END;
+        CREATE TRIGGER IF NOT EXISTS enrollments_roster_update
+        AFTER UPDATE OF "{class_col}", "{student_col}" ON enrollments
+        BEGIN {bump.format(row="OLD", col=class_col)} {bump.format(row="NEW", col=class_col)} END;
+        CREATE TRIGGER IF NOT EXISTS enrollments_roster_delete AFTER DELETE ON enrollments
+        BEGIN {bump.format(row="OLD", col=class_col)} END;
+        """
+    )
+
+# Write counter per table behind the cached GET listings, bumped by triggers (from
+# any connection), so _ResponseCache can tell when a cached body went stale.
+LISTING_TABLES = ("students", "classes", "enrollments")
+
+
+def _ensure_table_versions(cursor: sqlite3.Cursor) -> None:
+    bump = """
+        INSERT INTO table_versions (name, version) VALUES ('{table}', 1)
+        ON CONFLICT (name) DO UPDATE SET version = version + 1;
+    """
+    script = """
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+    """
+    for table in LISTING_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            script += f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN {bump.format(table=table)} END;
+            """
+    cursor.executescript(script)
+
 def init_db() -> None:
     os.makedirs(DB_DIR, exist_ok=True)
     with closing(get_connection()) as conn:
@@ -237,6 +739,7 @@ def init_db() -> None:
             existing = {row[1] for row in cursor.fetchall()}
             if column not in existing:
                 cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {coltype}')
+                _invalidate_schema_cache()
 
         ensure_column("students", "course", "TEXT")
         ensure_column("students", "year", "INTEGER")
@@ -249,6 +752,44 @@ def init_db() -> None:
         ensure_column("students", "class_code", "TEXT")
         # Critical for joins in /attendance/latest etc.
         ensure_column("students", "student_id", "INTEGER")
+        # Embedding generations: the live vector + embedder version, the photo it came
+        # from, and the next-generation vector written by the re-embed job.
+        ensure_column("students", "embedding_version", "TEXT")
+        ensure_column("students", "photo_hash", "TEXT")
+        ensure_column("students", "embedding_next", "TEXT")
+        ensure_column("students", "embedding_next_version", "TEXT")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_settings (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        # students rows whose match-relevant fields changed, in commit order; the
+        # in-process gallery cache reloads just these rows (see _GalleryCache).
+        cursor.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_rowid INTEGER NOT NULL
+            );
+            CREATE TRIGGER IF NOT EXISTS students_gallery_insert AFTER INSERT ON students
+            BEGIN
+                INSERT INTO embedding_changes (student_rowid) VALUES (NEW.rowid);
+            END;
+            CREATE TRIGGER IF NOT EXISTS students_gallery_update
+            AFTER UPDATE OF embedding, embedding_version, name, username, roll_no, rollNo, student_id ON students
+            BEGIN
+                INSERT INTO embedding_changes (student_rowid) VALUES (NEW.rowid);
+            END;
+            CREATE TRIGGER IF NOT EXISTS students_gallery_delete AFTER DELETE ON students
+            BEGIN
+                INSERT INTO embedding_changes (student_rowid) VALUES (OLD.rowid);
+            END;
+            """
+        )
+        cursor.execute(
+            "DELETE FROM embedding_changes WHERE seq <= (SELECT MAX(seq) FROM embedding_changes) - ?",
+            (EMBEDDING_CHANGES_KEEP,),
+        )
+        _ensure_student_search(cursor)
+        _ensure_log_rollup(cursor)
         info = _students_pk_info(cursor)
         if info["has_student_id"] and info["has_id"]:
             cursor.execute("UPDATE students SET student_id = id WHERE student_id IS NULL")
@@ -297,8 +838,437 @@ def init_db() -> None:
             );
             """
         )
+        _ensure_roster_versions(cursor)
+        _ensure_table_versions(cursor)
+        _ensure_indexes(cursor)
 
         conn.commit()
+        # Tables may have been created or altered above: describe the final schema once.
+        _invalidate_schema_cache()
+        _students_pk_info(cursor)
+        _enrollment_columns(cursor)
+
+# ----------------------------
+# Audit log writer
+# ----------------------------
+class _AuditLogWriter:
+    """
+    attendance_logs / verification_logs rows written off the request path.
+
+    Requests enqueue rows; one thread drains the bounded queue and writes each
+    batch (up to AUDIT_LOG_BATCH_ROWS rows, or whatever arrived within
+    AUDIT_LOG_FLUSH_MS) in a single transaction. Until start() runs, or when the
+    queue is full, rows are written synchronously instead. Values SQLite cannot
+    store are turned into NULL at submit(). When a batch is rejected it is
+    retried row by row, and only the rows that still fail are appended to
+    AUDIT_LOG_SPILL_PATH and replayed on the next start. stop() (registered with
+    atexit, and run on SIGTERM) drains the queue before exit; rows still queued
+    when the process is killed without that are lost.
+    """
+
+    COLUMNS: Dict[str, Tuple[str, ...]] = {
+        "attendance_logs": ("student_id", "matched", "distance", "score", "source", "created_at"),
+        "verification_logs": ("subject_id", "distance", "score", "match", "threshold", "source", "created_at"),
+    }
+    BINDABLE = (type(None), int, float, str, bytes)
+
+    def __init__(self) -> None:
+        self.queue: "queue.Queue[Optional[Tuple[str, Tuple[Any, ...]]]]" = queue.Queue(maxsize=AUDIT_LOG_QUEUE_SIZE)
+        self.thread: Optional[threading.Thread] = None
+        self.spill_lock = threading.Lock()
+
+    def submit(self, table: str, rows: List[Tuple[Any, ...]]) -> None:
+        rows = [self._storable(table, row) for row in rows]
+        if self.thread is None or not self.thread.is_alive():
+            self._write([(table, row) for row in rows])
+            return
+        for index, row in enumerate(rows):
+            try:
+                self.queue.put_nowait((table, row))
+            except queue.Full:
+                self._write([(table, pending) for pending in rows[index:]])
+                return
+
+    def start(self) -> None:
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self._replay_spill()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        thread = self.thread
+        if thread is None or not thread.is_alive():
+            return
+        self.queue.put(None)
+        thread.join()
+
+    def flush(self) -> None:
+        """Block until every row submitted so far is written (or spilled)."""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            batch: List[Tuple[str, Tuple[Any, ...]]] = []
+            deadline = time.monotonic() + AUDIT_LOG_FLUSH_MS / 1000.0
+            stopping = item is None
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= AUDIT_LOG_BATCH_ROWS:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+            if batch:
+                self._write(batch)
+            for _ in range(len(batch) + (1 if stopping else 0)):
+                self.queue.task_done()
+            if stopping:
+                return
+
+    def _storable(self, table: str, row: Tuple[Any, ...]) -> Tuple[Any, ...]:
+        """`row` with values SQLite cannot bind (dicts, lists, ...) replaced by NULL."""
+        if all(isinstance(value, self.BINDABLE) for value in row):
+            return row
+        print(f"[audit-log] {table} row has unstorable values; storing them as NULL", flush=True)
+        return tuple(value if isinstance(value, self.BINDABLE) else None for value in row)
+
+    def _insert_sql(self, table: str) -> str:
+        columns = self.COLUMNS[table]
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def _write(self, batch: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        by_table: Dict[str, List[Tuple[Any, ...]]] = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        try:
+            with closing(get_connection()) as conn:
+                with conn:
+                    for table, rows in by_table.items():
+                        conn.executemany(self._insert_sql(table), rows)
+            return
+        except sqlite3.Error as exc:
+            print(f"[audit-log] batch of {len(batch)} rows failed ({exc}); retrying row by row", flush=True)
+        # One bad row must not take the rest of its batch down with it.
+        failed: List[Tuple[str, Tuple[Any, ...]]] = []
+        try:
+            with closing(get_connection()) as conn:
+                for table, row in batch:
+                    try:
+                        with conn:
+                            conn.execute(self._insert_sql(table), row)
+                    except sqlite3.Error as exc:
+                        print(f"[audit-log] {table} row rejected ({exc})", flush=True)
+                        failed.append((table, row))
+        except sqlite3.Error as exc:
+            print(f"[audit-log] database unavailable ({exc})", flush=True)
+            failed = batch
+        if failed:
+            print(f"[audit-log] spilling {len(failed)} rows", flush=True)
+            self._spill(failed)
+
+    def _spill(self, batch: List[Tuple[str, Tuple[Any, ...]]]) -> None:
+        with self.spill_lock:
+            os.makedirs(os.path.dirname(AUDIT_LOG_SPILL_PATH) or ".", exist_ok=True)
+            with open(AUDIT_LOG_SPILL_PATH, "a", encoding="utf-8") as handle:
+                for table, row in batch:
+                    handle.write(json.dumps([table, list(row)]) + "\n")
+                handle.flush()
+                os.fsync(handle.fileno())
+
+    def _replay_spill(self) -> None:
+        with self.spill_lock:
+            if not os.path.exists(AUDIT_LOG_SPILL_PATH):
+                return
+            replay_path = f"{AUDIT_LOG_SPILL_PATH}.replay"
+            os.replace(AUDIT_LOG_SPILL_PATH, replay_path)
+        with open(replay_path, encoding="utf-8") as handle:
+            batch = [
+                (table, self._storable(table, tuple(row)))
+                for table, row in (json.loads(line) for line in handle if line.strip())
+            ]
+        print(f"[audit-log] replaying {len(batch)} spilled rows", flush=True)
+        self._write(batch)
+        os.remove(replay_path)
+
+
+_audit_log = _AuditLogWriter()
+
+# ----------------------------
+# Live attendance feed
+# ----------------------------
+class _FeedSubscriber:
+    def __init__(self, class_id: Optional[int]) -> None:
+        self.class_id = class_id
+        self.buffer: "deque[Tuple[str, str, Dict[str, Any]]]" = deque()  # (event id, event type, data)
+        self.overrun = False
+
+
+class _AttendanceFeed:
+    """
+    In-process fan-out of attendance events to /api/attendance/stream clients.
+
+    publish() gives each event the next id, keeps it in a replay ring of
+    ATTENDANCE_FEED_REPLAY events and appends it to every matching subscriber's
+    buffer. A subscriber whose buffer reaches ATTENDANCE_FEED_CLIENT_BUFFER is
+    dropped; its EventSource reconnects with Last-Event-ID and catches up from
+    the ring. Ids carry a per-process epoch, so an id from before a restart (or
+    older than the ring) gets a "reset" event telling the client to reload.
+    Only writes handled by this process are published.
+    """
+
+    def __init__(self) -> None:
+        self.condition = threading.Condition()
+        self.epoch = format(time.time_ns() // 1000, "x")
+        self.seq = 0
+        self.replay: "deque[Tuple[int, Optional[int], str, Dict[str, Any]]]" = deque(maxlen=ATTENDANCE_FEED_REPLAY)
+        self.subscribers: Set[_FeedSubscriber] = set()
+
+    def publish(self, event: str, class_id: Optional[int], items: List[Dict[str, Any]]) -> None:
+        with self.condition:
+            for item in items:
+                self.seq += 1
+                self.replay.append((self.seq, class_id, event, item))
+                for subscriber in list(self.subscribers):
+                    if subscriber.class_id is not None and subscriber.class_id != class_id:
+                        continue
+                    if len(subscriber.buffer) >= ATTENDANCE_FEED_CLIENT_BUFFER:
+                        subscriber.overrun = True
+                        self.subscribers.discard(subscriber)
+                        continue
+                    subscriber.buffer.append((f"{self.epoch}-{self.seq}", event, item))
+            self.condition.notify_all()
+
+    def subscribe(self, class_id: Optional[int], last_event_id: Optional[str]) -> _FeedSubscriber:
+        """Register a subscriber, queueing the events it missed after `last_event_id`."""
+        subscriber = _FeedSubscriber(class_id)
+        with self.condition:
+            if last_event_id:
+                epoch, _, seq = last_event_id.partition("-")
+                oldest = self.replay[0][0] if self.replay else self.seq + 1
+                if epoch != self.epoch or not seq.isdigit() or int(seq) + 1 < oldest or int(seq) > self.seq:
+                    subscriber.buffer.append((f"{self.epoch}-{self.seq}", "reset", {}))
+                else:
+                    for event_seq, event_class, event, item in self.replay:
+                        if event_seq > int(seq) and (class_id is None or event_class == class_id):
+                            subscriber.buffer.append((f"{self.epoch}-{event_seq}", event, item))
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _FeedSubscriber) -> None:
+        with self.condition:
+            self.subscribers.discard(subscriber)
+
+    def stream(self, subscriber: _FeedSubscriber) -> Iterator[str]:
+        """text/event-stream chunks until the subscriber is dropped or the client goes away."""
+        try:
+            yield "retry: 2000\n\n"
+            while True:
+                with self.condition:
+                    if not subscriber.buffer and not subscriber.overrun:
+                        self.condition.wait(ATTENDANCE_FEED_HEARTBEAT)
+                    pending = list(subscriber.buffer)
+                    subscriber.buffer.clear()
+                    overrun = subscriber.overrun
+                if pending:
+                    yield "".join(
+                        f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+                        for event_id, event, data in pending
+                    )
+                elif not overrun:
+                    yield ": keepalive\n\n"
+                if overrun:
+                    return
+        finally:
+            self.unsubscribe(subscriber)
+
+
+_attendance_feed = _AttendanceFeed()
+
+
+def _feed_item(
+    student_id: Any,
+    matched: Optional[bool],
+    distance: Optional[float],
+    score: Optional[float],
+    source: str,
+    created_at: str,
+    student: Optional[Dict[str, Any]] = None,
+    **extra: Any,
+) -> Dict[str, Any]:
+    """An attendance_logs row as /api/attendance/latest lists it (without the row id)."""
+    student = student or {}
+    item = {
+        "studentId": student_id,
+        "studentName": student.get("name"),
+        "rollNo": student.get("roll_no"),
+        "username": student.get("username"),
+        "matched": matched,
+        "distance": distance,
+        "score": score,
+        "source": source,
+        "threshold": MATCH_THRESHOLD,
+        "createdAt": created_at,
+    }
+    item.update(extra)
+    return item
+
+
+def _feed_students(student_ids: List[Any]) -> Dict[Any, Dict[str, Any]]:
+    """
+    name / roll_no / username for the feed, keyed by student id. Read after the
+    attendance write has committed; the feed is decoration, so any failure here
+    just leaves the events without student details.
+    """
+    if not student_ids:
+        return {}
+    try:
+        with closing(get_connection(readonly=True)) as conn:
+            cursor = conn.cursor()
+            info = _students_pk_info(cursor)
+            if not info.get("pk_col"):
+                return {}
+            has_users = bool(_table_columns(cursor, "users"))
+            placeholders = ", ".join("?" for _ in student_ids)
+            conditions = [f"s.{col} IN ({placeholders})" for col in ("student_id", "id") if info[f"has_{col}"]]
+            cursor.execute(
+                f"""
+                SELECT
+                    {_pk_select_expr("s", info)} AS student_id,
+                    s.name,
+                    COALESCE(s.roll_no, s.rollNo) AS roll_no,
+                    {"COALESCE(s.username, u.username)" if has_users else "s.username"} AS username
+                FROM students AS s
+                {"LEFT JOIN users AS u ON u.user_id = s.user_id" if has_users else ""}
+                WHERE {" OR ".join(conditions)}
+                """,
+                list(student_ids) * len(conditions),
+            )
+            rows = cursor.fetchall()
+    except sqlite3.Error as exc:
+        print(f"[feed] student details unavailable: {exc}", flush=True)
+        return {}
+    wanted = set(student_ids)
+    return {row["student_id"]: dict(row) for row in rows if row["student_id"] in wanted}
+
+# ----------------------------
+# Response cache
+# ----------------------------
+class _ResponseCache:
+    """
+    Rendered 200 responses of read-mostly GET routes, keyed by path and query
+    arguments. Each entry carries a strong ETag (a hash of its body), so a
+    matching If-None-Match is answered 304 straight from memory; a recomputed
+    body that did not change keeps its ETag and still answers 304.
+
+    Entries are valid for one data version: the sum of the table_versions
+    counters the students, classes and enrollments triggers bump. Like
+    _GalleryCache, the cache polls PRAGMA data_version on its own connection and
+    rereads the counters only after some connection has committed, so writes
+    from other processes invalidate it as promptly as writes from this one.
+    Without table_versions (init_db not run) nothing is cached.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.db_path: Optional[str] = None
+        self.data_version: Optional[int] = None
+        self.version: Optional[int] = None
+        # (path, args) -> (etag, body, mimetype), all rendered at self.version
+        self.entries: "OrderedDict[Tuple[str, Tuple[Tuple[str, str], ...]], Tuple[str, bytes, str]]" = OrderedDict()
+        self.stats: Dict[str, Counter] = {}
+
+    def _current_version(self) -> Optional[int]:
+        """Called with the lock held; drops every entry when the version moves."""
+        if self.conn is None or self.db_path != DB_PATH:
+            if self.conn is not None:
+                self.conn.close()
+            os.makedirs(DB_DIR, exist_ok=True)
+            self.conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+            self.db_path = DB_PATH
+            self.data_version = None
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:
+            try:
+                version = self.conn.execute("SELECT COALESCE(SUM(version), 0) FROM table_versions").fetchone()[0]
+            except sqlite3.OperationalError:
+                version = None
+            if version is None or version != self.version:
+                self.entries.clear()
+            self.data_version = data_version
+            self.version = version
+        return self.version
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            routes = {path: dict(counts) for path, counts in self.stats.items()}
+            entries = len(self.entries)
+            version = self.version
+        hits = sum(counts.get("hits", 0) for counts in routes.values())
+        misses = sum(counts.get("misses", 0) for counts in routes.values())
+        return {
+            "version": version,
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "notModified": sum(counts.get("notModified", 0) for counts in routes.values()),
+            "hitRate": hits / (hits + misses) if hits + misses else None,
+            "routes": routes,
+        }
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args: Any, **kwargs: Any):
+            if RESPONSE_CACHE_SIZE <= 0:
+                return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            with self.lock:
+                version = self._current_version()
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                if version is not None:
+                    self.stats.setdefault(request.path, Counter())["hits" if entry else "misses"] += 1
+            if version is None:
+                return view(*args, **kwargs)
+            if entry is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = (hashlib.blake2b(body, digest_size=16).hexdigest(), body, response.mimetype)
+                with self.lock:
+                    # A write that landed while the view ran may not be in `body`.
+                    if self._current_version() == version:
+                        self.entries[key] = entry
+                        self.entries.move_to_end(key)
+                        while len(self.entries) > RESPONSE_CACHE_SIZE:
+                            self.entries.popitem(last=False)
+            etag, body, mimetype = entry
+            if request.if_none_match.contains(etag):
+                with self.lock:
+                    self.stats[request.path]["notModified"] += 1
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype=mimetype)
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+
+        return wrapper
+
+
+_response_cache = _ResponseCache()
 
 # ----------------------------
 # Utilities
@@ -312,20 +1282,118 @@ def _json_response(message: str, status: int = 200):
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
-# FaceNet embedding helpers
-def _facenet_embed_from_bytes(image_bytes: bytes, content_type: Optional[str]) -> List[float]:
-    """
-    Prefer multipart -> /embed_upload (recommended),
-    fallback to /embed with multipart if service only exposes /embed.
-    """
-    files = {"image": ("image", image_bytes, content_type or "application/octet-stream")}
+# Photo store
+def _photo_path(digest: str) -> str:
+    return os.path.join(PHOTO_STORE_DIR, digest[:2], digest)
+
+def _store_photo(blob: bytes) -> str:
+    """Save an enrollment photo under its SHA-256 and return the digest."""
+    digest = hashlib.sha256(blob).hexdigest()
+    path = _photo_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        with open(tmp_path, "wb") as handle:
+            handle.write(blob)
+        os.replace(tmp_path, path)
+    return digest
+
+def _read_photo(digest: str) -> bytes:
+    with open(_photo_path(digest), "rb") as handle:
+        return handle.read()
+
+def _data_url_bytes(value: str) -> bytes:
+    """Decode a data URL or bare (url-safe) base64 string."""
+    payload = value.strip()
+    if payload.startswith("data:"):
+        payload = payload.split(",", 1)[1]
+    payload = "".join(payload.split())
+    payload += "=" * (-len(payload) % 4)
+    return base64.urlsafe_b64decode(payload)
+
+def _image_field_bytes(value: Any) -> Tuple[bytes, str]:
+    """Decode a JSON image field (data URL or bare base64) once; returns (bytes, mimetype)."""
+    if not isinstance(value, str):
+        raise ValueError("image must be a base64 string")
+    mimetype = "image/jpeg"
+    header = value[:64].strip()
+    if header.startswith("data:") and ";" in header:
+        mimetype = header[5:header.index(";")] or mimetype
+    return _data_url_bytes(value), mimetype
+
+# Embedding storage: students.embedding / embedding_next hold
+#   b"EMB" | format byte (1) | uint32 LE dim | float32 LE values
+# Rows written before this format are JSON text until _migrate_embedding_blobs converts them.
+EMBEDDING_BLOB_MAGIC = b"EMB\x01"
+EMBEDDING_BLOB_HEADER = struct.Struct("<4sI")
+
+def _pack_embedding(vector: Any) -> bytes:
+    values = np.ascontiguousarray(vector, dtype="<f4").reshape(-1)
+    return EMBEDDING_BLOB_HEADER.pack(EMBEDDING_BLOB_MAGIC, len(values)) + values.tobytes()
+
+def _unpack_embedding(value: Any) -> Optional[np.ndarray]:
+    """Stored embedding as a read-only float32 view of the blob (no copy); None if empty or corrupt."""
+    if isinstance(value, (bytes, memoryview)):
+        if len(value) < EMBEDDING_BLOB_HEADER.size:
+            return None
+        magic, dim = EMBEDDING_BLOB_HEADER.unpack_from(value)
+        if magic != EMBEDDING_BLOB_MAGIC or len(value) != EMBEDDING_BLOB_HEADER.size + 4 * dim or not dim:
+            return None
+        return np.frombuffer(value, dtype="<f4", count=dim, offset=EMBEDDING_BLOB_HEADER.size)
+    if isinstance(value, str) and value:
+        try:
+            vector = np.asarray(json.loads(value), dtype=np.float32)
+        except (TypeError, ValueError):
+            return None
+        return vector if vector.ndim == 1 and len(vector) else None
+    return None
+
+# Embedding generations
+def _get_setting(cursor: sqlite3.Cursor, key: str) -> Optional[str]:
     try:
-        r = requests.post(f"{FACENET_URL}/embed_upload", files=files, timeout=30)
-        if r.status_code == 404:
-            r = requests.post(f"{FACENET_URL}/embed", files=files, timeout=30)
-    except requests.RequestException as exc:
-        raise RuntimeError(f"facenet service unavailable: {exc}") from exc
+        cursor.execute("SELECT value FROM embedding_settings WHERE key = ?", (key,))
+    except sqlite3.OperationalError:
+        return None
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _set_setting(cursor: sqlite3.Cursor, key: str, value: Optional[str]) -> None:
+    if value is None:
+        cursor.execute("DELETE FROM embedding_settings WHERE key = ?", (key,))
+    else:
+        cursor.execute(
+            "INSERT OR REPLACE INTO embedding_settings (key, value) VALUES (?, ?)", (key, value)
+        )
+
+def _active_embedder() -> Optional[str]:
+    """Embedder version the stored gallery is in; None means facenet's default."""
+    with closing(get_connection(readonly=True)) as conn:
+        return _get_setting(conn.cursor(), "active_embedder")
+
+def _record_embedding_source(
+    cursor: sqlite3.Cursor, pk_col: str, student_pk: Any, embedder: Optional[str], photo_hash: Optional[str]
+) -> None:
+    """Tag a freshly written embedding; any half-built next generation for it is now stale."""
+    try:
+        cursor.execute(
+            f"""
+            UPDATE students
+            SET embedding_version = ?, photo_hash = ?, embedding_next = NULL, embedding_next_version = NULL
+            WHERE "{pk_col}" = ?
+            """,
+            (embedder, photo_hash, student_pk),
+        )
+    except sqlite3.OperationalError:
+        pass  # legacy schema without generation columns (init_db not run yet)
+
+# FaceNet embedding helpers
+def _facenet_headers(device_id: Optional[str]) -> Dict[str, str]:
+    return {DEVICE_ID_HEADER: device_id} if device_id else {}
+
+def _facenet_params(embedder: Optional[str]) -> Dict[str, str]:
+    return {"embedder": embedder} if embedder else {}
 
+def _facenet_embedding_result(r: "requests.Response") -> Tuple[List[float], Optional[str]]:
     if r.status_code != 200:
         detail = r.text
         try:
@@ -338,100 +1406,389 @@ def _facenet_embed_from_bytes(image_bytes: bytes, content_type: Optional[str]) -
     embedding = data.get("embedding")
     if not isinstance(embedding, list) or not embedding:
         raise RuntimeError("facenet embed returned empty embedding")
-    return [float(v) for v in embedding]
-
-def _facenet_embed_from_data(image_value: str) -> List[float]:
-    payload = {"image": image_value}
+    return [float(v) for v in embedding], data.get("embedder")
+
+def _facenet_embed_from_bytes(
+    image_bytes: bytes,
+    content_type: Optional[str],
+    device_id: Optional[str] = None,
+    embedder: Optional[str] = None,
+) -> Tuple[List[float], Optional[str]]:
+    """
+    Prefer multipart -> /embed_upload (recommended), or /embed with multipart if
+    the service only exposes /embed (known from /health, so no 404 round trip).
+    Returns the embedding (a float32 array when facenet runs in-process) and the
+    embedder version that produced it.
+    """
+    if _facenet_local is not None:
+        try:
+            return _facenet_local.embed(image_bytes, embedder, device_id)
+        except ValueError as exc:
+            raise RuntimeError(f"facenet embed failed: {exc}") from exc
+    files = {"image": ("image", image_bytes, content_type or "application/octet-stream")}
     try:
-        r = requests.post(f"{FACENET_URL}/embed", json=payload, timeout=30)
+        r = _facenet.post_first(
+            ("/embed_upload", "/embed"),
+            files=files,
+            headers=_facenet_headers(device_id),
+            params=_facenet_params(embedder),
+            timeout=30,
+        )
     except requests.RequestException as exc:
         raise RuntimeError(f"facenet service unavailable: {exc}") from exc
+    return _facenet_embedding_result(r)
 
-    if r.status_code != 200:
-        detail = r.text
+def _facenet_embed_batch(
+    images: List[Tuple[str, bytes]], embedder: Optional[str] = None
+) -> Tuple[List[Optional[List[float]]], Dict[int, str], Optional[str]]:
+    """
+    Embed (filename, bytes) pairs in one /embed_batch call. Returns one embedding
+    per image (None where facenet could not decode it), facenet's per-index
+    errors, and the embedder version.
+    """
+    if _facenet_local is not None:
         try:
-            detail = json.dumps(r.json())
-        except Exception:
-            pass
-        raise RuntimeError(f"facenet embed failed ({r.status_code}): {detail}")
-
+            return _facenet_local.embed_batch([blob for _, blob in images], embedder)
+        except ValueError as exc:
+            raise RuntimeError(f"facenet embed_batch failed: {exc}") from exc
+    files = [("images", (filename, blob, "application/octet-stream")) for filename, blob in images]
+    try:
+        r = _facenet.post("/embed_batch", files=files, params=_facenet_params(embedder), timeout=120)
+    except requests.RequestException as exc:
+        raise RuntimeError(f"facenet service unavailable: {exc}") from exc
+    if r.status_code != 200:
+        raise RuntimeError(f"facenet embed_batch failed ({r.status_code}): {r.text}")
     data = r.json()
-    embedding = data.get("embedding")
-    if not isinstance(embedding, list) or not embedding:
-        raise RuntimeError("facenet embed returned empty embedding")
-    return [float(v) for v in embedding]
-
-def _cosine_distance(vector_a: Iterable[float], vector_b: Iterable[float]) -> float:
-    a = list(vector_a)
-    b = list(vector_b)
-    if len(a) != len(b) or not a:
-        return 1.0
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(y * y for y in b))
-    if norm_a == 0 or norm_b == 0:
-        return 1.0
-    cosine = max(min(dot / (norm_a * norm_b), 1.0), -1.0)
-    return 1.0 - cosine
-
-def _load_students_with_embeddings(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
-    info = _students_pk_info(cursor)
-    pk_expr = _pk_select_expr("s", info)
-    cursor.execute(
-        f"""
-        SELECT
-            {pk_expr} AS studentId,
-            COALESCE(s.username, u.username) AS username,
-            s.name,
-            COALESCE(s.roll_no, s.rollNo) AS roll_no,
-            COALESCE(s.embedding, '') AS embedding
-        FROM students AS s
-        LEFT JOIN users AS u ON u.user_id = s.user_id
+    embeddings = list(data.get("embeddings") or [])
+    embeddings += [None] * (len(images) - len(embeddings))
+    errors = {int(index): str(message) for index, message in (data.get("errors") or {}).items()}
+    return embeddings, errors, data.get("embedder")
+
+class _GalleryPartition:
+    """Unit-normalized embeddings of one (embedder version, dim), grown in place."""
+
+    def __init__(self, dim: int) -> None:
+        self.dim = dim
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.size = 0
+        self.rowids: List[int] = []
+        self.students: List[Dict[str, Any]] = []
+        self.rows: Dict[int, int] = {}  # students.rowid -> matrix row
+
+    def upsert(self, rowid: int, vector: np.ndarray, student: Dict[str, Any]) -> None:
+        row = self.rows.get(rowid)
+        if row is None:
+            if self.size == len(self.matrix):
+                grown = np.zeros((2 * len(self.matrix), self.dim), dtype=np.float32)
+                grown[: self.size] = self.matrix[: self.size]
+                self.matrix = grown
+            row = self.size
+            self.size += 1
+            self.rows[rowid] = row
+            self.rowids.append(rowid)
+            self.students.append(student)
+        else:
+            self.students[row] = student
+        self.matrix[row] = vector
+
+    def remove(self, rowid: int) -> None:
+        row = self.rows.pop(rowid, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            # Move the last row into the hole so the matrix stays dense.
+            moved = self.rowids[last]
+            self.matrix[row] = self.matrix[last]
+            self.rowids[row] = moved
+            self.students[row] = self.students[last]
+            self.rows[moved] = row
+        self.rowids.pop()
+        self.students.pop()
+        self.size = last
+
+
+class _ClassRoster:
+    """One class's enrolled students, with their rows copied out of the gallery partitions."""
+
+    def __init__(self, version: Optional[int], members: set) -> None:
+        self.version = version  # roster_versions.version when loaded
+        self.members = members  # students.rowid of every enrolled student, with or without a vector
+        self.data_version: Optional[int] = None  # PRAGMA data_version it was last validated at
+        self.partitions: Dict[Tuple[Optional[str], int], Tuple[np.ndarray, List[Dict[str, Any]]]] = {}
+
+
+class _GalleryCache:
+    """
+    Process-wide float32 copy of every stored embedding, for matching without a
+    full students scan and decode per frame.
+
+    Writers in this process call refresh() after commit. Before each lookup the
+    cache polls PRAGMA data_version on its own connection, which changes only
+    when some other connection (or process) has committed; it then reads the
+    embedding_changes rows written by the students triggers and reloads just
+    those students. A cache that fell behind the kept change log rebuilds.
+
+    Class-scoped lookups use a cached submatrix of the class roster, dropped when
+    one of its students' rows changes and reloaded when roster_versions shows an
+    enrollment change.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.db_path: Optional[str] = None
+        self.data_version: Optional[int] = None
+        self.change_seq: Optional[int] = None  # None forces a rebuild
+        self.partitions: Dict[Tuple[Optional[str], int], _GalleryPartition] = {}
+        self.placement: Dict[int, Tuple[Optional[str], int]] = {}  # rowid -> partition key
+        self.rosters: "OrderedDict[int, _ClassRoster]" = OrderedDict()
+
+    def refresh(self) -> None:
+        with self.lock:
+            self._sync()
+
+    def top_k(
+        self, embedding: List[float], embedder: Optional[str], k: int, class_id: Optional[int] = None
+    ) -> List[Tuple[Dict[str, Any], float]]:
         """
-    )
-    students: List[Dict[str, Any]] = []
-    for row in cursor.fetchall():
-        embedding_text = row["embedding"]
-        if not embedding_text:
-            continue
+        Students most cosine-similar to `embedding`, best first, as (student, similarity).
+        When `embedder` is given, only vectors from that version (or untagged legacy
+        vectors) are compared, since other versions are not comparable. With
+        `class_id`, only students enrolled in that class are candidates.
+        """
+        probe = _unit_rows(embedding)[0]
+        candidates: List[Tuple[float, Dict[str, Any]]] = []
+        with self.lock:
+            self._sync()
+            roster = self._roster(class_id) if class_id is not None else None
+            if roster is not None:
+                groups = roster.partitions.items()
+            else:
+                groups = (
+                    (key, (partition.matrix[: partition.size], partition.students))
+                    for key, partition in self.partitions.items()
+                )
+            for (version, dim), (matrix, students) in groups:
+                if dim != len(probe) or (embedder and version and version != embedder):
+                    continue
+                for row, similarity in _top_k_similar(matrix, probe, k):
+                    candidates.append((similarity, students[row]))
+        candidates.sort(key=lambda candidate: -candidate[0])
+        return [(student, similarity) for similarity, student in candidates[:k]]
+
+    def _sync(self) -> None:
+        if self.conn is None or self.db_path != DB_PATH:
+            if self.conn is not None:
+                self.conn.close()
+            os.makedirs(DB_DIR, exist_ok=True)
+            self.conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+            self.conn.row_factory = sqlite3.Row
+            self.db_path = DB_PATH
+            self.data_version = None
+            self.change_seq = None
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version and self.change_seq is not None:
+            return
+        self.conn.execute("BEGIN")
         try:
-            embedding = json.loads(embedding_text)
-        except json.JSONDecodeError:
-            continue
-        if not isinstance(embedding, list) or not embedding:
-            continue
-        students.append(
-            {
+            self._apply_changes()
+        finally:
+            self.conn.execute("COMMIT")
+        self.data_version = data_version
+
+    def _apply_changes(self) -> None:
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(seq), 0), COALESCE(MIN(seq), 1) FROM embedding_changes")
+        except sqlite3.OperationalError:
+            self._rebuild(cursor, 0)  # no change log yet (init_db not run): reload on every commit
+            return
+        last_seq, first_seq = cursor.fetchone()
+        if self.change_seq is None or self.change_seq < first_seq - 1:
+            self._rebuild(cursor, last_seq)
+            return
+        if last_seq == self.change_seq:
+            return
+        cursor.execute("SELECT DISTINCT student_rowid FROM embedding_changes WHERE seq > ?", (self.change_seq,))
+        rowids = {row[0] for row in cursor.fetchall()}
+        if len(rowids) > max(64, len(self.placement) // 4):
+            self._rebuild(cursor, last_seq)
+            return
+        placeholders = ", ".join("?" for _ in rowids)
+        loaded = self._load(cursor, f"WHERE s.rowid IN ({placeholders})", list(rowids))
+        for rowid in rowids - loaded:
+            self._remove(rowid)
+        for class_id in [cid for cid, roster in self.rosters.items() if not roster.members.isdisjoint(rowids)]:
+            del self.rosters[class_id]
+        self.change_seq = last_seq
+
+    def _rebuild(self, cursor: sqlite3.Cursor, last_seq: int) -> None:
+        self.partitions = {}
+        self.placement = {}
+        self.rosters.clear()
+        self._load(cursor, "", [])
+        self.change_seq = last_seq
+
+    def _load(self, cursor: sqlite3.Cursor, where: str, params: List[Any]) -> set:
+        """Upsert the matching students; returns the rowids that now hold a usable vector."""
+        info = _students_pk_info(cursor)
+        pk_expr = _pk_select_expr("s", info)
+        version_expr = (
+            "s.embedding_version" if "embedding_version" in _table_columns(cursor, "students") else "NULL"
+        )
+        cursor.execute(
+            f"""
+            SELECT
+                s.rowid AS row_id,
+                {pk_expr} AS studentId,
+                COALESCE(s.username, u.username) AS username,
+                s.name,
+                COALESCE(s.roll_no, s.rollNo) AS roll_no,
+                COALESCE(s.embedding, '') AS embedding,
+                {version_expr} AS embedding_version
+            FROM students AS s
+            LEFT JOIN users AS u ON u.user_id = s.user_id
+            {where}
+            """,
+            params,
+        )
+        loaded = set()
+        for row in cursor.fetchall():
+            rowid = row["row_id"]
+            vector = _unpack_embedding(row["embedding"])
+            if vector is None:
+                self._remove(rowid)
+                continue
+            key = (row["embedding_version"], len(vector))
+            if self.placement.get(rowid, key) != key:
+                self._remove(rowid)
+            partition = self.partitions.get(key)
+            if partition is None:
+                partition = self.partitions[key] = _GalleryPartition(len(vector))
+            student = {
                 "studentId": row["studentId"],
                 "username": row["username"],
                 "name": row["name"],
                 "roll_no": row["roll_no"],
-                "embedding": [float(v) for v in embedding],
+            }
+            partition.upsert(rowid, _unit_rows(vector)[0], student)
+            self.placement[rowid] = key
+            loaded.add(rowid)
+        return loaded
+
+    def _remove(self, rowid: int) -> None:
+        key = self.placement.pop(rowid, None)
+        if key is not None:
+            self.partitions[key].remove(rowid)
+
+    def _roster(self, class_id: int) -> Optional[_ClassRoster]:
+        """The class's cached roster, reloaded if its enrollments changed; None without an enrollments table."""
+        roster = self.rosters.get(class_id)
+        if roster is not None and roster.data_version == self.data_version:
+            self.rosters.move_to_end(class_id)
+            return roster
+        cursor = self.conn.cursor()
+        enrollment_cols = _enrollment_columns(cursor)
+        student_col, class_col = enrollment_cols.get("student"), enrollment_cols.get("class")
+        info = _students_pk_info(cursor)
+        if not student_col or not class_col or not info.get("pk_col"):
+            return None
+        # Version before members: a concurrent enrollment can only make the members newer.
+        try:
+            cursor.execute("SELECT version FROM roster_versions WHERE class_id = ?", (class_id,))
+            row = cursor.fetchone()
+            version: Optional[int] = row[0] if row else 0
+        except sqlite3.OperationalError:
+            version = None  # no roster_versions yet (init_db not run): reload on every commit
+        if roster is None or version is None or roster.version != version:
+            cursor.execute(
+                f"""
+                SELECT s.rowid FROM enrollments AS e
+                JOIN students AS s ON {_enrollment_join_condition("s", "e", info, student_col)}
+                WHERE e.{class_col} = ? AND {_pk_select_expr("s", info)} = e.{student_col}
+                """,
+                (class_id,),
+            )
+            roster = _ClassRoster(version, {row[0] for row in cursor.fetchall()})
+            rows: Dict[Tuple[Optional[str], int], List[int]] = {}
+            for rowid in roster.members:
+                key = self.placement.get(rowid)
+                if key is not None:
+                    rows.setdefault(key, []).append(self.partitions[key].rows[rowid])
+            for key, indexes in rows.items():
+                indexes.sort()
+                partition = self.partitions[key]
+                roster.partitions[key] = (partition.matrix[indexes], [partition.students[i] for i in indexes])
+            self.rosters[class_id] = roster
+        roster.data_version = self.data_version
+        self.rosters.move_to_end(class_id)
+        while len(self.rosters) > ROSTER_CACHE_SIZE:
+            self.rosters.popitem(last=False)
+        return roster
+
+
+_gallery_cache = _GalleryCache()
+
+def _top_k_similar(matrix: np.ndarray, probe: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """Rows of an L2-normalized `matrix` most cosine-similar to unit vector `probe`, best first."""
+    if not len(matrix) or k <= 0:
+        return []
+    similarities = matrix @ probe
+    if k < len(matrix):
+        top = np.argpartition(-similarities, k - 1)[:k]
+    else:
+        top = np.arange(len(matrix))
+    top = top[np.argsort(-similarities[top], kind="stable")]
+    return [(int(row), float(similarities[row])) for row in top]
+
+def _unit_rows(vectors: Any) -> np.ndarray:
+    matrix = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _find_near_duplicates(embedding: List[float], embedder: Optional[str]) -> List[Dict[str, Any]]:
+    """Enrolled students whose face is nearly identical to `embedding`."""
+    duplicates = []
+    for student, similarity in _gallery_cache.top_k(embedding, embedder, DUPLICATE_TOP_K):
+        if similarity < DUPLICATE_SIMILARITY:
+            break
+        duplicates.append(
+            {
+                "studentId": student["studentId"],
+                "name": student.get("name"),
+                "rollNo": student.get("roll_no"),
+                "similarity": round(similarity, 4),
             }
         )
-    return students
+    return duplicates
 
-def _extract_image_payload() -> Tuple[Optional[str], Optional[Dict[str, Any]], Optional[str]]:
-    """Return a data URL representation of the uploaded image or JSON payload."""
+def _extract_image_payload() -> Tuple[Optional[bytes], str, Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Return the raw image bytes, their mimetype and the request metadata.
+    Multipart uploads are passed through as-is; base64 is only decoded when the
+    client sent JSON, so no request is ever re-encoded on its way to facenet.
+    """
     if request.files:
         file = request.files.get('image') or request.files.get('photo')
         if not file:
-            return None, None, 'image file required'
-        data = base64.b64encode(file.read()).decode('utf-8')
-        mimetype = file.mimetype or 'image/jpeg'
+            return None, '', None, 'image file required'
         payload_meta: Dict[str, Any] = dict(request.form) if request.form else {}
-        return f'data:{mimetype};base64,{data}', payload_meta, None
+        return file.read(), file.mimetype or 'image/jpeg', payload_meta, None
 
     payload = request.get_json(force=True, silent=True)
     if not payload:
-        return None, None, 'invalid json'
+        return None, '', None, 'invalid json'
 
     image_value = payload.get('image') or payload.get('photo')
     if not image_value:
-        return None, None, "field 'image' is required"
-    if isinstance(image_value, str) and not image_value.startswith('data:'):
-        image_value = 'data:image/jpeg;base64,' + image_value
-    return image_value, payload, None
+        return None, '', None, "field 'image' is required"
+    try:
+        image_bytes, mimetype = _image_field_bytes(image_value)
+    except (ValueError, TypeError):
+        return None, '', None, 'image is not valid base64'
+    return image_bytes, mimetype, payload, None
 
 # ----------------------------
 # Routes
@@ -440,6 +1797,12 @@ def _extract_image_payload() -> Tuple[Optional[str], Optional[Dict[str, Any]], O
 def health():
     return jsonify({"ok": True})
 
+@app.route("/api/cache/stats", methods=["GET"])
+def response_cache_stats():
+    return jsonify(_response_cache.snapshot())
+
+STUDENT_REQUIRED_FIELDS = ["username", "password", "name", "email", "phone", "rollNo", "classCode", "course", "year"]
+
 @app.route("/api/register-student", methods=["POST"])
 def register_student():
     # Accept multipart (preferred) or JSON fallback with data URL/base64
@@ -454,22 +1817,25 @@ def register_student():
             return json_payload.get(field)
         return None
 
-    required_fields = ["username", "password", "name", "email", "phone", "rollNo", "classCode", "course", "year"]
-    missing = [field for field in required_fields if not _get(field)]
+    missing = [field for field in STUDENT_REQUIRED_FIELDS if not _get(field)]
     if missing:
         return jsonify({"error": f"missing fields: {', '.join(missing)}"}), 400
 
     # Photo handling
+    active_embedder = _active_embedder()
     photo = files.get("photo") if files else None
     if photo is None and json_payload is not None:
         photo_data = json_payload.get("photo")
         if photo_data:
             try:
-                if isinstance(photo_data, str) and photo_data.startswith("data:"):
-                    embedding = _facenet_embed_from_data(photo_data)
-                else:
-                    data_url = "data:image/jpeg;base64," + str(photo_data)
-                    embedding = _facenet_embed_from_data(data_url)
+                photo_bytes, photo_type = _image_field_bytes(str(photo_data))
+            except (ValueError, TypeError):
+                return jsonify({"error": "photo is not valid base64"}), 400
+            photo_hash = _store_photo(photo_bytes)
+            try:
+                embedding, embedding_version = _facenet_embed_from_bytes(
+                    photo_bytes, photo_type, embedder=active_embedder
+                )
             except RuntimeError as exc:
                 return jsonify({"error": str(exc)}), 502
         else:
@@ -477,8 +1843,13 @@ def register_student():
     elif photo is None:
         return jsonify({"error": "photo is required"}), 400
     else:
+        photo_bytes = photo.read()
+        photo_type = photo.mimetype or "image/jpeg"
+        photo_hash = _store_photo(photo_bytes)
         try:
-            embedding = _facenet_embed_from_bytes(photo.read(), photo.mimetype or "image/jpeg")
+            embedding, embedding_version = _facenet_embed_from_bytes(
+                photo_bytes, photo_type, embedder=active_embedder
+            )
         except RuntimeError as exc:
             return jsonify({"error": str(exc)}), 502
 
@@ -496,7 +1867,8 @@ def register_student():
     except (TypeError, ValueError):
         return jsonify({"error": "year must be a number"}), 400
 
-    embedding_json = json.dumps(embedding)
+    embedding_blob = _pack_embedding(embedding)
+    possible_duplicates = _find_near_duplicates(embedding, embedding_version)
 
     # Insert
     try:
@@ -504,6 +1876,20 @@ def register_student():
             cursor = conn.cursor()
             info = _students_pk_info(cursor)
             student_pk: Optional[int] = None
+            # A re-embed job may have switched the gallery while the photo was being
+            # embedded; re-read the setting under the write lock and redo the vector
+            # so nothing from the retired embedder lands after the cutover.
+            cursor.execute("BEGIN IMMEDIATE")
+            current_embedder = _get_setting(cursor, "active_embedder")
+            if current_embedder != active_embedder:
+                try:
+                    embedding, embedding_version = _facenet_embed_from_bytes(
+                        photo_bytes, photo_type, embedder=current_embedder
+                    )
+                except RuntimeError as exc:
+                    return jsonify({"error": str(exc)}), 502
+                embedding_blob = _pack_embedding(embedding)
+                possible_duplicates = _find_near_duplicates(embedding, embedding_version)
 
             # Optional users table
             try:
@@ -538,7 +1924,7 @@ def register_student():
                         class_code,
                         course,
                         year_value,
-                        embedding_json,
+                        embedding_blob,
                     ),
                 )
                 student_pk = cursor.lastrowid
@@ -560,7 +1946,7 @@ def register_student():
                         class_code,
                         course,
                         year_value,
-                        embedding_json,
+                        embedding_blob,
                     ),
                 )
                 student_pk = cursor.lastrowid
@@ -570,12 +1956,261 @@ def register_student():
                     "UPDATE students SET student_id = COALESCE(student_id, id) WHERE id = ?",
                     (student_pk,),
                 )
+            if student_pk is not None:
+                _record_embedding_source(cursor, "rowid", student_pk, embedding_version, photo_hash)
 
             conn.commit()
+        if student_pk is not None:
+            _gallery_cache.refresh()
+            _schedule_gallery_push("rowid", [student_pk])
     except sqlite3.IntegrityError as exc:
         return jsonify({"error": "student already exists", "detail": str(exc)}), 409
 
-    return jsonify({"username": username, "name": name, "rollNo": roll_no}), 201
+    return jsonify(
+        {"username": username, "name": name, "rollNo": roll_no, "possibleDuplicates": possible_duplicates}
+    ), 201
+
+# Bulk import
+_import_hash_pool = ThreadPoolExecutor(
+    max_workers=max(1, STUDENT_IMPORT_HASH_WORKERS), thread_name_prefix="import-hash"
+)
+STUDENT_IMPORT_COLUMNS = [
+    "user_id", "username", "password", "name", "email", "phone", "roll_no", "class_code",
+    "rollNo", "classCode", "course", "year", "embedding", "embedding_version", "photo_hash",
+]
+
+def _archive_photo_index(archive: zipfile.ZipFile) -> Dict[str, zipfile.ZipInfo]:
+    """Archive members by lower-cased file name and by stem, ignoring folders."""
+    index: Dict[str, zipfile.ZipInfo] = {}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        filename = os.path.basename(info.filename).lower()
+        if not filename or filename.startswith("."):
+            continue
+        index.setdefault(filename, info)
+        index.setdefault(os.path.splitext(filename)[0], info)
+    return index
+
+def _taken_usernames(cursor: sqlite3.Cursor, usernames: List[str]) -> set:
+    taken: set = set()
+    tables = ["students"] + (["users"] if _table_columns(cursor, "users") else [])
+    for start in range(0, len(usernames), 500):
+        chunk = usernames[start:start + 500]
+        placeholders = ", ".join("?" for _ in chunk)
+        for table in tables:
+            cursor.execute(f"SELECT username FROM {table} WHERE username IN ({placeholders})", chunk)
+            taken.update(row[0] for row in cursor.fetchall())
+    return taken
+
+def _import_embed_batch(
+    archive: zipfile.ZipFile, batch: List[Dict[str, Any]], embedder: Optional[str]
+) -> None:
+    """Read, store and embed one batch of import rows, setting "embedding" or "error" on each."""
+    images = []
+    for entry in batch:
+        try:
+            blob = archive.read(entry["photo"])
+        except (zipfile.BadZipFile, OSError, RuntimeError) as exc:
+            entry["error"] = f"photo unreadable: {exc}"
+            continue
+        entry["photo_hash"] = _store_photo(blob)
+        images.append((entry, blob))
+    if not images:
+        return
+    try:
+        embeddings, errors, version = _facenet_embed_batch(
+            [(entry["photo"].filename, blob) for entry, blob in images], embedder
+        )
+    except RuntimeError as exc:
+        for entry, _ in images:
+            entry["error"] = str(exc)
+        return
+    for index, ((entry, _), vector) in enumerate(zip(images, embeddings)):
+        if vector is not None:
+            entry["embedding"] = vector
+            entry["embedding_version"] = version
+        else:
+            entry["error"] = errors.get(index) or "facenet returned no embedding"
+
+def _insert_import_rows(cursor: sqlite3.Cursor, entries: List[Dict[str, Any]]) -> Dict[str, Tuple[int, Any]]:
+    """Insert validated import rows (and their users); username -> (rowid, student id)."""
+    columns = _table_columns(cursor, "students")
+    info = _students_pk_info(cursor)
+    has_users = bool(_table_columns(cursor, "users"))
+    if has_users:
+        cursor.executemany(
+            "INSERT INTO users (username, password_hash, role) VALUES (?, ?, 'student')",
+            [(entry["fields"]["username"], entry["password_hash"]) for entry in entries],
+        )
+    insert_columns = [column for column in STUDENT_IMPORT_COLUMNS if column in columns]
+    placeholders = [
+        "(SELECT MAX(user_id) FROM users WHERE username = ?)" if column == "user_id" else "?"
+        for column in insert_columns
+    ]
+    records = []
+    for entry in entries:
+        fields = entry["fields"]
+        values = {
+            "user_id": fields["username"] if has_users else None,
+            "username": fields["username"],
+            "password": entry["password_hash"],
+            "name": fields["name"],
+            "email": fields["email"],
+            "phone": fields["phone"],
+            "roll_no": fields["rollNo"],
+            "class_code": fields["classCode"],
+            "rollNo": fields["rollNo"],
+            "classCode": fields["classCode"],
+            "course": fields["course"],
+            "year": entry["year"],
+            "embedding": _pack_embedding(entry["embedding"]),
+            "embedding_version": entry["embedding_version"],
+            "photo_hash": entry["photo_hash"],
+        }
+        records.append([values[column] for column in insert_columns])
+    cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM students")
+    first_rowid = cursor.fetchone()[0]
+    cursor.executemany(
+        f"""
+        INSERT INTO students ({", ".join(f'"{column}"' for column in insert_columns)})
+        VALUES ({", ".join(placeholders)})
+        """,
+        records,
+    )
+    if info["has_student_id"] and info["has_id"]:
+        cursor.execute(
+            "UPDATE students SET student_id = COALESCE(student_id, id) WHERE rowid > ?",
+            (first_rowid,),
+        )
+    pk_expr = _pk_select_expr("s", info)
+    cursor.execute(
+        f"SELECT s.rowid AS row_id, s.username, {pk_expr} AS sid FROM students AS s WHERE s.rowid > ?",
+        (first_rowid,),
+    )
+    return {row["username"]: (row["row_id"], row["sid"]) for row in cursor.fetchall()}
+
+@app.route("/api/students/import", methods=["POST"])
+def import_students():
+    """
+    Register many students at once. Multipart fields: `csv` (one row per student,
+    register-student's fields as columns plus an optional `photo` column naming a
+    file in the archive; otherwise <username>.* or <rollNo>.* is used) and `photos`
+    (a zip). Rows are validated and embedded independently, then every good row is
+    inserted in one transaction (row by row if one of them conflicts with an
+    existing record); the response has one result per CSV row.
+    """
+    csv_file = request.files.get("csv") or request.files.get("file")
+    archive_file = request.files.get("photos") or request.files.get("archive")
+    if not csv_file or not archive_file:
+        return jsonify({"error": "multipart fields 'csv' and 'photos' (zip) are required"}), 400
+    try:
+        rows = list(csv.DictReader(io.TextIOWrapper(csv_file.stream, encoding="utf-8-sig", newline="")))
+    except (UnicodeDecodeError, csv.Error) as exc:
+        return jsonify({"error": f"csv could not be parsed: {exc}"}), 400
+    if not rows:
+        return jsonify({"error": "csv has no rows"}), 400
+    if len(rows) > STUDENT_IMPORT_MAX_ROWS:
+        return jsonify({"error": f"at most {STUDENT_IMPORT_MAX_ROWS} rows per import"}), 413
+    try:
+        archive = zipfile.ZipFile(archive_file.stream)
+    except zipfile.BadZipFile:
+        return jsonify({"error": "photos must be a zip archive"}), 400
+    photos = _archive_photo_index(archive)
+
+    results: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+    seen: set = set()
+    for line, row in enumerate(rows, start=2):  # line 1 is the header
+        fields = {field: (row.get(field) or "").strip() for field in STUDENT_REQUIRED_FIELDS + ["photo"]}
+        result: Dict[str, Any] = {"row": line, "username": fields["username"], "status": "error"}
+        results.append(result)
+        missing = [field for field in STUDENT_REQUIRED_FIELDS if not fields[field]]
+        if missing:
+            result["error"] = f"missing fields: {', '.join(missing)}"
+            continue
+        try:
+            year_value = int(fields["year"])
+        except ValueError:
+            result["error"] = "year must be a number"
+            continue
+        if fields["username"] in seen:
+            result["error"] = "username repeated in csv"
+            continue
+        seen.add(fields["username"])
+        photo = (
+            photos.get(os.path.basename(fields["photo"]).lower())
+            or photos.get(fields["username"].lower())
+            or photos.get(fields["rollNo"].lower())
+        )
+        if photo is None:
+            result["error"] = "photo not found in archive"
+            continue
+        if photo.file_size > STUDENT_IMPORT_MAX_PHOTO_BYTES:
+            result["error"] = "photo is too large"
+            continue
+        pending.append(
+            {"result": result, "fields": fields, "password": row.get("password") or "", "year": year_value, "photo": photo}
+        )
+
+    if pending:
+        with closing(get_connection(readonly=True)) as conn:
+            taken = _taken_usernames(conn.cursor(), [entry["fields"]["username"] for entry in pending])
+        for entry in pending:
+            if entry["fields"]["username"] in taken:
+                entry["result"]["error"] = "username already exists"
+        pending = [entry for entry in pending if entry["fields"]["username"] not in taken]
+
+    if pending:
+        active_embedder = _active_embedder()
+        hashes = _import_hash_pool.map(_password_hash, [entry["password"] for entry in pending])
+        batches = [pending[i:i + STUDENT_IMPORT_BATCH_SIZE] for i in range(0, len(pending), STUDENT_IMPORT_BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(1, STUDENT_IMPORT_EMBED_WORKERS)) as pool:
+            list(pool.map(lambda batch: _import_embed_batch(archive, batch, active_embedder), batches))
+        for entry, password_hash in zip(pending, hashes):
+            entry["password_hash"] = password_hash
+
+    ready = [entry for entry in pending if "error" not in entry]
+    for entry in pending:
+        if "error" in entry:
+            entry["result"]["error"] = entry["error"]
+    for entry in ready:
+        entry["duplicates"] = _find_near_duplicates(entry["embedding"], entry["embedding_version"])
+
+    created: List[int] = []
+    if ready:
+        try:
+            with _request_transaction() as conn:
+                inserted = _insert_import_rows(conn.cursor(), ready)
+        except sqlite3.IntegrityError:
+            # A row collides with a student or user written since the username check:
+            # insert row by row and report only the rows that conflict.
+            inserted = {}
+            with _request_transaction() as conn:
+                cursor = conn.cursor()
+                for entry in ready:
+                    cursor.execute("SAVEPOINT import_row")
+                    try:
+                        inserted.update(_insert_import_rows(cursor, [entry]))
+                    except sqlite3.IntegrityError as exc:
+                        cursor.execute("ROLLBACK TO import_row")
+                        entry["result"]["error"] = f"conflicts with an existing record: {exc}"
+                    cursor.execute("RELEASE import_row")
+        for entry in ready:
+            if entry["fields"]["username"] not in inserted:
+                continue
+            rowid, student_pk = inserted[entry["fields"]["username"]]
+            created.append(rowid)
+            entry["result"].update(
+                {"status": "created", "studentId": student_pk, "possibleDuplicates": entry["duplicates"]}
+            )
+    if created:
+        _gallery_cache.refresh()
+        _schedule_gallery_push("rowid", created)
+
+    return jsonify(
+        {"imported": len(created), "failed": len(results) - len(created), "rows": results}
+    ), (201 if created else 400)
 
 @app.route("/api/students/<int:student_id>/embedding", methods=["POST", "PATCH"])
 def update_student_embedding(student_id: int):
@@ -595,12 +2230,16 @@ def update_student_embedding(student_id: int):
     if not pk_col:
         return jsonify({"error": "students table has no PK column (id or student_id)"}), 500
 
+    active_embedder = _active_embedder()
     if request.files:
         file = request.files.get("photo") or request.files.get("image")
         if not file:
             return jsonify({"error": "photo file required"}), 400
+        photo_bytes = file.read()
+        photo_type = file.mimetype or "image/jpeg"
+        photo_hash = _store_photo(photo_bytes)
         try:
-            emb = _facenet_embed_from_bytes(file.read(), file.mimetype or "image/jpeg")
+            emb, emb_version = _facenet_embed_from_bytes(photo_bytes, photo_type, embedder=active_embedder)
         except RuntimeError as exc:
             return jsonify({"error": str(exc)}), 502
     else:
@@ -610,20 +2249,34 @@ def update_student_embedding(student_id: int):
         image_value = payload.get("photo") or payload.get("image")
         if not image_value:
             return jsonify({"error": "photo is required"}), 400
-        if isinstance(image_value, str) and not image_value.startswith("data:"):
-            image_value = "data:image/jpeg;base64," + image_value
         try:
-            emb = _facenet_embed_from_data(image_value)
+            photo_bytes, photo_type = _image_field_bytes(image_value)
+        except (ValueError, TypeError):
+            return jsonify({"error": "photo is not valid base64"}), 400
+        photo_hash = _store_photo(photo_bytes)
+        try:
+            emb, emb_version = _facenet_embed_from_bytes(photo_bytes, photo_type, embedder=active_embedder)
         except RuntimeError as exc:
             return jsonify({"error": str(exc)}), 502
 
     with closing(get_connection()) as conn:
         cur = conn.cursor()
+        # Same cutover check as register_student.
+        cur.execute("BEGIN IMMEDIATE")
+        current_embedder = _get_setting(cur, "active_embedder")
+        if current_embedder != active_embedder:
+            try:
+                emb, emb_version = _facenet_embed_from_bytes(photo_bytes, photo_type, embedder=current_embedder)
+            except RuntimeError as exc:
+                return jsonify({"error": str(exc)}), 502
         cur.execute(
             f'UPDATE students SET embedding = ? WHERE "{pk_col}" = ?',
-            (json.dumps(emb), student_id),
+            (_pack_embedding(emb), student_id),
         )
+        _record_embedding_source(cur, pk_col, student_id, emb_version, photo_hash)
         conn.commit()
+    _gallery_cache.refresh()
+    _schedule_gallery_push(pk_col, [student_id])
 
     return jsonify({"ok": True, "studentId": student_id})
 
@@ -684,6 +2337,7 @@ def register_teacher():
     return _json_response("teacher registered", 201)
 
 @app.route("/api/students", methods=["GET"])
+@_response_cache.cached
 def list_students():
     class_id_value = request.args.get("classId")
     class_id: Optional[int]
@@ -694,8 +2348,9 @@ def list_students():
             class_id = int(class_id_value)
         except (TypeError, ValueError):
             return jsonify({"error": "classId must be an integer"}), 400
+    search_text = (request.args.get("q") or request.args.get("search") or "").strip()
 
-    with closing(get_connection()) as conn:
+    with closing(get_connection(readonly=True)) as conn:
         cursor = conn.cursor()
         info = _students_pk_info(cursor)
         pk_col = info.get("pk_col")
@@ -706,6 +2361,21 @@ def list_students():
         select_user = "u.username AS user_username" if has_user_id else "NULL AS user_username"
         join_users = "LEFT JOIN users AS u ON u.user_id = s.user_id" if has_user_id else ""
 
+        search_clause = ""
+        search_params: List[Any] = []
+        if search_text:
+            search = _student_search_sql(cursor, search_text)
+            if search is not None:
+                search_clause = f" AND s.rowid IN ({search[0]})"
+                search_params = search[1]
+            else:
+                like_value = f"%{search_text.lower()}%"
+                search_clause = (
+                    " AND (LOWER(COALESCE(s.name, '')) LIKE ? OR LOWER(COALESCE(s.roll_no, s.rollNo, '')) LIKE ?"
+                    " OR LOWER(COALESCE(s.username, '')) LIKE ?)"
+                )
+                search_params = [like_value, like_value, like_value]
+
         rows = []
         if class_id is not None:
             enrollment_cols = _enrollment_columns(cursor)
@@ -720,12 +2390,12 @@ def list_students():
             enrolled_ids = [row["student_id"] for row in cursor.fetchall() if row["student_id"] is not None]
             if enrolled_ids:
                 placeholders = ",".join(["?"] * len(enrolled_ids))
-                query = f"SELECT s.*, {select_user} FROM students AS s {join_users} WHERE s.{pk_col} IN ({placeholders}) ORDER BY s.name ASC"
-                cursor.execute(query, enrolled_ids)
+                query = f"SELECT s.*, {select_user} FROM students AS s {join_users} WHERE s.{pk_col} IN ({placeholders}){search_clause} ORDER BY s.name ASC"
+                cursor.execute(query, enrolled_ids + search_params)
                 rows = cursor.fetchall()
         else:
-            query = f"SELECT s.*, {select_user} FROM students AS s {join_users} ORDER BY s.name ASC"
-            cursor.execute(query)
+            query = f"SELECT s.*, {select_user} FROM students AS s {join_users} WHERE 1 = 1{search_clause} ORDER BY s.name ASC"
+            cursor.execute(query, search_params)
             rows = cursor.fetchall()
 
     students: List[Dict[str, Optional[str]]] = []
@@ -827,7 +2497,7 @@ def attendance_manual():
     if not normalized_records:
         return jsonify({"error": "no valid attendance records supplied"}), 400
 
-    with closing(get_connection()) as conn:
+    with _request_transaction() as conn:
         cursor = conn.cursor()
         enrollment_cols = _enrollment_columns(cursor)
         student_col = enrollment_cols.get("student")
@@ -847,29 +2517,36 @@ def attendance_manual():
         if missing:
             return jsonify({"error": "students not enrolled in class", "invalidStudentIds": missing}), 400
 
-        created = 0
-        updated = 0
-        status_counter: Counter[str] = Counter()
+        status_counter: Counter[str] = Counter(record["status"] for record in normalized_records)
         now_iso = _now_iso()
+        source_value = _normalize_source("manual")
 
-        for record in normalized_records:
-            status_counter[record["status"]] += 1
-            cursor.execute(
+        # Rows that already exist are updated by the upsert below; every other
+        # record creates one (a student listed twice creates once, then updates).
+        student_ids = sorted({record["student_id"] for record in normalized_records})
+        placeholders = ", ".join("?" for _ in student_ids)
+        cursor.execute(
+            f"""
+            SELECT COUNT(DISTINCT student_id) FROM attendance
+            WHERE class_id = ? AND date = ? AND student_id IN ({placeholders})
+            """,
+            (class_id, date_str, *student_ids),
+        )
+        created = len(student_ids) - cursor.fetchone()[0]
+        updated = len(normalized_records) - created
+
+        if not _attendance_has_unique_key(cursor):
+            # No unique index to upsert against (duplicate rows, see
+            # _ensure_attendance_unique_key): update every existing row, then
+            # insert the students that have none. The last record per student wins.
+            latest = list({record["student_id"]: record for record in normalized_records}.values())
+            cursor.executemany(
                 """
-                SELECT id FROM attendance
+                UPDATE attendance
+                SET time = ?, status = ?, recognized_name = ?, source = ?, remark = ?, updated_at = ?
                 WHERE class_id = ? AND student_id = ? AND date = ?
                 """,
-                (class_id, record["student_id"], date_str),
-            )
-            existing = cursor.fetchone()
-            source_value = _normalize_source("manual")
-            if existing:
-                cursor.execute(
-                    """
-                    UPDATE attendance
-                    SET time = ?, status = ?, recognized_name = ?, source = ?, remark = ?, updated_at = ?
-                    WHERE id = ?
-                    """,
+                [
                     (
                         time_str,
                         record["status"],
@@ -877,17 +2554,24 @@ def attendance_manual():
                         source_value,
                         record["remark"],
                         now_iso,
-                        existing["id"],
-                    ),
+                        class_id,
+                        record["student_id"],
+                        date_str,
+                    )
+                    for record in latest
+                ],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO attendance (
+                    student_id, class_id, date, time, status, recognized_name, source, remark, created_at, updated_at
                 )
-                updated += 1
-            else:
-                cursor.execute(
-                    """
-                    INSERT INTO attendance (
-                        student_id, class_id, date, time, status, recognized_name, source, remark, created_at, updated_at
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM attendance WHERE class_id = ? AND student_id = ? AND date = ?
+                )
+                """,
+                [
                     (
                         record["student_id"],
                         class_id,
@@ -899,27 +2583,77 @@ def attendance_manual():
                         record["remark"],
                         now_iso,
                         now_iso,
-                    ),
-                )
-                created += 1
-
-            matched = 1 if record["status"] == "present" else 0
-            cursor.execute(
+                        class_id,
+                        record["student_id"],
+                        date_str,
+                    )
+                    for record in latest
+                ],
+            )
+        else:
+            cursor.executemany(
                 """
-                INSERT INTO attendance_logs (student_id, matched, distance, score, source, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
+                INSERT INTO attendance (
+                    student_id, class_id, date, time, status, recognized_name, source, remark, created_at, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (class_id, student_id, date) DO UPDATE SET
+                    time = excluded.time,
+                    status = excluded.status,
+                    recognized_name = excluded.recognized_name,
+                    source = excluded.source,
+                    remark = excluded.remark,
+                    updated_at = excluded.updated_at
                 """,
-                (
-                    record["student_id"],
-                    matched,
-                    None,
-                    1.0 if matched else 0.0,
-                    "manual",
-                    now_iso,
-                ),
+                [
+                    (
+                        record["student_id"],
+                        class_id,
+                        date_str,
+                        time_str,
+                        record["status"],
+                        record["recognized_name"],
+                        source_value,
+                        record["remark"],
+                        now_iso,
+                        now_iso,
+                    )
+                    for record in normalized_records
+                ],
             )
 
-        conn.commit()
+    _audit_log.submit(
+        "attendance_logs",
+        [
+            (
+                record["student_id"],
+                1 if record["status"] == "present" else 0,
+                None,
+                1.0 if record["status"] == "present" else 0.0,
+                "manual",
+                now_iso,
+            )
+            for record in normalized_records
+        ],
+    )
+    students = _feed_students(student_ids)
+    _attendance_feed.publish(
+        "attendance_manual",
+        class_id,
+        [
+            _feed_item(
+                record["student_id"],
+                record["status"] == "present",
+                None,
+                1.0 if record["status"] == "present" else 0.0,
+                "manual",
+                now_iso,
+                students.get(record["student_id"]),
+                classId=class_id,
+                status=record["status"],
+            )
+            for record in normalized_records
+        ],
+    )
 
     response = {
         "classId": class_id,
@@ -935,6 +2669,7 @@ def attendance_manual():
 
 # >>> NEW: /api/class-students — returns only the enrolled students for a class
 @app.route("/api/class-students", methods=["GET"])
+@_response_cache.cached
 def class_students_api():
     class_id_param = request.args.get("class_id") or request.args.get("classId")
     try:
@@ -942,7 +2677,7 @@ def class_students_api():
     except (TypeError, ValueError):
         return jsonify({"ok": False, "error": "class_id is required and must be an integer"}), 400
 
-    with closing(get_connection()) as conn:
+    with closing(get_connection(readonly=True)) as conn:
         cursor = conn.cursor()
 
         # fetch students enrolled in class
@@ -966,6 +2701,7 @@ def class_students_api():
     return jsonify({"ok": True, "data": {"students": students}})
 
 @app.route("/api/classes", methods=["GET"])
+@_response_cache.cached
 def list_classes_api():
     # >>> NEW: back-compat for /api/classes?class_id=..&with_students=1
     class_id_param = request.args.get("class_id") or request.args.get("classId")
@@ -977,7 +2713,7 @@ def list_classes_api():
         except (TypeError, ValueError):
             return jsonify({"ok": False, "error": "class_id must be an integer"}), 400
 
-        with closing(get_connection()) as conn:
+        with closing(get_connection(readonly=True)) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -1024,7 +2760,7 @@ def list_classes_api():
         )
 
     # default: list all classes
-    with closing(get_connection()) as conn:
+    with closing(get_connection(readonly=True)) as conn:
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -1119,6 +2855,135 @@ def create_class_api():
     return jsonify({"class": created}), 201
 
 
+def _enrollment_keys(payload: Dict[str, Any]) -> Tuple[List[int], List[str], Optional[str]]:
+    """Distinct student ids and roll numbers from an enrollments payload, in request order."""
+    id_values = payload.get("studentIds") or []
+    roll_values = payload.get("rollNos") or []
+    if not isinstance(id_values, list) or not isinstance(roll_values, list):
+        return [], [], "studentIds and rollNos must be lists"
+    student_ids: Dict[int, None] = {}
+    for value in id_values:
+        try:
+            student_ids[int(value)] = None
+        except (TypeError, ValueError):
+            return [], [], f"invalid studentId: {value!r}"
+    roll_nos = {str(value).strip(): None for value in roll_values if str(value or "").strip()}
+    return list(student_ids), list(roll_nos), None
+
+def _resolve_enrollment_keys(
+    cursor: sqlite3.Cursor, student_ids: List[int], roll_nos: List[str]
+) -> Tuple[Dict[Tuple[str, Any], set], List[Tuple[str, Any]]]:
+    """
+    Students matching each key, found with one join against a temp table of the
+    keys (student ids match the PK expression, roll numbers either roll column).
+    Returns ({(kind, key): student ids}, keys in input order).
+    """
+    info = _students_pk_info(cursor)
+    student_cols = _table_columns(cursor, "students")
+    keys = [("studentId", value) for value in student_ids] + [("rollNo", value) for value in roll_nos]
+    cursor.execute("CREATE TEMP TABLE enrollment_keys (position INTEGER PRIMARY KEY, student_key INTEGER, roll_no TEXT)")
+    cursor.executemany(
+        "INSERT INTO temp.enrollment_keys (student_key, roll_no) VALUES (?, ?)",
+        [(value, None) if kind == "studentId" else (None, value) for kind, value in keys],
+    )
+    # Each OR term can use an index; the WHERE keeps the same precedence as the rest
+    # of the app (COALESCE(student_id, id), COALESCE(roll_no, rollNo)).
+    roll_cols = [f"s.{col}" for col in ("roll_no", "rollNo") if col in student_cols]
+    matches = [f"s.{col} = k.student_key" for col in ("student_id", "id") if info[f"has_{col}"]]
+    matches += [f"{col} = k.roll_no" for col in roll_cols]
+    roll_expr = roll_cols[0] if len(roll_cols) == 1 else f"COALESCE({', '.join(roll_cols)})"
+    pk_expr = _pk_select_expr("s", info)
+    resolved: Dict[Tuple[str, Any], set] = {}
+    if info.get("pk_col"):
+        cursor.execute(
+            f"""
+            SELECT k.position, {pk_expr} AS student_id
+            FROM temp.enrollment_keys AS k
+            JOIN students AS s ON {" OR ".join(matches)}
+            WHERE {pk_expr} = k.student_key{f" OR {roll_expr} = k.roll_no" if roll_cols else ""}
+            """
+        )
+        for row in cursor.fetchall():
+            resolved.setdefault(keys[row["position"] - 1], set()).add(row["student_id"])
+    cursor.execute("DROP TABLE temp.enrollment_keys")
+    return resolved, keys
+
+@app.route("/api/classes/<int:class_id>/enrollments", methods=["POST", "DELETE"])
+def class_enrollments_api(class_id: int):
+    """
+    Enroll (POST) or unenroll (DELETE) students in bulk: {"studentIds": [...],
+    "rollNos": [...]}. All keys are resolved in one query and applied in one
+    transaction; keys that match no student (or a roll number shared by several)
+    are reported and skipped.
+    """
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "invalid json"}), 400
+    student_ids, roll_nos, error = _enrollment_keys(payload)
+    if error:
+        return jsonify({"error": error}), 400
+    if not student_ids and not roll_nos:
+        return jsonify({"error": "studentIds or rollNos is required"}), 400
+    if len(student_ids) + len(roll_nos) > ENROLLMENT_MAX_KEYS:
+        return jsonify({"error": f"at most {ENROLLMENT_MAX_KEYS} students per request"}), 413
+
+    with _request_transaction() as conn:
+        cursor = conn.cursor()
+        enrollment_cols = _enrollment_columns(cursor)
+        student_col = enrollment_cols.get("student")
+        class_col = enrollment_cols.get("class")
+        if not student_col or not class_col:
+            return jsonify({"error": "enrollments schema incomplete"}), 500
+        cursor.execute("SELECT 1 FROM classes WHERE id = ?", (class_id,))
+        if cursor.fetchone() is None:
+            return jsonify({"error": "class not found"}), 404
+
+        resolved, keys = _resolve_enrollment_keys(cursor, student_ids, roll_nos)
+        unresolved: Dict[str, List[Any]] = {"studentIds": [], "rollNos": []}
+        ambiguous: List[str] = []
+        targets: Dict[Any, None] = {}
+        for key in keys:
+            matched = resolved.get(key)
+            if not matched:
+                unresolved[f"{key[0]}s"].append(key[1])
+            elif len(matched) > 1:
+                ambiguous.append(key[1])
+            else:
+                targets[next(iter(matched))] = None
+
+        if request.method == "POST":
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO enrollments ({class_col}, {student_col}) VALUES (?, ?)",
+                [(class_id, student_pk) for student_pk in targets],
+            )
+            changed = max(cursor.rowcount, 0) if targets else 0
+        else:
+            cursor.execute("CREATE TEMP TABLE enrollment_targets (student_id INTEGER PRIMARY KEY)")
+            cursor.executemany(
+                "INSERT INTO temp.enrollment_targets (student_id) VALUES (?)", [(pk,) for pk in targets]
+            )
+            cursor.execute(
+                f"""
+                DELETE FROM enrollments
+                WHERE {class_col} = ? AND {student_col} IN (SELECT student_id FROM temp.enrollment_targets)
+                """,
+                (class_id,),
+            )
+            changed = max(cursor.rowcount, 0)
+            cursor.execute("DROP TABLE temp.enrollment_targets")
+
+    return jsonify(
+        {
+            "classId": class_id,
+            "requested": len(keys),
+            "resolved": len(targets),
+            "enrolled" if request.method == "POST" else "removed": changed,
+            "unchanged": len(targets) - changed,
+            "unresolved": unresolved,
+            "ambiguousRollNos": ambiguous,
+        }
+    )
+
 @app.route("/api/attendance/checkin", methods=["POST"])
 def attendance_checkin():
     payload = request.get_json(force=True, silent=True)
@@ -1126,24 +2991,20 @@ def attendance_checkin():
         return jsonify({"error": "invalid json"}), 400
 
     created_at = _now_iso()
-    with closing(get_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO attendance_logs (student_id, matched, distance, score, source, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (payload.get("studentId"), 1, None, None, "gps", created_at),
-        )
-        conn.commit()
+    student_id = payload.get("studentId")
+    _audit_log.submit("attendance_logs", [(student_id, 1, None, None, "gps", created_at)])
+    student = _feed_students([student_id]).get(student_id) if isinstance(student_id, int) else None
+    _attendance_feed.publish(
+        "attendance_checkin", None, [_feed_item(student_id, True, None, None, "gps", created_at, student)]
+    )
     return jsonify({"ok": True, "createdAt": created_at})
 
 # -------------
 # Facenet proxy
 # -------------
-def _forward_request(url: str, *, json_payload=None, files_payload=None):
+def _forward_request(path: str, *, json_payload=None, files_payload=None):
     try:
-        response = requests.post(url, json=json_payload, files=files_payload, timeout=15)
+        response = _facenet.post(path, json=json_payload, files=files_payload, timeout=15)
     except requests.RequestException as exc:
         return None, jsonify({"error": "facenet service unavailable", "detail": str(exc)}), 502
 
@@ -1171,23 +3032,18 @@ def facenet_verify():
             if file:
                 files_payload[key] = (file.filename or key, file.read(), file.content_type or "application/octet-stream")
         source_value = "upload"
-        body, response, status = _forward_request(f"{FACENET_URL}/verify_upload", files_payload=files_payload)
+        body, response, status = _forward_request("/verify_upload", files_payload=files_payload)
     else:
         payload = request.get_json(force=True, silent=True)
         if not payload:
             return jsonify({"error": "invalid json"}), 400
         source_value = payload.get("source", "json")
-        body, response, status = _forward_request(f"{FACENET_URL}/verify", json_payload=payload)
+        body, response, status = _forward_request("/verify", json_payload=payload)
 
     if body is not None and status == 200:
-        with closing(get_connection()) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO verification_logs (
-                    subject_id, distance, score, match, threshold, source, created_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
+        _audit_log.submit(
+            "verification_logs",
+            [
                 (
                     payload.get("subjectId") if payload else None,
                     body.get("distance"),
@@ -1196,17 +3052,17 @@ def facenet_verify():
                     body.get("threshold", MATCH_THRESHOLD),
                     source_value,
                     _now_iso(),
-                ),
-            )
-            conn.commit()
+                )
+            ],
+        )
     return response, status
 
 @app.route("/api/attendance/mark", methods=["POST"])
 def attendance_mark():
-    image_value, meta_payload, error = _extract_image_payload()
+    image_bytes, image_type, meta_payload, error = _extract_image_payload()
     if error:
         return jsonify({"error": error}), 400
-    if not image_value:
+    if not image_bytes:
         return jsonify({"error": "image payload missing"}), 400
 
     meta_payload = meta_payload or {}
@@ -1219,75 +3075,24 @@ def attendance_mark():
         except (TypeError, ValueError):
             class_id = None
 
+    device_id = str(request.headers.get(DEVICE_ID_HEADER) or meta_payload.get("deviceId") or "").strip() or None
     try:
-        embedding = _facenet_embed_from_data(image_value)
+        embedding, embedding_version = _facenet_embed_from_bytes(
+            image_bytes, image_type, device_id, _active_embedder()
+        )
     except RuntimeError as exc:
         return jsonify({"error": str(exc)}), 502
 
-    with closing(get_connection()) as conn:
-        cursor = conn.cursor()
-        students = _load_students_with_embeddings(cursor)
+    matches = _gallery_cache.top_k(embedding, embedding_version, 2, class_id)
 
-    if not students:
+    if not matches:
         created_at = _now_iso()
-        with closing(get_connection()) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO attendance_logs (student_id, matched, distance, score, source, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    None,
-                    0,
-                    None,
-                    None,
-                    source_hint,
-                    created_at,
-                ),
-            )
-            conn.commit()
-        return jsonify(
-            {
-                "matched": False,
-                "reason": "no_students_with_embeddings",
-                "threshold": MATCH_THRESHOLD,
-                "createdAt": created_at,
-                "source": _normalize_source(source_hint),
-            }
+        _audit_log.submit("attendance_logs", [(None, 0, None, None, source_hint, created_at)])
+        _attendance_feed.publish(
+            "attendance_mark",
+            class_id,
+            [_feed_item(None, False, None, None, source_hint, created_at, classId=class_id, attendanceRecorded=False)],
         )
-
-    best: Optional[Dict[str, Any]] = None
-    for student in students:
-        distance = _cosine_distance(embedding, student['embedding'])
-        if best is None or distance < best['distance']:
-            best = {
-                'studentId': student['studentId'],
-                'username': student.get('username'),
-                'name': student.get('name'),
-                'rollNo': student.get('roll_no'),
-                'distance': distance,
-            }
-
-    if best is None:
-        created_at = _now_iso()
-        with closing(get_connection()) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO attendance_logs (student_id, matched, distance, score, source, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    None,
-                    0,
-                    None,
-                    None,
-                    source_hint,
-                    created_at,
-                ),
-            )
-            conn.commit()
         return jsonify(
             {
                 "matched": False,
@@ -1298,6 +3103,18 @@ def attendance_mark():
             }
         )
 
+    student, similarity = matches[0]
+    best: Dict[str, Any] = {
+        'studentId': student['studentId'],
+        'username': student.get('username'),
+        'name': student.get('name'),
+        'rollNo': student.get('roll_no'),
+        'distance': 1.0 - max(min(similarity, 1.0), -1.0),
+    }
+    # Distance gap to the runner-up; None with a single enrolled student.
+    margin = float(similarity - matches[1][1]) if len(matches) > 1 else None
+    ambiguous = margin is not None and margin < MATCH_MIN_MARGIN
+
     distance_value = float(best['distance'])
     try:
         student_identifier = int(best['studentId']) if best.get('studentId') is not None else None
@@ -1305,7 +3122,7 @@ def attendance_mark():
         student_identifier = None
     else:
         best['studentId'] = student_identifier
-    matched = distance_value <= MATCH_THRESHOLD
+    matched = distance_value <= MATCH_THRESHOLD and not ambiguous
     score = max(0.0, 1.0 - distance_value)
     created_at = _now_iso()
 
@@ -1315,24 +3132,9 @@ def attendance_mark():
     if matched:
         recognized_name = best.get('name') or best.get('username') or best.get('rollNo')
 
-    with closing(get_connection()) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            INSERT INTO attendance_logs (student_id, matched, distance, score, source, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (
-                student_identifier if matched else None,
-                1 if matched else 0,
-                distance_value,
-                score,
-                source_hint,
-                created_at,
-            ),
-        )
-
-        if matched and class_id is not None:
+    if matched and class_id is not None:
+        with _request_transaction() as conn:
+            cursor = conn.cursor()
             enrollment_cols = _enrollment_columns(cursor)
             student_col = enrollment_cols.get("student")
             class_col = enrollment_cols.get("class")
@@ -1392,7 +3194,28 @@ def attendance_mark():
                             ),
                         )
                     attendance_recorded = True
-        conn.commit()
+
+    _audit_log.submit(
+        "attendance_logs",
+        [(student_identifier if matched else None, 1 if matched else 0, distance_value, score, source_hint, created_at)],
+    )
+    _attendance_feed.publish(
+        "attendance_mark",
+        class_id,
+        [
+            _feed_item(
+                student_identifier if matched else None,
+                matched,
+                distance_value,
+                score,
+                source_hint,
+                created_at,
+                student if matched else None,
+                classId=class_id,
+                attendanceRecorded=attendance_recorded,
+            )
+        ],
+    )
 
     response_body = {
         "matched": matched,
@@ -1402,6 +3225,8 @@ def attendance_mark():
         "distance": distance_value,
         "score": score,
         "threshold": MATCH_THRESHOLD,
+        "margin": margin,
+        "ambiguous": ambiguous,
         "createdAt": created_at,
         "source": normalized_source,
         "recognizedName": recognized_name if matched else None,
@@ -1410,6 +3235,177 @@ def attendance_mark():
     }
     return jsonify(response_body)
 
+# Keyset pagination for attendance history. Rows are ordered by (date, time, id)
+# descending; the opaque cursor is the last row's key, so every page is a range
+# seek instead of an OFFSET walk.
+HISTORY_SORT_TIME = "COALESCE(a.time, substr(a.created_at, 12, 8), '')"
+_history_counts: Dict[Tuple[Any, ...], Tuple[float, int]] = {}
+_history_counts_lock = threading.Lock()
+
+
+def _encode_history_cursor(row: sqlite3.Row) -> str:
+    key = json.dumps([row["date"], row["sort_time"], row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(key.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_history_cursor(value: str) -> Tuple[str, str, int]:
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        day, sort_time, row_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return str(day), str(sort_time), int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("cursor is invalid")
+
+
+def _history_total(cursor: sqlite3.Cursor, query: str, params: List[Any], mode: str) -> Tuple[Optional[int], bool]:
+    """Count rows for a filter set; returns (total, exact).
+
+    Cached totals are keyed on MAX(attendance.id) as well, so new rows invalidate
+    them at once; edits and deletes may lag by up to HISTORY_COUNT_TTL seconds.
+    """
+    if mode == "none":
+        return None, False
+    cursor.execute("SELECT MAX(id) FROM attendance")
+    key = (query, tuple(params), cursor.fetchone()[0])
+    now = time.monotonic()
+    if mode != "exact":
+        with _history_counts_lock:
+            cached = _history_counts.get(key)
+        if cached is not None and now - cached[0] < HISTORY_COUNT_TTL:
+            return cached[1], False
+    cursor.execute(query, params)
+    total = cursor.fetchone()[0]
+    with _history_counts_lock:
+        _history_counts.pop(key, None)
+        _history_counts[key] = (now, total)
+        while len(_history_counts) > HISTORY_COUNT_CACHE_SIZE:
+            _history_counts.pop(next(iter(_history_counts)))
+    return total, True
+
+
+HISTORY_CSV_HEADER = ["Date", "Time", "Class", "Section", "Subject", "Student", "Roll No", "Status", "Recognized Name", "Source"]
+
+
+def _history_filters(cursor: sqlite3.Cursor) -> Tuple[List[str], List[Any]]:
+    """WHERE conditions and params for the history filters on the current request."""
+    class_id_param = request.args.get("classId")
+    student_query = (request.args.get("student") or request.args.get("studentQuery") or "").strip()
+    from_date = request.args.get("fromDate") or request.args.get("from")
+    to_date = request.args.get("toDate") or request.args.get("to")
+
+    conditions: List[str] = []
+    params: List[Any] = []
+    if class_id_param not in (None, ""):
+        try:
+            class_id = int(class_id_param)
+        except (TypeError, ValueError):
+            raise ValueError("classId must be an integer")
+        conditions.append("a.class_id = ?")
+        params.append(class_id)
+    if from_date:
+        conditions.append("a.date >= ?")
+        params.append(from_date)
+    if to_date:
+        conditions.append("a.date <= ?")
+        params.append(to_date)
+    search = _student_search_sql(cursor, student_query) if student_query else None
+    if search is not None:
+        # Resolve the few matching students first, then seek their rows on idx_attendance_student.
+        info = _students_pk_info(cursor)
+        keys = [column for column, present in (("student_id", info["has_student_id"]), ("id", info["has_id"])) if present]
+        search_sql, search_params = search
+        matching = " UNION ".join(f"SELECT {key} FROM students WHERE rowid IN ({search_sql})" for key in keys)
+        conditions.append(f"a.student_id IN ({matching or 'NULL'})")
+        params.extend(search_params * len(keys))
+    elif student_query:
+        like_value = f"%{student_query.lower()}%"
+        conditions.append("(LOWER(s.name) LIKE ? OR LOWER(a.recognized_name) LIKE ? OR LOWER(COALESCE(s.roll_no, '')) LIKE ?)")
+        params.extend([like_value, like_value, like_value])
+    return conditions, params
+
+
+def _history_query(cursor: sqlite3.Cursor, conditions: List[str]) -> str:
+    info = _students_pk_info(cursor)
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return f"""
+        SELECT
+            a.id,
+            a.student_id,
+            a.class_id,
+            a.date,
+            a.time,
+            a.status,
+            a.recognized_name,
+            a.source,
+            a.created_at,
+            a.updated_at,
+            {HISTORY_SORT_TIME} AS sort_time,
+            {_pk_select_expr("s", info)} AS student_primary_id,
+            s.name AS student_name,
+            s.roll_no,
+            s.email,
+            c.class_name,
+            c.section,
+            c.subject
+        FROM attendance AS a
+        LEFT JOIN students AS s ON {_pk_join_condition("s", "a", info)}
+        LEFT JOIN classes AS c ON c.id = a.class_id
+        {where_clause}
+        ORDER BY a.date DESC, {HISTORY_SORT_TIME} DESC, a.id DESC
+    """
+
+
+def _history_item(row: sqlite3.Row) -> Dict[str, Any]:
+    row_dict = dict(row)
+    student_id_out = row_dict.get("student_primary_id") or row_dict.get("student_id")
+    if student_id_out is not None:
+        try:
+            student_id_out = int(student_id_out)
+        except (TypeError, ValueError):
+            pass
+    date_value = row_dict.get("date")
+    time_value = row_dict.get("time")
+    created_at = row_dict.get("created_at")
+    if (not time_value) and created_at:
+        try:
+            parsed = datetime.fromisoformat(created_at)
+            time_value = parsed.time().strftime("%H:%M:%S")
+            if not date_value:
+                date_value = parsed.date().isoformat()
+        except ValueError:
+            pass
+    return {
+        "attendanceId": row_dict.get("id"),
+        "studentId": student_id_out,
+        "studentName": row_dict.get("student_name"),
+        "rollNo": row_dict.get("roll_no"),
+        "classId": row_dict.get("class_id"),
+        "className": row_dict.get("class_name"),
+        "section": row_dict.get("section"),
+        "subject": row_dict.get("subject"),
+        "date": date_value,
+        "time": time_value,
+        "status": (row_dict.get("status") or "").lower(),
+        "recognizedName": row_dict.get("recognized_name"),
+        "source": _normalize_source(row_dict.get("source")),
+    }
+
+
+def _history_csv_row(item: Dict[str, Any]) -> List[Any]:
+    return [
+        item.get("date"),
+        item.get("time"),
+        item.get("className"),
+        item.get("section"),
+        item.get("subject"),
+        item.get("studentName"),
+        item.get("rollNo"),
+        item.get("status"),
+        item.get("recognizedName"),
+        item.get("source"),
+    ]
+
+
 @app.route("/api/attendance/history", methods=["GET"])
 def attendance_history_api():
     page_value = request.args.get("page", default="1")
@@ -1425,141 +3421,57 @@ def attendance_history_api():
     per_page = max(1, min(per_page, 100))
     offset = (page - 1) * per_page
 
-    class_id_param = request.args.get("classId")
-    student_query = (request.args.get("student") or request.args.get("studentQuery") or "").strip()
-    from_date = request.args.get("fromDate") or request.args.get("from")
-    to_date = request.args.get("toDate") or request.args.get("to")
-
-    class_id = None
-    if class_id_param not in (None, ""):
+    cursor_value = (request.args.get("cursor") or "").strip()
+    after: Optional[Tuple[str, str, int]] = None
+    if cursor_value:
         try:
-            class_id = int(class_id_param)
-        except (TypeError, ValueError):
-            return jsonify({"error": "classId must be an integer"}), 400
+            after = _decode_history_cursor(cursor_value)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+        offset = 0
+    total_mode = (request.args.get("total") or "cached").lower()
+    if total_mode not in ("cached", "exact", "none"):
+        return jsonify({"error": "total must be cached, exact or none"}), 400
 
     try:
-        with closing(get_connection()) as conn:
+        with closing(get_connection(readonly=True)) as conn:
             cursor = conn.cursor()
-            info = _students_pk_info(cursor)
-            join_condition = _pk_join_condition("s", "a", info)
-            pk_expr = _pk_select_expr("s", info)
-
-            conditions: List[str] = []
-            params: List[Any] = []
-            if class_id is not None:
-                conditions.append("a.class_id = ?")
-                params.append(class_id)
-            if from_date:
-                conditions.append("a.date >= ?")
-                params.append(from_date)
-            if to_date:
-                conditions.append("a.date <= ?")
-                params.append(to_date)
-            if student_query:
-                like_value = f"%{student_query.lower()}%"
-                conditions.append("(LOWER(s.name) LIKE ? OR LOWER(a.recognized_name) LIKE ? OR LOWER(COALESCE(s.roll_no, '')) LIKE ?)")
-                params.extend([like_value, like_value, like_value])
-
+            try:
+                conditions, params = _history_filters(cursor)
+            except ValueError as exc:
+                return jsonify({"error": str(exc)}), 400
+            join_condition = _pk_join_condition("s", "a", _students_pk_info(cursor))
             where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
 
+            # classes joins on its primary key, so it cannot change the count.
             count_query = f"""
                 SELECT COUNT(*)
                 FROM attendance AS a
                 LEFT JOIN students AS s ON {join_condition}
-                LEFT JOIN classes AS c ON c.id = a.class_id
                 {where_clause}
             """
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
+            total, total_exact = _history_total(cursor, count_query, params, total_mode)
 
-            data_query = f"""
-                SELECT
-                    a.id,
-                    a.student_id,
-                    a.class_id,
-                    a.date,
-                    a.time,
-                    a.status,
-                    a.recognized_name,
-                    a.source,
-                    a.created_at,
-                    a.updated_at,
-                    {pk_expr} AS student_primary_id,
-                    s.name AS student_name,
-                    s.roll_no,
-                    s.email,
-                    c.class_name,
-                    c.section,
-                    c.subject
-                FROM attendance AS a
-                LEFT JOIN students AS s ON {join_condition}
-                LEFT JOIN classes AS c ON c.id = a.class_id
-                {where_clause}
-                ORDER BY a.date DESC, COALESCE(a.time, substr(a.created_at, 12, 8), '') DESC, a.id DESC
-                LIMIT ? OFFSET ?
-            """
-            cursor.execute(data_query, params + [per_page, offset])
+            data_params = list(params)
+            if after is not None:
+                # The leading a.date bound keeps the seek on the date indexes.
+                conditions.append(f"a.date <= ? AND (a.date < ? OR ({HISTORY_SORT_TIME}, a.id) < (?, ?))")
+                data_params.extend([after[0], after[0], after[1], after[2]])
+
+            cursor.execute(_history_query(cursor, conditions) + " LIMIT ? OFFSET ?", data_params + [per_page + 1, offset])
             rows = cursor.fetchall()
     except sqlite3.OperationalError as exc:
         return jsonify({"error": "attendance history unavailable", "detail": str(exc)}), 500
 
-    format_value = (request.args.get("format") or "").lower()
-
-    items: List[Dict[str, Any]] = []
-    for row in rows:
-        row_dict = dict(row)
-        student_id_out = row_dict.get("student_primary_id") or row_dict.get("student_id")
-        if student_id_out is not None:
-            try:
-                student_id_out = int(student_id_out)
-            except (TypeError, ValueError):
-                pass
-        date_value = row_dict.get("date")
-        time_value = row_dict.get("time")
-        created_at = row_dict.get("created_at")
-        if (not time_value) and created_at:
-            try:
-                parsed = datetime.fromisoformat(created_at)
-                time_value = parsed.time().strftime("%H:%M:%S")
-                if not date_value:
-                    date_value = parsed.date().isoformat()
-            except ValueError:
-                pass
-        items.append(
-            {
-                "attendanceId": row_dict.get("id"),
-                "studentId": student_id_out,
-                "studentName": row_dict.get("student_name"),
-                "rollNo": row_dict.get("roll_no"),
-                "classId": row_dict.get("class_id"),
-                "className": row_dict.get("class_name"),
-                "section": row_dict.get("section"),
-                "subject": row_dict.get("subject"),
-                "date": date_value,
-                "time": time_value,
-                "status": (row_dict.get("status") or "").lower(),
-                "recognizedName": row_dict.get("recognized_name"),
-                "source": _normalize_source(row_dict.get("source")),
-            }
-        )
+    next_cursor = _encode_history_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    items = [_history_item(row) for row in rows[:per_page]]
 
+    format_value = (request.args.get("format") or "").lower()
     if format_value == "csv":
         output = io.StringIO()
         writer = csv.writer(output)
-        writer.writerow(["Date", "Time", "Class", "Section", "Subject", "Student", "Roll No", "Status", "Recognized Name", "Source"])
-        for item in items:
-            writer.writerow([
-                item.get("date"),
-                item.get("time"),
-                item.get("className"),
-                item.get("section"),
-                item.get("subject"),
-                item.get("studentName"),
-                item.get("rollNo"),
-                item.get("status"),
-                item.get("recognizedName"),
-                item.get("source"),
-            ])
+        writer.writerow(HISTORY_CSV_HEADER)
+        writer.writerows(_history_csv_row(item) for item in items)
         response = Response(output.getvalue(), mimetype="text/csv")
         filename = f"attendance-history-{date.today().isoformat()}.csv"
         response.headers["Content-Disposition"] = f"attachment; filename={filename}"
@@ -1568,14 +3480,65 @@ def attendance_history_api():
     return jsonify(
         {
             "items": items,
-            "meta": {"page": page, "perPage": per_page, "total": total},
+            "meta": {
+                "page": None if after is not None else page,
+                "perPage": per_page,
+                "total": total,
+                "totalExact": total_exact,
+                "nextCursor": next_cursor,
+            },
         }
     )
 
 
+@app.route("/api/attendance/history/export", methods=["GET"])
+def attendance_history_export():
+    """Stream every history row matching the filters as CSV (``?gzip=1`` compresses it)."""
+    conn = get_connection(readonly=True)
+    try:
+        conditions, params = _history_filters(conn.cursor())
+    except ValueError as exc:
+        conn.close()
+        return jsonify({"error": str(exc)}), 400
+    compress = (request.args.get("gzip") or "").lower() in ("1", "true", "yes")
+
+    def generate() -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(HISTORY_CSV_HEADER)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+        cursor = conn.cursor()
+        try:
+            cursor.execute(_history_query(cursor, conditions), params)
+            while True:
+                rows = cursor.fetchmany(HISTORY_EXPORT_CHUNK)
+                if rows:
+                    writer.writerows(_history_csv_row(_history_item(row)) for row in rows)
+                chunk = buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+                if not rows:
+                    break
+        finally:
+            cursor.close()
+        if compressor is not None:
+            yield compressor.flush()
+
+    filename = f"attendance-history-{date.today().isoformat()}.csv"
+    response = Response(generate(), mimetype="application/gzip" if compress else "text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}{'.gz' if compress else ''}"
+    # Released when the response closes, even if the body is never iterated.
+    response.call_on_close(conn.close)
+    return response
+
+
 @app.route("/api/attendance/latest", methods=["GET"])
 def attendance_latest():
-    with closing(get_connection()) as conn:
+    with closing(get_connection(readonly=True)) as conn:
         cursor = conn.cursor()
         info = _students_pk_info(cursor)
         join_cond = _pk_join_condition("s", "a", info)
@@ -1620,18 +3583,57 @@ def attendance_latest():
     ]
     return jsonify({"items": items})
 
+@app.route("/api/attendance/stream", methods=["GET"])
+def attendance_stream():
+    """
+    Server-sent events for new attendance log rows (attendance_mark,
+    attendance_manual, attendance_checkin), optionally only for ?classId=.
+    Data objects match /api/attendance/latest items. Reconnects resume after
+    Last-Event-ID (or ?lastEventId=); a "reset" event means the gap could not
+    be replayed and the client should reload /api/attendance/latest.
+    """
+    class_id: Optional[int] = None
+    class_value = request.args.get("classId") or request.args.get("class_id")
+    if class_value not in (None, ""):
+        try:
+            class_id = int(class_value)
+        except ValueError:
+            return jsonify({"error": "classId must be an integer"}), 400
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    subscriber = _attendance_feed.subscribe(class_id, last_event_id)
+    return Response(
+        _attendance_feed.stream(subscriber),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.route("/api/attendance/summary", methods=["GET"])
 def attendance_summary():
-    with closing(get_connection()) as conn:
+    from_date = request.args.get("fromDate") or request.args.get("from")
+    to_date = request.args.get("toDate") or request.args.get("to")
+    conditions: List[str] = []
+    params: List[Any] = []
+    if from_date:
+        conditions.append("day >= ?")
+        params.append(from_date)
+    if to_date:
+        conditions.append("day <= ?")
+        params.append(to_date)
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    with closing(get_connection(readonly=True)) as conn:
         cursor = conn.cursor()
         cursor.execute(
-            """
+            f"""
             SELECT source,
-                   COUNT(*) AS attempts,
-                   SUM(CASE WHEN matched = 1 THEN 1 ELSE 0 END) AS successes
-            FROM attendance_logs
+                   SUM(attempts) AS attempts,
+                   SUM(successes) AS successes
+            FROM attendance_log_rollup
+            {where_clause}
             GROUP BY source
-            """
+            HAVING SUM(attempts) > 0
+            """,
+            params,
         )
         rows = cursor.fetchall()
 
@@ -1672,17 +3674,603 @@ def legacy_verify():
     forward_payload = request.get_json(force=True, silent=True)
     if not forward_payload:
         return jsonify({"error": "invalid json"}), 400
-    body, response, status = _forward_request(f"{FACENET_URL}/verify", json_payload=forward_payload)
+    body, response, status = _forward_request("/verify", json_payload=forward_payload)
     return response, status
 
+# ----------------------------
+# Re-embedding
+# ----------------------------
+class _ReembedJob:
+    """
+    Regenerate every student embedding with another facenet embedder.
+
+    Vectors for the new generation go to students.embedding_next, batch by batch,
+    while matching keeps reading students.embedding. Progress lives in the DB, so
+    an interrupted job resumes by skipping rows already at the target version.
+    When no row is left, one transaction promotes embedding_next and flips
+    embedding_settings.active_embedder.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.target: Optional[str] = None
+        self.status = "idle"
+        self.error: Optional[str] = None
+        self.processed = 0
+        self.failed: Dict[str, str] = {}
+        self.missing: List[Any] = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "status": self.status,
+                "target": self.target,
+                "processed": self.processed,
+                "failed": dict(self.failed),
+                "missingPhotos": list(self.missing),
+                "error": self.error,
+                "activeEmbedder": _active_embedder(),
+            }
+
+    def start(self, target: str, force: bool = False) -> bool:
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.target = target
+            self.status = "running"
+            self.error = None
+            self.processed = 0
+            self.failed = {}
+            self.missing = []
+            with closing(get_connection()) as conn:
+                _set_setting(conn.cursor(), "reembed_target", target)
+                _set_setting(conn.cursor(), "reembed_force", "1" if force else None)
+                conn.commit()
+            self.thread = threading.Thread(target=self._run, args=(target, force), daemon=True)
+            self.thread.start()
+            return True
+
+    def resume(self) -> None:
+        """Restart a job that was interrupted by a shutdown."""
+        with closing(get_connection()) as conn:
+            cursor = conn.cursor()
+            target = _get_setting(cursor, "reembed_target")
+            force = _get_setting(cursor, "reembed_force") == "1"
+        if target:
+            self.start(target, force)
+
+    def _todo(self, cursor: sqlite3.Cursor, pk_col: str, target: str) -> List[Tuple[Any, str]]:
+        cursor.execute(
+            f"""
+            SELECT "{pk_col}" AS pk, photo_hash FROM students
+            WHERE COALESCE(embedding, '') != '' AND photo_hash IS NOT NULL
+              AND COALESCE(embedding_next_version, '') != ?
+            """,
+            (target,),
+        )
+        return [
+            (row["pk"], row["photo_hash"])
+            for row in cursor.fetchall()
+            if str(row["pk"]) not in self.failed
+        ]
+
+    def _embed_batch(
+        self, target: str, batch: List[Tuple[Any, str]]
+    ) -> List[Tuple[Any, str, Optional[str], Optional[str]]]:
+        """Return (pk, photo_hash, embedding_blob, embedder) per row; embedding_blob is None on failure."""
+        images = []
+        for _, digest in batch:
+            try:
+                images.append((digest, _read_photo(digest)))
+            except OSError:
+                images.append((digest, b""))
+        embeddings, _, embedder = _facenet_embed_batch(images, target)
+        return [
+            (pk, digest, _pack_embedding(vector) if vector is not None else None, embedder)
+            for (pk, digest), vector in zip(batch, embeddings)
+        ]
+
+    def _run(self, target: str, force: bool) -> None:
+        try:
+            with closing(get_connection()) as conn:
+                cursor = conn.cursor()
+                pk_col = _students_pk_info(cursor).get("pk_col") or "id"
+                while True:
+                    todo = self._todo(cursor, pk_col, target)
+                    batches = [todo[i:i + REEMBED_BATCH_SIZE] for i in range(0, len(todo), REEMBED_BATCH_SIZE)]
+                    with ThreadPoolExecutor(max_workers=REEMBED_WORKERS) as pool:
+                        for results in pool.map(lambda batch: self._embed_batch(target, batch), batches):
+                            ok = [(emb, version, pk, digest) for pk, digest, emb, version in results if emb]
+                            canonical = next((version for _, version, _, _ in ok if version), None)
+                            if canonical and canonical != target:
+                                # "hog" -> "hog-324": track the exact version facenet reports.
+                                target = canonical
+                                with self.lock:
+                                    self.target = target
+                                _set_setting(cursor, "reembed_target", target)
+                            # A row re-photographed while this batch ran keeps its reset
+                            # embedding_next and is picked up again by the next _todo().
+                            cursor.executemany(
+                                f"""
+                                UPDATE students SET embedding_next = ?, embedding_next_version = ?
+                                WHERE "{pk_col}" = ? AND photo_hash = ?
+                                """,
+                                ok,
+                            )
+                            conn.commit()
+                            with self.lock:
+                                self.processed += len(ok)
+                                for pk, _, emb, _ in results:
+                                    if not emb:
+                                        self.failed[str(pk)] = "embedding failed"
+
+                    cursor.execute("BEGIN IMMEDIATE")
+                    # Rows registered or re-photographed since _todo() need another pass.
+                    if self._todo(cursor, pk_col, target):
+                        conn.rollback()
+                        continue
+                    cursor.execute(
+                        f"""
+                        SELECT "{pk_col}" AS pk FROM students
+                        WHERE COALESCE(embedding, '') != ''
+                          AND (photo_hash IS NULL OR COALESCE(embedding_next_version, '') != ?)
+                        """,
+                        (target,),
+                    )
+                    missing = [row["pk"] for row in cursor.fetchall()]
+                    with self.lock:
+                        self.missing = missing
+                    if missing and not force:
+                        conn.rollback()
+                        with self.lock:
+                            self.status = "blocked"
+                        return
+
+                    # Rows without a usable photo cannot join the new generation.
+                    cursor.execute(
+                        """
+                        UPDATE students SET embedding = NULL, embedding_version = NULL
+                        WHERE COALESCE(embedding_next_version, '') != ?
+                        """,
+                        (target,),
+                    )
+                    cursor.execute(
+                        """
+                        UPDATE students
+                        SET embedding = embedding_next, embedding_version = embedding_next_version,
+                            embedding_next = NULL, embedding_next_version = NULL
+                        WHERE embedding_next_version = ?
+                        """,
+                        (target,),
+                    )
+                    _set_setting(cursor, "active_embedder", target)
+                    _set_setting(cursor, "reembed_target", None)
+                    _set_setting(cursor, "reembed_force", None)
+                    conn.commit()
+                    break
+            _schedule_gallery_push()
+            with self.lock:
+                self.status = "complete"
+        except Exception as exc:
+            with self.lock:
+                self.status = "failed"
+                self.error = str(exc)
+
+
+_reembed_job = _ReembedJob()
+
+@app.route("/api/embeddings/reembed", methods=["GET"])
+def reembed_status():
+    return jsonify(_reembed_job.snapshot())
+
+@app.route("/api/embeddings/reembed", methods=["POST"])
+def reembed_start():
+    """Start regenerating all student embeddings with `embedder` (a facenet embedder name)."""
+    payload = request.get_json(force=True, silent=True) or {}
+    target = (payload.get("embedder") or "").strip()
+    if not target:
+        return jsonify({"error": "embedder is required"}), 400
+    if not _reembed_job.start(target, bool(payload.get("force"))):
+        return jsonify({"error": "re-embed already running", **_reembed_job.snapshot()}), 409
+    return jsonify(_reembed_job.snapshot()), 202
+
+# ----------------------------
+# Embedding storage migration
+# ----------------------------
+def _blob_or_original(value: Any) -> Any:
+    if not isinstance(value, str) or not value:
+        return value
+    vector = _unpack_embedding(value)
+    return _pack_embedding(vector) if vector is not None else None  # unparseable text never matched
+
+def _migrate_embedding_blobs(vacuum: bool = False) -> int:
+    """
+    Rewrite JSON-text embeddings as float32 blobs, EMBEDDING_MIGRATION_BATCH rows at a
+    time. Rows are decoded outside any transaction and written back only if unchanged
+    in the meantime, so requests keep running; it is safe to interrupt and rerun.
+    Returns the number of rows converted.
+    """
+    converted = 0
+    with closing(get_connection()) as conn:
+        cursor = conn.cursor()
+        while True:
+            cursor.execute(
+                """
+                SELECT rowid AS row_id, embedding, embedding_next FROM students
+                WHERE (typeof(embedding) = 'text' AND embedding != '')
+                   OR (typeof(embedding_next) = 'text' AND embedding_next != '')
+                LIMIT ?
+                """,
+                (EMBEDDING_MIGRATION_BATCH,),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            updates = [
+                (
+                    row["embedding"], _blob_or_original(row["embedding"]),
+                    row["embedding_next"], _blob_or_original(row["embedding_next"]),
+                    row["row_id"],
+                )
+                for row in rows
+            ]
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM embedding_changes")
+            last_seq = cursor.fetchone()[0]
+            cursor.executemany(
+                """
+                UPDATE students
+                SET embedding = CASE WHEN embedding IS ? THEN ? ELSE embedding END,
+                    embedding_next = CASE WHEN embedding_next IS ? THEN ? ELSE embedding_next END
+                WHERE rowid = ?
+                """,
+                updates,
+            )
+            # Same vectors in a new encoding: nothing for the gallery cache to reload.
+            cursor.execute("DELETE FROM embedding_changes WHERE seq > ?", (last_seq,))
+            conn.commit()
+            converted += len(rows)
+        if vacuum and converted:
+            cursor.execute("VACUUM")
+    return converted
+
+def _migrate_embedding_blobs_in_background() -> None:
+    try:
+        converted = _migrate_embedding_blobs()
+    except sqlite3.Error as exc:
+        print(f"embedding blob migration stopped: {exc}", flush=True)
+        return
+    if converted:
+        print(
+            f"converted {converted} embeddings to float32 blobs; "
+            "run `python run.py migrate-embeddings` to VACUUM the freed space",
+            flush=True,
+        )
+
+# ----------------------------
+# Gallery sync
+# ----------------------------
+# Same binary layout as facenet_service's /gallery/export and /gallery/import:
+#   b"GAL1" | uint32 LE header length | JSON header | float32 LE matrix (len(ids) x dim)
+GALLERY_MAGIC = b"GAL1"
+GALLERY_CHUNK_ROWS = 1024
+
+_sync_pool = ThreadPoolExecutor(max_workers=1)  # one worker keeps pushes in commit order
+
+def _gallery_header_bytes(header: Dict[str, Any]) -> bytes:
+    header_bytes = json.dumps(header).encode("utf-8")
+    return GALLERY_MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes
+
+def _gallery_row_bytes(stored: Any, dim: int) -> bytes:
+    vector = _unpack_embedding(stored)
+    if vector is None or vector.shape != (dim,):
+        vector = np.zeros(dim, dtype="<f4")  # keep the stream aligned; a zero row never matches
+    return vector.tobytes()
+
+def _gallery_export_embedder(cursor: sqlite3.Cursor) -> Optional[str]:
+    """The active generation, or the most common tagged version before the first re-embed."""
+    active = _get_setting(cursor, "active_embedder")
+    if active:
+        return active
+    cursor.execute(
+        """
+        SELECT embedding_version FROM students
+        WHERE COALESCE(embedding, '') != '' AND embedding_version IS NOT NULL
+        GROUP BY embedding_version ORDER BY COUNT(*) DESC LIMIT 1
+        """
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _gallery_export_chunks():
+    """
+    Stream every embedding of the export generation as one GAL1 blob.
+    Ids are read first so the header can lead, then vectors follow in the same
+    order through fetchmany, all inside one read transaction.
+    """
+    with closing(get_connection(readonly=True)) as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        try:
+            info = _students_pk_info(cursor)
+            pk_expr = _pk_select_expr("s", info)
+            embedder = _gallery_export_embedder(cursor)
+            cursor.execute(
+                f"""
+                SELECT {pk_expr} AS sid, s.embedding, s.photo_hash FROM students AS s
+                WHERE COALESCE(s.embedding, '') != '' AND s.embedding_version IS ?
+                ORDER BY s.rowid
+                """,
+                (embedder,),
+            )
+            first = cursor.fetchone()
+            rows = [] if first is None else [(first["sid"], first["photo_hash"])]
+            first_vector = _unpack_embedding(first["embedding"]) if first is not None else None
+            dim = len(first_vector) if first_vector is not None else 0
+            rows += [(row["sid"], row["photo_hash"]) for row in cursor.fetchall()]
+            yield _gallery_header_bytes(
+                {
+                    "version": 0,
+                    "embedder": embedder,
+                    "dim": dim,
+                    "ids": [str(sid) for sid, _ in rows],
+                    "photos": [photo for _, photo in rows],
+                    "origin": FACENET_SYNC_ORIGIN,
+                }
+            )
+            cursor.execute(
+                """
+                SELECT s.embedding FROM students AS s
+                WHERE COALESCE(s.embedding, '') != '' AND s.embedding_version IS ?
+                ORDER BY s.rowid
+                """,
+                (embedder,),
+            )
+            while True:
+                rows = cursor.fetchmany(GALLERY_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield b"".join(_gallery_row_bytes(row[0], dim) for row in rows)
+        finally:
+            conn.rollback()
+
+def _push_gallery_delta(pk_col: str, pks: List[Any]) -> None:
+    """Merge the given students' current embeddings into facenet's gallery."""
+    with closing(get_connection()) as conn:
+        cursor = conn.cursor()
+        pk_expr = _pk_select_expr("s", _students_pk_info(cursor))
+        placeholders = ", ".join("?" for _ in pks)
+        cursor.execute(
+            f"""
+            SELECT {pk_expr} AS sid, s.embedding, s.embedding_version, s.photo_hash FROM students AS s
+            WHERE s."{pk_col}" IN ({placeholders}) AND COALESCE(s.embedding, '') != ''
+            """,
+            pks,
+        )
+        rows = cursor.fetchall()
+    groups: Dict[Optional[str], List[sqlite3.Row]] = {}
+    for row in rows:
+        groups.setdefault(row["embedding_version"], []).append(row)
+    for embedder, group in groups.items():
+        first_vector = _unpack_embedding(group[0]["embedding"])
+        if first_vector is None:
+            continue
+        dim = len(first_vector)
+        header = {
+            "version": 0,
+            "embedder": embedder,
+            "dim": dim,
+            "ids": [str(row["sid"]) for row in group],
+            "photos": [row["photo_hash"] for row in group],
+            "origin": FACENET_SYNC_ORIGIN,
+        }
+        blob = _gallery_header_bytes(header) + b"".join(
+            _gallery_row_bytes(row["embedding"], dim) for row in group
+        )
+        r = _facenet.post("/gallery/import", params={"mode": "merge"}, data=blob, timeout=30)
+        if r.status_code != 200:
+            raise RuntimeError(f"facenet gallery import failed ({r.status_code}): {r.text}")
+
+def _push_gallery_snapshot() -> Dict[str, Any]:
+    """Replace facenet's gallery with this database's, streamed without buffering."""
+    try:
+        r = _facenet.post(
+            "/gallery/import",
+            params={"mode": "replace"},
+            data=_gallery_export_chunks(),
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=300,
+            retry=False,  # a generator body cannot be replayed
+        )
+    except requests.RequestException as exc:
+        raise RuntimeError(f"facenet service unavailable: {exc}") from exc
+    if r.status_code != 200:
+        raise RuntimeError(f"facenet gallery import failed ({r.status_code}): {r.text}")
+    return r.json()
+
+def _schedule_gallery_push(pk_col: Optional[str] = None, pks: Optional[List[Any]] = None) -> None:
+    """Best-effort push after commit; without pks the whole gallery is replaced."""
+    if not FACENET_SYNC:
+        return
+
+    def push() -> None:
+        try:
+            if pks:
+                _push_gallery_delta(pk_col or "rowid", pks)
+            else:
+                _push_gallery_snapshot()
+        except Exception as exc:
+            print(f"gallery push failed: {exc}", flush=True)
+
+    _sync_pool.submit(push)
+
+def _pull_photo(digest: Optional[str]) -> Optional[str]:
+    """
+    Copy a facenet enrollment photo into the photo store so a later re-embed
+    starts from it. Returns its digest, or None when facenet has no photo for
+    the entry or it cannot be fetched (the re-embed job then reports the
+    student as missing a photo).
+    """
+    if not digest or len(digest) != 64 or not set(digest) <= set("0123456789abcdef"):
+        return None
+    if os.path.exists(_photo_path(digest)):
+        return digest
+    try:
+        r = _facenet.get(f"/gallery/photos/{digest}", timeout=30)
+    except requests.RequestException:
+        return None
+    if r.status_code != 200 or hashlib.sha256(r.content).hexdigest() != digest:
+        return None
+    return _store_photo(r.content)
+
+def _pull_gallery_changes() -> Dict[str, Any]:
+    """Copy embeddings enrolled directly on facenet since the last pull into students."""
+    with closing(get_connection()) as conn:
+        since = int(_get_setting(conn.cursor(), "facenet_sync_version") or 0)
+    try:
+        r = _facenet.get(
+            "/gallery/changes",
+            params={"since": since, "exclude_origin": FACENET_SYNC_ORIGIN},
+            timeout=30,
+        )
+    except requests.RequestException as exc:
+        raise RuntimeError(f"facenet service unavailable: {exc}") from exc
+    if r.status_code != 200:
+        raise RuntimeError(f"facenet gallery changes failed ({r.status_code}): {r.text}")
+    data = r.json()
+    version = int(data.get("version") or 0)
+    changes = data.get("changes") or []
+    if version < since:
+        # facenet lost its gallery (new pickle); start the feed over.
+        with closing(get_connection()) as conn:
+            _set_setting(conn.cursor(), "facenet_sync_version", "0")
+            conn.commit()
+        return _pull_gallery_changes() if version else {"version": 0, "applied": 0}
+
+    # Deletions are facenet-local (a re-embed dropped a photo-less entry); students stay.
+    # Ids go back to integers so the lookup can use the primary key's index.
+    updates = []
+    for change in changes:
+        if change.get("deleted") or not change.get("embedding"):
+            continue
+        try:
+            student_pk = int(change["studentId"])
+        except (TypeError, ValueError):
+            continue  # enrolled on facenet under an id that is not one of ours
+        updates.append(
+            {
+                "embedding": _pack_embedding(change["embedding"]),
+                "embedder": change.get("embedder"),
+                "photo": _pull_photo(change.get("photo")),
+                "pk": student_pk,
+            }
+        )
+    applied = 0
+    with closing(get_connection()) as conn:
+        cursor = conn.cursor()
+        info = _students_pk_info(cursor)
+        # Same key as _pk_select_expr's COALESCE(student_id, id), written so both indexes apply.
+        if info["has_student_id"] and info["has_id"]:
+            match = "student_id = :pk OR (student_id IS NULL AND id = :pk)"
+        elif info["pk_col"]:
+            match = f'"{info["pk_col"]}" = :pk'
+        else:
+            match = None
+        if updates and match:
+            cursor.executemany(
+                f"""
+                UPDATE students
+                SET embedding = :embedding, embedding_version = :embedder, photo_hash = :photo,
+                    embedding_next = NULL, embedding_next_version = NULL
+                WHERE {match}
+                """,
+                updates,
+            )
+            applied = cursor.rowcount
+        _set_setting(cursor, "facenet_sync_version", str(version))
+        conn.commit()
+    return {"version": version, "applied": applied}
+
+def _gallery_sync_loop() -> None:
+    while True:
+        time.sleep(FACENET_SYNC_INTERVAL)
+        try:
+            _pull_gallery_changes()
+        except Exception as exc:
+            print(f"gallery pull failed: {exc}", flush=True)
+
+@app.route("/api/gallery/export", methods=["GET"])
+def gallery_export():
+    """Binary snapshot of all student embeddings (GAL1); also a GALLERY_BOOTSTRAP_URL for facenet."""
+    return Response(_gallery_export_chunks(), mimetype="application/octet-stream")
+
+@app.route("/api/gallery/photos/<digest>", methods=["GET"])
+def gallery_photo(digest: str):
+    """An enrollment photo by the SHA-256 sent in gallery headers; facenet's GALLERY_PHOTO_URL."""
+    if len(digest) != 64 or not set(digest) <= set("0123456789abcdef"):
+        return jsonify({"error": "not a photo digest"}), 400
+    try:
+        blob = _read_photo(digest)
+    except OSError:
+        return jsonify({"error": "photo not found"}), 404
+    return Response(blob, mimetype="application/octet-stream")
+
+@app.route("/api/gallery/sync", methods=["POST"])
+def gallery_sync():
+    """
+    Force a sync with facenet_service.
+    Body: {"mode": "pull"} fetches facenet-side changes (default),
+          {"mode": "push"} replaces facenet's gallery with this database's.
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    mode = (payload.get("mode") or "pull").lower()
+    if mode not in ("pull", "push"):
+        return jsonify({"error": "mode must be pull or push"}), 400
+    if _facenet_local is not None:
+        return jsonify({"error": "facenet runs in-process without a gallery of its own; there is nothing to sync"}), 409
+    try:
+        result = _pull_gallery_changes() if mode == "pull" else _push_gallery_snapshot()
+    except RuntimeError as exc:
+        return jsonify({"error": str(exc)}), 502
+    return jsonify({"ok": True, "mode": mode, **result})
+
 # ----------------------------
 # Entrypoint
 # ----------------------------
 if __name__ == "__main__":
     print("DB_PATH:", DB_PATH, flush=True)
     init_db()
+    if sys.argv[1:] == ["migrate-embeddings"]:
+        print("converted:", _migrate_embedding_blobs(vacuum=True), flush=True)
+        sys.exit(0)
+    if sys.argv[1:] == ["dedupe-attendance"]:
+        with closing(get_connection()) as conn:
+            with conn:
+                cursor = conn.cursor()
+                print("duplicate attendance rows:", _attendance_duplicate_count(cursor), flush=True)
+                print("deleted:", _dedupe_attendance(cursor), flush=True)
+                print("unique index:", _ensure_attendance_unique_key(cursor), flush=True)
+            _invalidate_schema_cache()
+        sys.exit(0)
+    if sys.argv[1:] == ["rebuild-log-rollup"]:
+        with closing(get_connection()) as conn:
+            with conn:
+                print("rollup rows:", _rebuild_log_rollup(conn.cursor()), flush=True)
+        sys.exit(0)
     with closing(get_connection()) as conn:
         cur = conn.cursor()
         pk_info = _students_pk_info(cur)
     print("students PK:", pk_info, flush=True)
+    if _facenet_local is not None:
+        print("facenet: in-process from", FACENET_SERVICE_DIR, flush=True)
+    print("facenet endpoints:", sorted(_facenet.discover() or []) or "unknown", flush=True)
+    if AUDIT_LOG_ASYNC:
+        _audit_log.start()
+        # Docker/systemd stop with SIGTERM: exit normally so atexit drains the log queue.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    _reembed_job.resume()
+    threading.Thread(target=_migrate_embedding_blobs_in_background, daemon=True).start()
+    if FACENET_SYNC and FACENET_SYNC_INTERVAL > 0:
+        threading.Thread(target=_gallery_sync_loop, daemon=True).start()
     app.run(host="0.0.0.0", port=PORT)
@@ -0,0 +1,179 @@
+"""
+Shared HTTP client for facenet_service.
+
+One keep-alive requests.Session per process (its connection pool sized for the
+server's worker threads), endpoint capabilities read once from /health instead
+of probing with requests that 404, bounded retries with jittered backoff, and a
+circuit breaker that fails fast while the service is down.
+"""
+import random
+import threading
+import time
+from typing import Any, FrozenSet, Iterable, Optional, Set
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = (502, 503, 504)
+
+
+class FacenetUnavailable(requests.ConnectionError):
+    """facenet_service could not be reached, or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after `reset_timeout`
+    seconds one trial request is let through (half-open) and its outcome decides."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class FacenetClient:
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 16,
+        retries: int = 2,
+        backoff: float = 0.1,
+        failure_threshold: int = 5,
+        reset_timeout: float = 10.0,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self._endpoints: Optional[FrozenSet[str]] = None
+        self._discovered = False
+        self._missing: Set[str] = set()
+
+    # Capabilities
+    def discover(self) -> Optional[FrozenSet[str]]:
+        """
+        Read the endpoint list from /health once. None means unknown: the service
+        is unreachable (asked again next time) or predates the list (not asked again).
+        """
+        if self._discovered:
+            return self._endpoints
+        try:
+            r = self.request("GET", "/health", retry=False, timeout=5)
+        except requests.RequestException:
+            return None
+        if r.status_code != 200:
+            return None
+        try:
+            endpoints = r.json().get("endpoints")
+        except ValueError:
+            endpoints = None
+        with self.lock:
+            self._endpoints = frozenset(endpoints) if isinstance(endpoints, list) else None
+            self._discovered = True
+        return self._endpoints
+
+    def resolve(self, *paths: str) -> str:
+        """First of `paths` the service exposes (falls back to the last one)."""
+        endpoints = self.discover()
+        for path in paths:
+            if endpoints is not None and path in endpoints:
+                return path
+            if endpoints is None and path not in self._missing:
+                return path
+        return paths[-1]
+
+    def mark_missing(self, path: str) -> None:
+        """Remember a 404 from a service too old to list its endpoints."""
+        with self.lock:
+            self._missing.add(path)
+
+    # Requests
+    def request(self, method: str, path: str, *, retry: bool = True, **kwargs: Any) -> requests.Response:
+        """
+        Send one request through the pooled session. Connection failures and
+        502/503/504 are retried up to `retries` times with jittered exponential
+        backoff (pass retry=False for one-shot bodies such as generators); read
+        timeouts are not retried, since the service may already be processing.
+        """
+        if not self.breaker.allow():
+            raise FacenetUnavailable(f"facenet circuit open; retrying after {self.breaker.reset_timeout:g}s")
+        attempts = 1 + (self.retries if retry else 0)
+        last_error: Optional[Exception] = None
+        healthy = False
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+                try:
+                    response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+                except requests.ConnectionError as exc:  # includes ConnectTimeout
+                    last_error = exc
+                    continue
+                if response.status_code in RETRY_STATUSES and attempt + 1 < attempts:
+                    last_error = requests.HTTPError(f"{response.status_code} from {path}", response=response)
+                    continue
+                healthy = response.status_code not in RETRY_STATUSES
+                return response
+            raise FacenetUnavailable(str(last_error)) from last_error
+        finally:
+            # Whatever ended the attempt (including errors that are not
+            # RequestExceptions) is recorded, so a half-open trial is never left in flight.
+            if healthy:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def post_first(self, paths: Iterable[str], **kwargs: Any) -> requests.Response:
+        """POST to the first endpoint the service supports; a 404 from an
+        undiscovered service is remembered and the next candidate tried."""
+        candidates = list(paths)
+        while True:
+            path = self.resolve(*candidates)
+            response = self.post(path, **kwargs)
+            if response.status_code != 404 or path == candidates[-1] or self._endpoints is not None:
+                return response
+            self.mark_missing(path)
+            candidates = candidates[candidates.index(path) + 1:]
@@ -0,0 +1,105 @@
+"""
+facenet_service loaded into this process, for single-host deployments.
+
+Embedding calls the service's public functions (embedder_named, embed_bytes,
+embed_batch_bytes) directly: no HTTP round trip and no JSON float lists. The
+module is imported with FACENET_GALLERY=0, so facenet keeps no gallery of its
+own; the backend's gallery cache is the only copy and is not synced. Endpoints
+without a direct call (verify, health) go through facenet's WSGI app
+in-process, so the request()/get()/post() surface matches FacenetClient and
+callers need not care which one they hold.
+"""
+import importlib
+import io
+import os
+import sys
+import threading
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import numpy as np
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class LocalFacenet:
+    def __init__(self, service_dir: str) -> None:
+        self.service_dir = os.path.abspath(service_dir)
+        self.lock = threading.Lock()
+        self._module: Any = None
+
+    @property
+    def module(self) -> Any:
+        """facenet_service, imported on first use without its gallery."""
+        if self._module is None:
+            with self.lock:
+                if self._module is None:
+                    if self.service_dir not in sys.path:
+                        sys.path.insert(0, self.service_dir)
+                    os.environ["FACENET_GALLERY"] = "0"
+                    self._module = importlib.import_module("facenet_service")
+        return self._module
+
+    # Direct calls
+    def embed(
+        self, image_bytes: bytes, embedder: Optional[str] = None, device_id: Optional[str] = None
+    ) -> Tuple[np.ndarray, str]:
+        """Embedding and embedder version; raises ValueError for an unknown embedder or unreadable image."""
+        backend = self.module.embedder_named(embedder)
+        try:
+            vector, _ = self.module.embed_bytes(image_bytes, backend, device_id)
+        except Exception as exc:
+            raise ValueError(f"decode_failed: {exc}") from exc
+        return vector, backend.name
+
+    def embed_batch(
+        self, blobs: List[bytes], embedder: Optional[str] = None
+    ) -> Tuple[List[Optional[np.ndarray]], Dict[int, str], str]:
+        backend = self.module.embedder_named(embedder)
+        embeddings, errors = self.module.embed_batch_bytes(blobs, backend)
+        return embeddings, errors, backend.name
+
+    # FacenetClient-compatible surface
+    def discover(self) -> Optional[FrozenSet[str]]:
+        app = self.module.app
+        return frozenset(rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != "static")
+
+    def request(self, method: str, path: str, *, retry: bool = True, **kwargs: Any) -> requests.Response:
+        """Dispatch to facenet's WSGI app; returns a requests.Response like FacenetClient."""
+        params = kwargs.get("params")
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        body: Dict[str, Any] = {"headers": kwargs.get("headers") or {}}
+        if kwargs.get("json") is not None:
+            body["json"] = kwargs["json"]
+        elif kwargs.get("files"):
+            files = kwargs["files"]
+            fields: Dict[str, List[Any]] = {}
+            for field, value in files.items() if isinstance(files, dict) else files:
+                content_type = value[2] if len(value) > 2 else None
+                fields.setdefault(field, []).append((io.BytesIO(value[1]), value[0], content_type))
+            body["data"] = fields
+            body["content_type"] = "multipart/form-data"
+        elif kwargs.get("data") is not None:
+            data = kwargs["data"]
+            body["data"] = data if isinstance(data, (bytes, str)) else b"".join(data)
+        result = self.module.app.test_client().open(path, method=method, **body)
+        response = requests.Response()
+        response.status_code = result.status_code
+        response.headers = CaseInsensitiveDict(result.headers)
+        response._content = result.get_data()
+        response.url = path
+        return response
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def post_first(self, paths: Iterable[str], **kwargs: Any) -> requests.Response:
+        endpoints = self.discover() or frozenset()
+        candidates = list(paths)
+        path = next((candidate for candidate in candidates if candidate in endpoints), candidates[-1])
+        return self.post(path, **kwargs)
+
@@ -0,0 +1,389 @@
+"""Behaviour tests for run.py's caches, audit log writer and write routes.
+
+Usage (from backend-test/):
+    python -m pytest test_behaviour.py
+
+Uses the seeded database fixture from test_query_plans.py (40 students with
+8-d test embeddings, odd ids in class 1, even ids in class 2).
+"""
+import base64
+import io
+import json
+import os
+import sqlite3
+import zipfile
+
+import pytest
+
+import run
+from test_query_plans import client  # noqa: F401  (module-scoped seeded database)
+
+
+def _count(sql, params=()):
+    with sqlite3.connect(run.DB_PATH) as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+@pytest.fixture
+def spill_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "spill.jsonl")
+    monkeypatch.setattr(run, "AUDIT_LOG_SPILL_PATH", path)
+    return path
+
+
+# Audit log writer
+def test_audit_log_batch_keeps_rows_next_to_unstorable_one(client, spill_path):
+    writer = run._AuditLogWriter()
+    writer.start()
+    before = _count("SELECT COUNT(*) FROM attendance_logs WHERE source = 'gps'")
+    for student_id in (1, {"x": 1}, 2):
+        writer.submit("attendance_logs", [(student_id, 1, None, None, "gps", "2026-02-01T08:00:00")])
+    writer.flush()
+    writer.stop()
+    assert _count("SELECT COUNT(*) FROM attendance_logs WHERE source = 'gps'") == before + 3
+    assert _count("SELECT COUNT(*) FROM attendance_logs WHERE source = 'gps' AND student_id IS NULL") == 1
+    assert not os.path.exists(spill_path)
+
+
+def test_checkin_with_malformed_student_id_is_logged(client, spill_path):
+    before = _count("SELECT COUNT(*) FROM attendance_logs")
+    for student_id in (3, {"x": 1}, 5):
+        assert client.post("/api/attendance/checkin", json={"studentId": student_id}).status_code == 200
+    assert _count("SELECT COUNT(*) FROM attendance_logs") == before + 3
+
+
+def test_rejected_batch_spills_only_failing_rows_and_replays(client, spill_path):
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute(
+            """
+            CREATE TRIGGER reject_audit_source BEFORE INSERT ON attendance_logs
+            WHEN NEW.source = 'reject' BEGIN SELECT RAISE(ABORT, 'rejected'); END
+            """
+        )
+    try:
+        writer = run._AuditLogWriter()
+        before = _count("SELECT COUNT(*) FROM attendance_logs")
+        writer._write(
+            [
+                ("attendance_logs", (1, 1, None, None, "spill-test", "2026-02-02")),
+                ("attendance_logs", (2, 1, None, None, "reject", "2026-02-02")),
+                ("attendance_logs", (3, 1, None, None, "spill-test", "2026-02-02")),
+            ]
+        )
+        assert _count("SELECT COUNT(*) FROM attendance_logs") == before + 2
+        with open(spill_path, encoding="utf-8") as handle:
+            spilled = [json.loads(line) for line in handle]
+        assert spilled == [["attendance_logs", [2, 1, None, None, "reject", "2026-02-02"]]]
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("DROP TRIGGER reject_audit_source")
+
+    # A spill line from before values were checked: replays with the bad value as NULL.
+    with open(spill_path, "a", encoding="utf-8") as handle:
+        handle.write(json.dumps(["attendance_logs", [{"x": 1}, 1, None, None, "spill-test", "2026-02-02"]]) + "\n")
+    writer._replay_spill()
+    assert not os.path.exists(spill_path)
+    assert _count("SELECT COUNT(*) FROM attendance_logs WHERE source = 'reject'") == 1
+    assert _count("SELECT COUNT(*) FROM attendance_logs WHERE source = 'spill-test' AND student_id IS NULL") == 1
+
+
+# Gallery cache
+def _axis(i, dim=8):
+    vector = [0.0] * dim
+    vector[i] = 1.0
+    return vector
+
+
+def _best_match(vector, class_id=None):
+    matches = run._gallery_cache.top_k(vector, "test-8", 1, class_id)
+    return (matches[0][0]["studentId"], round(matches[0][1], 6)) if matches else None
+
+
+def test_gallery_cache_follows_register_and_embedding_update(client, monkeypatch):
+    vectors = iter([_axis(0), _axis(1)])
+    monkeypatch.setattr(
+        run, "_facenet_embed_from_bytes", lambda *args, **kwargs: (next(vectors), "test-8")
+    )
+    response = client.post(
+        "/api/register-student",
+        data={
+            "username": "gallery1", "password": "pw", "name": "Gallery One", "email": "g1@example.com",
+            "phone": "1", "rollNo": "RG1", "classCode": "C1", "course": "CS", "year": "1",
+            "photo": (io.BytesIO(b"gallery photo"), "g.jpg"),
+        },
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 201
+    student_id = _count("SELECT COALESCE(student_id, id) FROM students WHERE username = 'gallery1'")
+    assert _best_match(_axis(0)) == (student_id, 1.0)
+
+    photo = "data:image/jpeg;base64," + base64.b64encode(b"new photo").decode()
+    response = client.post(f"/api/students/{student_id}/embedding", json={"photo": photo})
+    assert response.status_code == 200
+    assert _best_match(_axis(1)) == (student_id, 1.0)
+    assert _best_match(_axis(0)) != (student_id, 1.0)
+
+
+def test_gallery_cache_sees_embedding_written_by_another_connection(client):
+    assert _best_match(_axis(2)) != (7, 1.0)
+    with sqlite3.connect(run.DB_PATH) as conn:
+        original = conn.execute("SELECT embedding FROM students WHERE id = 7").fetchone()[0]
+        conn.execute("UPDATE students SET embedding = ? WHERE id = 7", (run._pack_embedding(_axis(2)),))
+    assert _best_match(_axis(2)) == (7, 1.0)
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("UPDATE students SET embedding = ? WHERE id = 7", (original,))
+    assert _best_match(_axis(2)) != (7, 1.0)
+
+
+# Class-scoped matching
+@pytest.fixture
+def student_4_on_axis():
+    """Student 4 (class 2) holds a vector no other student is close to."""
+    with sqlite3.connect(run.DB_PATH) as conn:
+        original = conn.execute("SELECT embedding FROM students WHERE id = 4").fetchone()[0]
+        conn.execute("UPDATE students SET embedding = ? WHERE id = 4", (run._pack_embedding(_axis(4)),))
+    yield _axis(4)
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("UPDATE students SET embedding = ? WHERE id = 4", (original,))
+        conn.execute("DELETE FROM enrollments WHERE class_id = 1 AND student_id = 4")
+
+
+def test_class_scoped_match_only_considers_enrolled_students(client, student_4_on_axis):
+    assert _best_match(student_4_on_axis) == (4, 1.0)
+    assert _best_match(student_4_on_axis, class_id=2) == (4, 1.0)
+    assert _best_match(student_4_on_axis, class_id=1)[0] % 2 == 1
+
+
+def test_class_roster_follows_enroll_and_unenroll(client, student_4_on_axis):
+    assert _best_match(student_4_on_axis, class_id=1) != (4, 1.0)
+    assert client.post("/api/classes/1/enrollments", json={"studentIds": [4]}).status_code == 200
+    assert _best_match(student_4_on_axis, class_id=1) == (4, 1.0)
+    assert client.delete("/api/classes/1/enrollments", json={"studentIds": [4]}).status_code == 200
+    assert _best_match(student_4_on_axis, class_id=1) != (4, 1.0)
+
+
+def test_class_roster_follows_enrollment_from_another_connection(client, student_4_on_axis):
+    assert _best_match(student_4_on_axis, class_id=1) != (4, 1.0)
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("INSERT INTO enrollments (class_id, student_id) VALUES (1, 4)")
+    assert _best_match(student_4_on_axis, class_id=1) == (4, 1.0)
+
+
+def test_class_roster_follows_member_embedding_change(client, student_4_on_axis):
+    assert _best_match(student_4_on_axis, class_id=2) == (4, 1.0)
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("UPDATE students SET embedding = ? WHERE id = 4", (run._pack_embedding(_axis(5)),))
+    assert _best_match(_axis(5), class_id=2) == (4, 1.0)
+
+
+# Response cache
+def test_cached_listing_sees_write_from_another_connection(client):
+    first = client.get("/api/classes")
+    etag = first.headers["ETag"]
+    assert client.get("/api/classes", headers={"If-None-Match": etag}).status_code == 304
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("INSERT INTO classes (class_name) VALUES ('Written elsewhere')")
+    response = client.get("/api/classes", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
+    assert b"Written elsewhere" in response.get_data()
+
+
+def test_cached_roster_sees_enrollment_from_another_connection(client):
+    before = client.get("/api/class-students?class_id=1").get_json()["data"]["students"]
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("DELETE FROM enrollments WHERE class_id = 1 AND student_id = 1")
+    try:
+        after = client.get("/api/class-students?class_id=1").get_json()["data"]["students"]
+        assert len(after) == len(before) - 1
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("INSERT INTO enrollments (class_id, student_id) VALUES (1, 1)")
+
+
+# Bulk import
+def _import_files(usernames, emails):
+    header = "username,password,name,email,phone,rollNo,classCode,course,year\n"
+    lines = [f"{u},pw,{u},{e},1,{u.upper()},C1,CS,1\n" for u, e in zip(usernames, emails)]
+    photos = io.BytesIO()
+    with zipfile.ZipFile(photos, "w") as archive:
+        for username in usernames:
+            archive.writestr(f"{username}.jpg", b"photo " + username.encode())
+    photos.seek(0)
+    return {"csv": (io.BytesIO((header + "".join(lines)).encode()), "s.csv"), "photos": (photos, "p.zip")}
+
+
+def test_import_conflict_skips_only_the_conflicting_row(client, monkeypatch):
+    monkeypatch.setattr(
+        run, "_facenet_embed_batch", lambda images, embedder: ([[0.5] * 8 for _ in images], {}, "test-8")
+    )
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("CREATE UNIQUE INDEX test_students_email ON students (email)")
+    try:
+        response = client.post(
+            "/api/students/import",
+            data=_import_files(["imp1", "imp2", "imp3"], ["imp1@example.com", "s0@example.com", "imp3@example.com"]),
+            content_type="multipart/form-data",
+        )
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("DROP INDEX test_students_email")
+    body = response.get_json()
+    assert response.status_code == 201 and body["imported"] == 2
+    assert [row["status"] for row in body["rows"]] == ["created", "error", "created"]
+    assert "conflicts" in body["rows"][1]["error"]
+    assert _count("SELECT COUNT(*) FROM students WHERE username IN ('imp1', 'imp2', 'imp3')") == 2
+    assert _count("SELECT COUNT(*) FROM users WHERE username = 'imp2'") == 0
+
+
+# Embedder cutover
+def test_register_re_embeds_when_embedder_switches_mid_request(client, monkeypatch):
+    calls = []
+
+    def embed(photo_bytes, photo_type, embedder=None, **kwargs):
+        calls.append(embedder)
+        if len(calls) == 1:  # the re-embed job's cutover commits while facenet works
+            with sqlite3.connect(run.DB_PATH) as conn:
+                conn.execute("INSERT OR REPLACE INTO embedding_settings (key, value) VALUES ('active_embedder', 'next-8')")
+        return [0.25] * 8, embedder or "test-8"
+
+    monkeypatch.setattr(run, "_facenet_embed_from_bytes", embed)
+    try:
+        response = client.post(
+            "/api/register-student",
+            data={
+                "username": "cutover", "password": "pw", "name": "Cut Over", "email": "c@example.com",
+                "phone": "1", "rollNo": "RC", "classCode": "C1", "course": "CS", "year": "1",
+                "photo": (io.BytesIO(b"cutover photo"), "c.jpg"),
+            },
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 201, response.get_json()
+        assert calls == [None, "next-8"]
+        with sqlite3.connect(run.DB_PATH) as conn:
+            version = conn.execute("SELECT embedding_version FROM students WHERE username = 'cutover'").fetchone()[0]
+        assert version == "next-8"
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("DELETE FROM embedding_settings WHERE key = 'active_embedder'")
+
+
+# Bulk enrollments
+def test_enrollments_report_unresolved_and_ambiguous_keys(client):
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("INSERT INTO students (name, username, rollNo) VALUES ('Roll Twin', 'twin', 'R10')")
+    try:
+        response = client.post(
+            "/api/classes/2/enrollments",
+            json={"studentIds": [1, 9999], "rollNos": ["R2", "R10", "NOPE"]},
+        )
+        body = response.get_json()
+        assert response.status_code == 200, body
+        assert body["unresolved"] == {"studentIds": [9999], "rollNos": ["NOPE"]}
+        assert body["ambiguousRollNos"] == ["R10"]
+        assert body["resolved"] == 2 and body["enrolled"] == 2
+        assert _count("SELECT COUNT(*) FROM enrollments WHERE class_id = 2 AND student_id IN (1, 3)") == 2
+        assert _count("SELECT COUNT(*) FROM enrollments WHERE class_id = 2 AND student_id = 11") == 0
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("DELETE FROM students WHERE username = 'twin'")
+            conn.execute("DELETE FROM enrollments WHERE class_id = 2 AND student_id IN (1, 3)")
+
+
+def test_re_enrolling_is_idempotent(client):
+    before = _count("SELECT COUNT(*) FROM enrollments WHERE class_id = 1")
+    first = client.post("/api/classes/1/enrollments", json={"studentIds": [2]}).get_json()
+    again = client.post("/api/classes/1/enrollments", json={"studentIds": [2], "rollNos": ["R1"]}).get_json()
+    assert (first["enrolled"], first["unchanged"]) == (1, 0)
+    assert (again["resolved"], again["enrolled"], again["unchanged"]) == (1, 0, 1)
+    assert _count("SELECT COUNT(*) FROM enrollments WHERE class_id = 1") == before + 1
+    removed = client.delete("/api/classes/1/enrollments", json={"studentIds": [2]}).get_json()
+    assert removed["removed"] == 1
+    assert client.delete("/api/classes/1/enrollments", json={"studentIds": [2]}).get_json()["removed"] == 0
+    assert _count("SELECT COUNT(*) FROM enrollments WHERE class_id = 1") == before
+
+
+def test_reembed_result_for_replaced_photo_is_not_kept(client, monkeypatch):
+    batches = []
+
+    def embed_batch(images, target):
+        batches.append([digest for digest, _ in images])
+        if len(batches) == 1:  # student 2 is re-photographed while the first batch runs
+            with sqlite3.connect(run.DB_PATH) as conn:
+                conn.execute(
+                    "UPDATE students SET photo_hash = 'p2-new', embedding_next = NULL, "
+                    "embedding_next_version = NULL WHERE id = 2"
+                )
+        return [_axis(len(batches) - 1) for _ in images], {}, "next-8"
+
+    monkeypatch.setattr(run, "_facenet_embed_batch", embed_batch)
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("UPDATE students SET photo_hash = 'p' || id, student_id = id WHERE id IN (1, 2)")
+    try:
+        job = run._ReembedJob()
+        job._run("next-8", False)
+        assert job.status == "blocked", job.error  # the other seeded students have no photo
+        # (students registered by earlier tests have real photo digests; only ours start with "p")
+        ours = [[digest for digest in batch if digest.startswith("p")] for batch in batches]
+        assert ours == [["p1", "p2"], ["p2-new"]]
+        with sqlite3.connect(run.DB_PATH) as conn:
+            rows = dict(conn.execute("SELECT id, embedding_next FROM students WHERE id IN (1, 2)").fetchall())
+        assert rows == {1: run._pack_embedding(_axis(0)), 2: run._pack_embedding(_axis(1))}
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("UPDATE students SET photo_hash = NULL, student_id = NULL WHERE id IN (1, 2)")
+            conn.execute("UPDATE students SET embedding_next = NULL, embedding_next_version = NULL")
+
+
+# Gallery export
+def test_gallery_export_carries_photo_digests_that_can_be_fetched(client):
+    digest = run._store_photo(b"export photo")
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("UPDATE students SET photo_hash = ? WHERE id = 3", (digest,))
+    try:
+        response = client.get("/api/gallery/export")
+        header_len = int.from_bytes(response.data[4:8], "little")
+        header = json.loads(response.data[8:8 + header_len])
+        photos = dict(zip(header["ids"], header["photos"]))
+        assert photos["3"] == digest
+        assert photos["5"] is None
+        assert client.get(f"/api/gallery/photos/{digest}").data == b"export photo"
+        assert client.get("/api/gallery/photos/" + "0" * 64).status_code == 404
+        assert client.get("/api/gallery/photos/nope").status_code == 400
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("UPDATE students SET photo_hash = NULL WHERE id = 3")
+
+
+# Manual attendance
+def test_manual_attendance_works_without_the_unique_index(client):
+    with sqlite3.connect(run.DB_PATH) as conn:
+        conn.execute("DROP INDEX idx_attendance_class_student_date")
+        conn.executemany(
+            "INSERT INTO attendance (student_id, class_id, date, time, status) VALUES (1, 1, '2026-02-01', ?, 'absent')",
+            [("09:00:00",), ("09:05:00",)],
+        )
+    run._invalidate_schema_cache()
+    try:
+        records = [
+            {"studentId": 1, "status": "late"},
+            {"studentId": 3, "status": "absent"},
+            {"studentId": 3, "status": "present"},
+        ]
+        response = client.post(
+            "/api/attendance/manual", json={"classId": 1, "date": "2026-02-01", "time": "10:00", "records": records}
+        )
+        assert response.status_code == 200, response.get_data(as_text=True)
+        body = response.get_json()
+        assert (body["created"], body["updated"]) == (1, 2)
+        with sqlite3.connect(run.DB_PATH) as conn:
+            rows = conn.execute(
+                "SELECT student_id, time, status FROM attendance WHERE date = '2026-02-01' ORDER BY id"
+            ).fetchall()
+        assert rows == [(1, "10:00:00", "late"), (1, "10:00:00", "late"), (3, "10:00:00", "present")]
+    finally:
+        with sqlite3.connect(run.DB_PATH) as conn:
+            conn.execute("DELETE FROM attendance WHERE date = '2026-02-01'")
+            conn.execute(
+                "CREATE UNIQUE INDEX idx_attendance_class_student_date ON attendance (class_id, student_id, date)"
+            )
+        run._invalidate_schema_cache()
@@ -0,0 +1,196 @@
+"""EXPLAIN QUERY PLAN regression test for the hot SQLite queries in run.py.
+
+Usage (from backend-test/):
+    python -m pytest test_query_plans.py
+
+Each hot route runs once against a seeded database while every SELECT it
+issues is captured (with its bound values). The test fails if any of those
+plans a full table scan that the route does not need by design.
+"""
+import os
+import re
+import sqlite3
+
+import numpy as np
+import pytest
+
+import run
+
+# "SCAN t USING [COVERING] INDEX ..." walks an index and "SCAN t VIRTUAL TABLE ..." is an
+# FTS lookup; a bare "SCAN t" reads the whole table.
+FULL_SCAN = re.compile(r"^SCAN (\w+)\b(?! USING| VIRTUAL TABLE)")
+
+# route -> {table or alias: why a full pass is inherent}
+ALLOWED_SCANS = {
+    "/api/students": {"s": "lists every student"},
+    "/api/classes": {"c": "lists every class"},
+    "/api/attendance/latest": {"a": "rowid order, stops after LIMIT 20"},
+    "/api/attendance/summary": {"attendance_log_rollup": "one row per source per day"},
+}
+
+HOT_GETS = [
+    "/api/students",
+    "/api/students?classId=1",
+    "/api/students?q=student 3",
+    "/api/class-students?class_id=1",
+    "/api/classes",
+    "/api/classes?class_id=1&with_students=1",
+    "/api/attendance/history",
+    "/api/attendance/history?classId=1",
+    "/api/attendance/history?from=2026-01-03&to=2026-01-05",
+    "/api/attendance/history?classId=1&from=2026-01-03&page=2",
+    "/api/attendance/history?student=student 1",
+    "/api/attendance/history?classId=1&student=s12",
+    "/api/attendance/history/export?classId=1",
+    "/api/attendance/history/export?from=2026-01-03&to=2026-01-05",
+    "/api/attendance/latest",
+    "/api/attendance/summary",
+    "/api/attendance/summary?from=2026-01-01",
+]
+
+STUDENTS = 40
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("plans")
+    run.DB_DIR = str(workdir)
+    run.DB_PATH = os.path.join(str(workdir), "plans.db")
+    run.PHOTO_STORE_DIR = os.path.join(str(workdir), "photos")
+    run.FACENET_SYNC = False
+    conn = sqlite3.connect(run.DB_PATH)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE, password_hash TEXT, role TEXT)")
+    conn.execute(
+        """
+        CREATE TABLE students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, username TEXT UNIQUE, password TEXT,
+            name TEXT, email TEXT, phone TEXT, roll_no TEXT, class_code TEXT, rollNo TEXT, classCode TEXT,
+            course TEXT, year INTEGER, embedding TEXT, created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE attendance (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER NOT NULL, class_id INTEGER NOT NULL,
+            date TEXT NOT NULL, time TEXT, status TEXT NOT NULL, recognized_name TEXT,
+            source TEXT DEFAULT 'manual', remark TEXT, created_at TEXT, updated_at TEXT
+        )
+        """
+    )
+    conn.commit()
+    conn.close()
+    run.init_db()
+
+    rng = np.random.default_rng(0)
+    conn = sqlite3.connect(run.DB_PATH)
+    conn.executemany(
+        "INSERT INTO students (name, roll_no, email, username, embedding, embedding_version) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (f"Student {i}", f"R{i}", f"s{i}@example.com", f"s{i}", run._pack_embedding(rng.random(8)), "test-8")
+            for i in range(STUDENTS)
+        ],
+    )
+    conn.executemany("INSERT INTO classes (class_name) VALUES (?)", [("Math",), ("Physics",)])
+    conn.executemany(
+        "INSERT INTO enrollments (class_id, student_id) VALUES (?, ?)",
+        [(i % 2 + 1, i + 1) for i in range(STUDENTS)],
+    )
+    conn.executemany(
+        """
+        INSERT INTO attendance (student_id, class_id, date, time, status, source, created_at, updated_at)
+        VALUES (?, ?, ?, '09:00:00', 'present', 'manual', '2026-01-01T09:00:00', '2026-01-01T09:00:00')
+        """,
+        [(i + 1, i % 2 + 1, f"2026-01-{day:02d}") for day in range(1, 8) for i in range(STUDENTS)],
+    )
+    conn.executemany(
+        "INSERT INTO attendance_logs (student_id, matched, source, created_at) VALUES (?, 1, 'manual', '2026-01-01')",
+        [(i + 1,) for i in range(STUDENTS)],
+    )
+    conn.commit()
+    conn.close()
+    return run.app.test_client()
+
+
+@pytest.fixture
+def captured(monkeypatch):
+    """SELECTs issued through get_connection() while the test runs."""
+    statements = []
+    get_connection = run.get_connection
+
+    def traced(*args, **kwargs):
+        conn = get_connection(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(run, "get_connection", traced)
+    yield statements
+    for pool in (run._write_pool, run._read_pool):
+        for conn in pool.idle:
+            conn.set_trace_callback(None)
+
+
+def _full_scans(sql):
+    with sqlite3.connect(run.DB_PATH) as conn:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [match.group(1) for _, _, _, detail in plan if (match := FULL_SCAN.match(detail))]
+
+
+def _assert_no_full_scans(route, statements):
+    allowed = ALLOWED_SCANS.get(route.split("?")[0], {})
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+    assert selects, f"{route} issued no SELECT"
+    for sql in selects:
+        # Schema reads and FTS5's own statements on its shadow tables ('main'.'x_fts_...').
+        if "sqlite_master" in sql or "'main'." in sql:
+            continue
+        scanned = [table for table in _full_scans(sql) if table not in allowed]
+        assert not scanned, f"{route}: full scan of {scanned} in\n{sql}"
+
+
+@pytest.mark.parametrize("route", HOT_GETS)
+def test_get_routes_use_indexes(client, captured, route):
+    response = client.get(route)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    _assert_no_full_scans(route, captured)
+
+
+@pytest.mark.parametrize("filters", ["", "&classId=1", "&from=2026-01-02"])
+def test_history_cursor_pages_use_indexes(client, captured, filters):
+    first = client.get(f"/api/attendance/history?perPage=30&total=none{filters}").get_json()
+    next_cursor = first["meta"]["nextCursor"]
+    assert next_cursor
+    captured.clear()
+    response = client.get(f"/api/attendance/history?perPage=30&total=none&cursor={next_cursor}{filters}")
+    assert response.status_code == 200, response.get_data(as_text=True)
+    _assert_no_full_scans("/api/attendance/history", captured)
+
+
+def test_manual_attendance_uses_indexes(client, captured):
+    records = [{"studentId": sid, "status": "present"} for sid in range(1, STUDENTS + 1, 2)]
+    response = client.post("/api/attendance/manual", json={"classId": 1, "date": "2026-01-07", "records": records})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    _assert_no_full_scans("/api/attendance/manual", captured)
+
+
+def test_attendance_mark_uses_indexes(client, captured, monkeypatch):
+    with sqlite3.connect(run.DB_PATH) as conn:
+        stored = conn.execute("SELECT embedding FROM students WHERE id = 3").fetchone()[0]
+    probe = run._unpack_embedding(stored).tolist()
+    monkeypatch.setattr(run, "_facenet_embed_from_bytes", lambda *args, **kwargs: (probe, "test-8"))
+    response = client.post("/api/attendance/mark", json={"image": "data:image/jpeg;base64,AA==", "classId": 1})
+    body = response.get_json()
+    assert body["matched"] and body["attendanceRecorded"], body
+    _assert_no_full_scans("/api/attendance/mark", captured)
+
+
+def test_cached_get_revalidates_without_sqlite(client, captured):
+    first = client.get("/api/classes")
+    etag = first.headers["ETag"]
+    captured.clear()
+    response = client.get("/api/classes", headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.headers["ETag"] == etag
+    assert not captured, captured
+    client.post("/api/classes", json={"className": "Chemistry"})
+    response = client.get("/api/classes", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["ETag"] != etag
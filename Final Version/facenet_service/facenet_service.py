@@ -1,13 +1,22 @@
 ﻿"""Minimal FaceNet-like microservice with deterministic embeddings."""
 import base64
+import bisect
+import hashlib
 import io
+import json
 import os
 import pickle
+import struct
 import threading
-from typing import Dict, List, Tuple, Optional, Union
+import time
+import urllib.request
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Tuple, Optional, Union
 
 import numpy as np
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import WSGIRequestHandler
 from PIL import Image
 
 # -----------------------------
@@ -19,32 +28,184 @@ EMBEDDINGS_PATH = os.getenv(
     os.path.join(os.path.dirname(os.path.abspath(__file__)), "embeddings.pkl"),
 )
 PORT = int(os.getenv("PORT", "5001"))
+# Embedding backend: "pixel" (raw 64x64 RGB), "hog" or "lbp". Each stored vector
+# records the embedder that produced it; vectors from another embedder are not matched.
+EMBEDDER = os.getenv("EMBEDDER", "pixel").strip().lower()
+# Enrollment photos are kept by content hash so the gallery can be re-embedded
+# when the embedder changes, without asking students to upload again.
+PHOTO_STORE_DIR = os.getenv(
+    "PHOTO_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "photos"),
+)
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "32"))
+REEMBED_WORKERS = int(os.getenv("REEMBED_WORKERS", "4"))
+REEMBED_CHECKPOINT_PATH = EMBEDDINGS_PATH + ".reembed"
+# Enrollment reports existing students whose cosine similarity to the new face
+# is at least DUPLICATE_SIMILARITY (top DUPLICATE_TOP_K candidates).
+DUPLICATE_SIMILARITY = float(os.getenv("DUPLICATE_SIMILARITY", "0.92"))
+DUPLICATE_TOP_K = int(os.getenv("DUPLICATE_TOP_K", "5"))
+# A cold node with an empty gallery pulls one binary snapshot from here at startup
+# (another facenet's /gallery/export or the backend's /api/gallery/export).
+GALLERY_BOOTSTRAP_URL = os.getenv("GALLERY_BOOTSTRAP_URL", "")
+# Imported entries keep the photo digest sent with them; a photo missing from
+# PHOTO_STORE_DIR is fetched from GALLERY_PHOTO_URL + digest when it is first read
+# (another facenet's /gallery/photos/ or the backend's /api/gallery/photos/).
+GALLERY_PHOTO_URL = os.getenv("GALLERY_PHOTO_URL", "")
+# FACENET_GALLERY=0 skips loading the gallery pickle at import: a backend that
+# imports this module only for embedding keeps the one gallery it matches against.
+GALLERY_ENABLED = os.getenv("FACENET_GALLERY", "1") != "0"
+
+# Frame dedup: consecutive webcam frames whose perceptual hash is within
+# FRAME_DEDUP_MAX_DISTANCE bits of a recent frame reuse that frame's result.
+DEVICE_ID_HEADER = os.getenv("DEVICE_ID_HEADER", "X-Device-Id")
+FRAME_DEDUP_ENABLED = os.getenv("FRAME_DEDUP_ENABLED", "1").lower() not in ("0", "false", "no")
+FRAME_DEDUP_MAX_DISTANCE = int(os.getenv("FRAME_DEDUP_MAX_DISTANCE", "4"))
+FRAME_DEDUP_WINDOW = int(os.getenv("FRAME_DEDUP_WINDOW", "8"))
+FRAME_DEDUP_TTL = float(os.getenv("FRAME_DEDUP_TTL", "5.0"))
+FRAME_DEDUP_MAX_DEVICES = int(os.getenv("FRAME_DEDUP_MAX_DEVICES", "256"))
 
 # -----------------------------
 # App / State
 # -----------------------------
 app = Flask(__name__)
+# Everything below is per process and only the pickle is shared, so the service
+# must run as a single (threaded) worker; see Dockerfile.facenet.
 _embeddings: Dict[str, np.ndarray] = {}
+_embedders: Dict[str, str] = {}
+_photos: Dict[str, str] = {}
+# Who wrote an entry through /gallery/import (e.g. "backend"); None for local enrollments.
+_origins: Dict[str, str] = {}
 _lock = threading.Lock()
+# Bumped on every gallery write so cached recognition results go stale. It is
+# also the change-feed cursor: each entry and tombstone carries the version of
+# its last write, and _change_log lists (version, id) in write order.
+_gallery_version = 0
+_entry_versions: Dict[str, int] = {}
+_tombstones: Dict[str, int] = {}
+_change_log: List[Tuple[int, str]] = []
 
 # -----------------------------
 # Persistence
 # -----------------------------
 def _load_embeddings() -> None:
+    """Load the gallery; legacy entries are bare vectors, newer ones carry their embedder."""
     if os.path.exists(EMBEDDINGS_PATH):
         with open(EMBEDDINGS_PATH, "rb") as handle:
             raw = pickle.load(handle)
+        global _gallery_version
         with _lock:
             _embeddings.clear()
+            _embedders.clear()
+            _photos.clear()
+            _origins.clear()
+            _entry_versions.clear()
+            _tombstones.clear()
             for key, value in raw.items():
-                _embeddings[key] = np.asarray(value, dtype="float32")
+                if isinstance(value, dict) and value.get("deleted"):
+                    _tombstones[key] = int(value.get("version") or 1)
+                    continue
+                if isinstance(value, dict):
+                    vector = np.asarray(value["embedding"], dtype="float32")
+                    embedder = value.get("embedder") or _legacy_embedder_name(vector)
+                    if value.get("photo"):
+                        _photos[key] = value["photo"]
+                    if value.get("origin"):
+                        _origins[key] = value["origin"]
+                    version = int(value.get("version") or 1)
+                else:
+                    vector = np.asarray(value, dtype="float32")
+                    embedder = _legacy_embedder_name(vector)
+                    version = 1
+                _embeddings[key] = vector
+                _embedders[key] = embedder
+                _entry_versions[key] = version
+            _gallery_version = max([*_entry_versions.values(), *_tombstones.values(), 0])
+            _rebuild_change_log()
 
 
 def _save_embeddings() -> None:
+    if not GALLERY_ENABLED:
+        return  # never loaded, so writing would clobber the pickle with a partial gallery
     with _lock:
-        serializable = {k: v.tolist() for k, v in _embeddings.items()}
-    with open(EMBEDDINGS_PATH, "wb") as handle:
-        pickle.dump(serializable, handle)
+        serializable: Dict[str, Any] = {
+            k: {
+                "embedding": v.tolist(),
+                "embedder": _embedders.get(k) or _legacy_embedder_name(v),
+                "photo": _photos.get(k),
+                "origin": _origins.get(k),
+                "version": _entry_versions.get(k, _gallery_version),
+            }
+            for k, v in _embeddings.items()
+        }
+        for k, version in _tombstones.items():
+            serializable[k] = {"deleted": True, "version": version}
+    _write_pickle(EMBEDDINGS_PATH, serializable)
+
+
+def _rebuild_change_log() -> None:
+    """Caller holds _lock."""
+    _change_log[:] = sorted(
+        [(version, sid) for sid, version in _entry_versions.items()]
+        + [(version, sid) for sid, version in _tombstones.items()]
+    )
+
+
+def _log_change(student_id: str, deleted: bool = False) -> None:
+    """Stamp an entry (or its deletion) with the current _gallery_version. Caller holds _lock."""
+    if deleted:
+        _tombstones[student_id] = _gallery_version
+        _entry_versions.pop(student_id, None)
+    else:
+        _entry_versions[student_id] = _gallery_version
+        _tombstones.pop(student_id, None)
+    _change_log.append((_gallery_version, student_id))
+    # Superseded log entries are skipped by the feed; compact once they dominate.
+    if len(_change_log) > 2 * (len(_entry_versions) + len(_tombstones)) + 1024:
+        _rebuild_change_log()
+
+
+def _write_pickle(path: str, value: Any) -> None:
+    """Write via a temp file so a crash never leaves a truncated pickle behind."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as handle:
+        pickle.dump(value, handle)
+    os.replace(tmp_path, path)
+
+
+def _legacy_embedder_name(vector: np.ndarray) -> str:
+    return PixelEmbedder.name if vector.size == PixelEmbedder.dim else f"unknown-{vector.size}"
+
+
+def _photo_path(digest: str) -> str:
+    return os.path.join(PHOTO_STORE_DIR, digest[:2], digest)
+
+
+def _store_photo(blob: bytes) -> str:
+    """Save an enrollment photo under its SHA-256 and return the digest."""
+    digest = hashlib.sha256(blob).hexdigest()
+    path = _photo_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        with open(tmp_path, "wb") as handle:
+            handle.write(blob)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def _read_photo(digest: str) -> bytes:
+    try:
+        with open(_photo_path(digest), "rb") as handle:
+            return handle.read()
+    except FileNotFoundError:
+        if not GALLERY_PHOTO_URL:
+            raise
+    with urllib.request.urlopen(GALLERY_PHOTO_URL + digest, timeout=30) as response:
+        blob = response.read()
+    if hashlib.sha256(blob).hexdigest() != digest:
+        raise ValueError(f"photo fetched for {digest} does not match its digest")
+    _store_photo(blob)
+    return blob
 
 # -----------------------------
 # Image / Embedding helpers
@@ -74,15 +235,241 @@ def _decode_image(source: Union[bytes, str]) -> np.ndarray:
     return bgr
 
 
+def _l2_normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _gray_batch(images_bgr: List[np.ndarray], size: int) -> np.ndarray:
+    """Stack images as an (n, size, size) float32 grayscale batch."""
+    batch = np.empty((len(images_bgr), size, size), dtype="float32")
+    for i, image_bgr in enumerate(images_bgr):
+        gray = Image.fromarray(image_bgr[:, :, ::-1]).convert("L").resize((size, size))
+        batch[i] = np.asarray(gray, dtype="float32")
+    return batch
+
+
+class Embedder:
+    """Maps a batch of BGR images to an (n, dim) float32 matrix of L2-normalized rows."""
+
+    name = "base"
+    dim = 0
+
+    def embed_batch(self, images_bgr: List[np.ndarray]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed(self, image_bgr: np.ndarray) -> np.ndarray:
+        return self.embed_batch([image_bgr])[0]
+
+
+class PixelEmbedder(Embedder):
+    """Deterministic 64x64 RGB pixels (12,288 dims)."""
+
+    name = "pixel-64"
+    dim = 64 * 64 * 3
+
+    def embed_batch(self, images_bgr: List[np.ndarray]) -> np.ndarray:
+        batch = np.empty((len(images_bgr), self.dim), dtype="float32")
+        for i, image_bgr in enumerate(images_bgr):
+            resized = Image.fromarray(image_bgr[:, :, ::-1]).resize((64, 64))
+            batch[i] = np.asarray(resized, dtype="float32").reshape(-1)
+        return _l2_normalize_rows(batch)
+
+
+class HogEmbedder(Embedder):
+    """Histogram of oriented gradients: 64x64 gray, 16px cells, 9 bins, 2x2 L2-Hys blocks (324 dims)."""
+
+    name = "hog-324"
+    size = 64
+    cell = 16
+    bins = 9
+    dim = 3 * 3 * 2 * 2 * 9
+
+    def embed_batch(self, images_bgr: List[np.ndarray]) -> np.ndarray:
+        gray = _gray_batch(images_bgr, self.size)
+        n = gray.shape[0]
+        gx = np.zeros_like(gray)
+        gy = np.zeros_like(gray)
+        gx[:, :, 1:-1] = gray[:, :, 2:] - gray[:, :, :-2]
+        gy[:, 1:-1, :] = gray[:, 2:, :] - gray[:, :-2, :]
+        magnitude = np.hypot(gx, gy)
+        # Unsigned orientation in [0, 180) split into `bins` buckets.
+        orientation = (np.degrees(np.arctan2(gy, gx)) % 180.0) * (self.bins / 180.0)
+        bucket = np.minimum(orientation.astype("int64"), self.bins - 1)
+
+        cells = self.size // self.cell
+        cell_index = (np.arange(self.size) // self.cell)
+        flat = (
+            np.arange(n)[:, None, None] * (cells * cells * self.bins)
+            + (cell_index[None, :, None] * cells + cell_index[None, None, :]) * self.bins
+            + bucket
+        )
+        hist = np.bincount(flat.ravel(), weights=magnitude.ravel(), minlength=n * cells * cells * self.bins)
+        hist = hist.reshape(n, cells, cells, self.bins).astype("float32")
+
+        blocks = np.concatenate(
+            [hist[:, :-1, :-1], hist[:, :-1, 1:], hist[:, 1:, :-1], hist[:, 1:, 1:]], axis=-1
+        ).reshape(n, (cells - 1) * (cells - 1), 4 * self.bins)
+        blocks /= np.linalg.norm(blocks, axis=-1, keepdims=True) + 1e-6
+        np.minimum(blocks, 0.2, out=blocks)
+        blocks /= np.linalg.norm(blocks, axis=-1, keepdims=True) + 1e-6
+        return _l2_normalize_rows(blocks.reshape(n, -1))
+
+
+def _uniform_lbp_table() -> np.ndarray:
+    """Map the 256 8-bit LBP codes to 59 bins: one per uniform pattern plus one shared bin."""
+    table = np.full(256, 58, dtype="int64")
+    next_bin = 0
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        transitions = sum(bits[i] != bits[(i + 1) % 8] for i in range(8))
+        if transitions <= 2:
+            table[code] = next_bin
+            next_bin += 1
+    return table
+
+
+class LbpEmbedder(Embedder):
+    """Uniform LBP histograms over a 3x3 grid of a 66x66 gray image (531 dims)."""
+
+    name = "lbp-531"
+    size = 66
+    grid = 3
+    bins = 59
+    dim = 3 * 3 * 59
+    _table = _uniform_lbp_table()
+
+    def embed_batch(self, images_bgr: List[np.ndarray]) -> np.ndarray:
+        gray = _gray_batch(images_bgr, self.size)
+        n = gray.shape[0]
+        center = gray[:, 1:-1, 1:-1]
+        h, w = center.shape[1:]
+        codes = np.zeros(center.shape, dtype="int64")
+        offsets = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+        for bit, (dy, dx) in enumerate(offsets):
+            neighbour = gray[:, 1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+            codes |= (neighbour >= center).astype("int64") << bit
+        patterns = self._table[codes]
+
+        region_y = np.arange(h) * self.grid // h
+        region_x = np.arange(w) * self.grid // w
+        flat = (
+            np.arange(n)[:, None, None] * (self.grid * self.grid * self.bins)
+            + (region_y[None, :, None] * self.grid + region_x[None, None, :]) * self.bins
+            + patterns
+        )
+        hist = np.bincount(flat.ravel(), minlength=n * self.grid * self.grid * self.bins)
+        hist = hist.reshape(n, -1).astype("float32")
+        # Square root dampens the dominant flat-region bins before normalization.
+        return _l2_normalize_rows(np.sqrt(hist))
+
+
+EMBEDDER_BACKENDS: Dict[str, type] = {
+    "pixel": PixelEmbedder,
+    "hog": HogEmbedder,
+    "lbp": LbpEmbedder,
+}
+
+
+def _make_embedder(name: str) -> Embedder:
+    """Resolve a backend key ("hog") or embedder version ("hog-324")."""
+    for key, backend in EMBEDDER_BACKENDS.items():
+        if name in (key, backend.name):
+            return backend()
+    raise ValueError(f"unknown EMBEDDER {name!r}; expected one of {sorted(EMBEDDER_BACKENDS)}")
+
+
+# The embedder the live gallery is in. It only differs from EMBEDDER while a
+# gallery built with an older embedder waits to be re-embedded.
+_embedder = _make_embedder(EMBEDDER)
+
+
 def _compute_embedding(image_bgr: np.ndarray) -> np.ndarray:
-    """Deterministic 64x64 L2-normalized vector."""
-    rgb = image_bgr[:, :, ::-1]
-    resized = Image.fromarray(rgb).resize((64, 64))
-    vec = np.asarray(resized, dtype="float32").reshape(-1)
-    norm = np.linalg.norm(vec)
-    if norm > 0:
-        vec /= norm
-    return vec
+    """L2-normalized vector from the active embedder."""
+    return _embedder.embed(image_bgr)
+
+
+def embedder_named(name: Optional[str]) -> Embedder:
+    """Embedder for a backend key or version, defaulting to the active one."""
+    name = (name or "").strip().lower()
+    if not name or name == _embedder.name:
+        return _embedder
+    return _make_embedder(name)
+
+
+def _requested_embedder() -> Embedder:
+    """Embedder named by ?embedder=, defaulting to the active one."""
+    return embedder_named(request.args.get("embedder"))
+
+
+class _GalleryIndex:
+    """
+    The active embedder's gallery vectors as one contiguous matrix, so a probe is
+    scored against every student with a single matrix-vector product. Rows are
+    appended in place on enrollment; any other gallery change triggers a rebuild.
+    """
+
+    def __init__(self) -> None:
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix = np.zeros((0, 0), dtype="float32")
+        self.size = 0
+        self.version = -1
+        self.embedder: Optional[str] = None
+
+    def rebuild(self) -> None:
+        """Caller holds _lock."""
+        live = [(sid, vec) for sid, vec in _embeddings.items() if _embedders.get(sid) == _embedder.name]
+        self.ids = [sid for sid, _ in live]
+        self.rows = {sid: row for row, sid in enumerate(self.ids)}
+        self.matrix = np.empty((max(len(live), 16), _embedder.dim), dtype="float32")
+        for row, (_, vec) in enumerate(live):
+            self.matrix[row] = vec
+        self.size = len(live)
+        self.embedder = _embedder.name
+        self.version = _gallery_version
+
+    def upsert(self, student_id: str, vector: np.ndarray) -> None:
+        """Caller holds _lock."""
+        row = self.rows.get(student_id)
+        if row is None:
+            if self.size == self.matrix.shape[0]:
+                grown = np.empty((max(2 * self.size, 16), self.matrix.shape[1]), dtype="float32")
+                grown[: self.size] = self.matrix[: self.size]
+                self.matrix = grown
+            row = self.size
+            self.size += 1
+            self.ids.append(student_id)
+            self.rows[student_id] = row
+        self.matrix[row] = vector
+
+
+_gallery_index = _GalleryIndex()
+
+
+def _gallery_snapshot() -> Tuple[List[str], np.ndarray, Optional[str]]:
+    """(ids, matrix, embedder) for the live gallery; safe to use after the lock is released."""
+    with _lock:
+        if _gallery_index.version != _gallery_version:
+            _gallery_index.rebuild()
+        # ids is append-only, so the first `size` entries stay valid without copying the list.
+        size = _gallery_index.size
+        return _gallery_index.ids, _gallery_index.matrix[:size], _gallery_index.embedder
+
+
+def _top_k_similar(probe: np.ndarray, embedder_name: str, k: int) -> List[Tuple[str, float]]:
+    """The k gallery entries with the highest cosine similarity to `probe`, best first."""
+    ids, matrix, indexed_embedder = _gallery_snapshot()
+    if indexed_embedder != embedder_name or not len(matrix) or k <= 0:
+        return []
+    similarities = matrix @ probe
+    if k < len(matrix):
+        top = np.argpartition(-similarities, k - 1)[:k]
+    else:
+        top = np.arange(len(matrix))
+    top = top[np.argsort(-similarities[top], kind="stable")]
+    return [(ids[row], float(similarities[row])) for row in top]
 
 
 def _distance(a: np.ndarray, b: np.ndarray) -> float:
@@ -108,12 +495,93 @@ def _extract_image_from_request() -> Optional[bytes]:
         return None
     return _normalize_base64(val) if isinstance(val, str) else val
 
+# -----------------------------
+# Frame dedup
+# -----------------------------
+_frame_windows: "OrderedDict[Tuple[str, str], Deque[Tuple[int, float, int, Any]]]" = OrderedDict()
+_frame_lock = threading.Lock()
+_dedup_stats = {"hits": 0, "misses": 0}
+
+
+def _frame_hash(blob: bytes) -> Optional[int]:
+    """64-bit dHash of a 9x8 grayscale thumbnail; None if the bytes are not an image."""
+    try:
+        image = Image.open(io.BytesIO(blob))
+        # JPEG can decode straight to a downscaled grayscale image, skipping most of the work.
+        image.draft("L", (64, 64))
+        pixels = np.asarray(image.convert("L").resize((9, 8)), dtype="int16")
+    except Exception:
+        return None
+    bits = (pixels[:, 1:] > pixels[:, :-1]).reshape(-1)
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _dedup_lookup(kind: str, device_id: Optional[str], frame_hash: Optional[int]) -> Optional[Any]:
+    """Return the cached result of a near-identical recent frame from the same device."""
+    if not FRAME_DEDUP_ENABLED or not device_id or frame_hash is None:
+        return None
+    now = time.monotonic()
+    with _frame_lock:
+        window = _frame_windows.get((kind, device_id))
+        if window:
+            for cached_hash, seen_at, version, result in reversed(window):
+                if now - seen_at > FRAME_DEDUP_TTL or version != _gallery_version:
+                    continue
+                if (cached_hash ^ frame_hash).bit_count() <= FRAME_DEDUP_MAX_DISTANCE:
+                    _dedup_stats["hits"] += 1
+                    return result
+        _dedup_stats["misses"] += 1
+    return None
+
+
+def _dedup_store(kind: str, device_id: Optional[str], frame_hash: Optional[int], version: int, result: Any) -> None:
+    """Remember a result computed against gallery ``version`` (read before computing it)."""
+    if not FRAME_DEDUP_ENABLED or not device_id or frame_hash is None:
+        return
+    key = (kind, device_id)
+    with _frame_lock:
+        window = _frame_windows.get(key)
+        if window is None:
+            window = deque(maxlen=FRAME_DEDUP_WINDOW)
+            _frame_windows[key] = window
+        _frame_windows.move_to_end(key)
+        window.append((frame_hash, time.monotonic(), version, result))
+        while len(_frame_windows) > FRAME_DEDUP_MAX_DEVICES:
+            _frame_windows.popitem(last=False)
+
+
+def _device_id() -> Optional[str]:
+    value = (request.headers.get(DEVICE_ID_HEADER) or "").strip()
+    return value or None
+
 # -----------------------------
 # Routes
 # -----------------------------
 @app.get("/health")
 def health():
-    return jsonify({"ok": True})
+    # "endpoints" lets clients pick a route up front instead of probing for 404s.
+    endpoints = sorted({rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != "static"})
+    return jsonify({"ok": True, "embedder": _embedder.name, "endpoints": endpoints})
+
+
+@app.get("/metrics")
+def metrics():
+    with _frame_lock:
+        hits = _dedup_stats["hits"]
+        misses = _dedup_stats["misses"]
+        devices = len(_frame_windows)
+    lookups = hits + misses
+    return jsonify(
+        {
+            "dedup": {
+                "enabled": FRAME_DEDUP_ENABLED,
+                "hits": hits,
+                "misses": misses,
+                "hitRate": (hits / lookups) if lookups else 0.0,
+                "devices": devices,
+            }
+        }
+    )
 
 # --- Embedding APIs (for backend) ---
 @app.post("/embed")
@@ -138,12 +606,63 @@ def embed():
         val = payload["image"]
         img_bytes = _normalize_base64(val) if isinstance(val, str) else val
 
+    return _embed_response(img_bytes)
+
+
+# In-process API (embedder_named, embed_bytes, embed_batch_bytes): what a backend
+# that imports this module calls instead of /embed_upload and /embed_batch.
+def embed_bytes(img_bytes: bytes, embedder: Embedder, device_id: Optional[str] = None) -> Tuple[np.ndarray, bool]:
+    """
+    Embedding of one encoded image, and whether it was reused from a near-identical
+    recent frame of the same device. Decode errors propagate.
+    """
+    kind = f"embed:{embedder.name}"
+    frame_hash = _frame_hash(img_bytes) if device_id else None
+    cached = _dedup_lookup(kind, device_id, frame_hash)
+    if cached is not None:
+        return cached, True
+    version = _gallery_version
+    emb = embedder.embed(_decode_image(img_bytes))
+    _dedup_store(kind, device_id, frame_hash, version, emb)
+    return emb, False
+
+
+def embed_batch_bytes(
+    blobs: List[bytes], embedder: Embedder
+) -> Tuple[List[Optional[np.ndarray]], Dict[int, str]]:
+    """Embed encoded images in one vectorized pass; None (plus an error) where decoding failed."""
+    decoded: List[np.ndarray] = []
+    positions: List[int] = []
+    errors: Dict[int, str] = {}
+    for index, blob in enumerate(blobs):
+        try:
+            decoded.append(_decode_image(blob))
+            positions.append(index)
+        except Exception as e:
+            errors[index] = f"decode_failed: {e}"
+
+    embeddings: List[Optional[np.ndarray]] = [None] * len(blobs)
+    if decoded:
+        for index, row in zip(positions, embedder.embed_batch(decoded)):
+            embeddings[index] = row
+    return embeddings, errors
+
+
+def _embed_response(img_bytes: bytes):
     try:
-        emb = _compute_embedding(_decode_image(img_bytes))
+        embedder = _requested_embedder()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        emb, cached = embed_bytes(img_bytes, embedder, _device_id())
     except Exception as e:
         return jsonify({"error": f"decode_failed: {e}"}), 400
 
-    return jsonify({"embedding": emb.tolist(), "ok": True})
+    body = {"embedding": emb.tolist(), "embedder": embedder.name, "ok": True}
+    if cached:
+        body["cached"] = True
+    return jsonify(body)
 
 
 @app.post("/embed_upload")
@@ -152,11 +671,34 @@ def embed_upload():
     file = request.files.get("image")
     if not file:
         return jsonify({"error": "multipart field 'image' is required"}), 400
+    return _embed_response(file.read())
+
+
+@app.post("/embed_batch")
+def embed_batch():
+    """
+    Embed several images in one vectorized pass.
+    Accepts multipart: images=@file (repeated); optional ?embedder=<name>.
+    Returns:
+      { "embeddings": [[float, ...] | null, ...], "errors": {index: str}, "embedder": str }
+    """
+    files = request.files.getlist("images") or request.files.getlist("image")
+    if not files:
+        return jsonify({"error": "multipart field 'images' is required"}), 400
     try:
-        emb = _compute_embedding(_decode_image(file.read()))
-    except Exception as e:
-        return jsonify({"error": f"decode_failed: {e}"}), 400
-    return jsonify({"embedding": emb.tolist(), "ok": True})
+        embedder = _requested_embedder()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    embeddings, errors = embed_batch_bytes([file.read() for file in files], embedder)
+    return jsonify(
+        {
+            "embeddings": [None if row is None else row.tolist() for row in embeddings],
+            "errors": errors,
+            "embedder": embedder.name,
+            "ok": True,
+        }
+    )
 
 # --- Pairwise verify ---
 @app.post("/verify")
@@ -165,8 +707,9 @@ def verify():
     if not payload or "image_a" not in payload or "image_b" not in payload:
         return jsonify({"error": "fields 'image_a' and 'image_b' are required"}), 400
 
-    image_a = _compute_embedding(_decode_image(payload["image_a"]))
-    image_b = _compute_embedding(_decode_image(payload["image_b"]))
+    image_a, image_b = _embedder.embed_batch(
+        [_decode_image(payload["image_a"]), _decode_image(payload["image_b"])]
+    )
     distance = _distance(image_a, image_b)
     score = _score_from_distance(distance)
     return jsonify(
@@ -186,8 +729,9 @@ def verify_upload():
     if not file_a or not file_b:
         return jsonify({"error": "multipart fields 'image_a' and 'image_b' are required"}), 400
 
-    image_a = _compute_embedding(_decode_image(file_a.read()))
-    image_b = _compute_embedding(_decode_image(file_b.read()))
+    image_a, image_b = _embedder.embed_batch(
+        [_decode_image(file_a.read()), _decode_image(file_b.read())]
+    )
     distance = _distance(image_a, image_b)
     score = _score_from_distance(distance)
     return jsonify(
@@ -227,30 +771,61 @@ def enroll():
     if not student_id or not image_bytes:
         return jsonify({"error": "student_id and image are required"}), 400
 
-    emb = _compute_embedding(_decode_image(image_bytes))
+    embedder = _embedder
+    emb = embedder.embed(_decode_image(image_bytes))
+    duplicates = [
+        {"studentId": sid, "similarity": similarity}
+        for sid, similarity in _top_k_similar(emb, embedder.name, DUPLICATE_TOP_K + 1)
+        if sid != str(student_id) and similarity >= DUPLICATE_SIMILARITY
+    ][:DUPLICATE_TOP_K]
+
+    photo = _store_photo(image_bytes)
+    global _gallery_version
     with _lock:
+        index_current = _gallery_index.version == _gallery_version
         _embeddings[str(student_id)] = emb
+        _embedders[str(student_id)] = embedder.name
+        _photos[str(student_id)] = photo
+        _origins.pop(str(student_id), None)
+        _gallery_version += 1
+        _log_change(str(student_id))
+        if index_current and _gallery_index.embedder == embedder.name:
+            _gallery_index.upsert(str(student_id), emb)
+            _gallery_index.version = _gallery_version
+    _reembed_job.forget(str(student_id))
     _save_embeddings()
-    return jsonify({"ok": True, "studentId": student_id})
+    return jsonify(
+        {
+            "ok": True,
+            "studentId": student_id,
+            "embedder": embedder.name,
+            "photo": photo,
+            "duplicates": duplicates,
+        }
+    )
 
 
 def _recognize_from_image(image_bgr: np.ndarray) -> Tuple[List[dict], List[dict]]:
-    probe = _compute_embedding(image_bgr)
     with _lock:
         if not _embeddings:
             return [], []
-        results: List[dict] = []
-        for sid, stored in _embeddings.items():
-            dist = _distance(probe, stored)
+    embedder = _embedder
+    probe = embedder.embed(image_bgr)
+    ids, matrix, indexed_embedder = _gallery_snapshot()
+    results: List[dict] = []
+    if indexed_embedder == embedder.name and len(matrix):
+        # Unit vectors: |a - b| = sqrt(2 - 2 a.b)
+        distances = np.sqrt(np.maximum(2.0 - 2.0 * (matrix @ probe), 0.0))
+        for row in np.argsort(distances, kind="stable"):
+            dist = float(distances[row])
             results.append(
                 {
-                    "student_id": sid,
+                    "student_id": ids[row],
                     "distance": dist,
                     "score": _score_from_distance(dist),
                     "match": dist <= MATCH_THRESHOLD,
                 }
             )
-    results.sort(key=lambda x: x["distance"])
 
     # Dummy single "face" covering full frame for compatibility
     h, w = image_bgr.shape[:2]
@@ -274,18 +849,474 @@ def recognize():
     if not img_bytes:
         return jsonify({"error": "image is required"}), 400
 
+    device_id = _device_id()
+    frame_hash = _frame_hash(img_bytes) if device_id else None
+    cached = _dedup_lookup("recognize", device_id, frame_hash)
+    if cached is not None:
+        return jsonify({**cached, "cached": True})
+
+    version = _gallery_version
     try:
         image_bgr = _decode_image(img_bytes)
     except Exception as e:
         return jsonify({"error": f"decode_failed: {e}"}), 400
 
     recognized, faces = _recognize_from_image(image_bgr)
-    return jsonify({"recognized": recognized, "faces": faces, "threshold": MATCH_THRESHOLD})
+    body = {"recognized": recognized, "faces": faces, "threshold": MATCH_THRESHOLD}
+    _dedup_store("recognize", device_id, frame_hash, version, body)
+    return jsonify(body)
+
+# -----------------------------
+# Re-embedding
+# -----------------------------
+class _ReembedJob:
+    """
+    Rebuild the gallery with another embedder from the stored enrollment photos.
+
+    New vectors accumulate in a side table (checkpointed to disk after every
+    batch, so a restart resumes where it stopped) while matching keeps using
+    the live gallery. Each vector remembers the photo digest it was computed
+    from; one whose entry has been re-enrolled since is stale and redone. Photos
+    that cannot be read or embedded are reported in `failed` and block the
+    switch like missing photos. Once every entry has a current vector the
+    gallery and the active embedder are swapped under the gallery lock in one
+    step. The job and
+    the switch exist only in the process that received the POST, which is why
+    the service runs as a single worker.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.target: Optional[str] = None
+        self.pending: Dict[str, Tuple[str, np.ndarray]] = {}  # id -> (photo digest, vector)
+        self.failed: Dict[str, str] = {}  # id -> why its photo could not be embedded
+        self.status = "idle"
+        self.error: Optional[str] = None
+        self.missing: List[str] = []
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def snapshot(self) -> dict:
+        with self.lock, _lock:
+            total = len(_embeddings)
+            return {
+                "status": self.status,
+                "activeEmbedder": _embedder.name,
+                "target": self.target,
+                "done": total if self.status == "complete" else len(self._current()),
+                "total": total,
+                "missingPhotos": list(self.missing),
+                "failed": dict(self.failed),
+                "error": self.error,
+                "startedAt": self.started_at,
+                "finishedAt": self.finished_at,
+            }
+
+    def start(self, target: str, force: bool = False) -> bool:
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            embedder = _make_embedder(target)
+            if embedder.name != self.target:
+                self.pending = {}
+            self.target = embedder.name
+            self.status = "running"
+            self.error = None
+            self.missing = []
+            self.failed = {}
+            self.started_at = time.time()
+            self.finished_at = None
+            self.thread = threading.Thread(target=self._run, args=(embedder, force), daemon=True)
+            self.thread.start()
+            return True
+
+    def resume_from_checkpoint(self) -> None:
+        if not os.path.exists(REEMBED_CHECKPOINT_PATH):
+            return
+        with open(REEMBED_CHECKPOINT_PATH, "rb") as handle:
+            checkpoint = pickle.load(handle)
+        with self.lock:
+            self.target = checkpoint["target"]
+            # Checkpoints from before vectors carried their photo digest are recomputed.
+            self.pending = {
+                k: (v[0], np.asarray(v[1], dtype="float32"))
+                for k, v in checkpoint["vectors"].items()
+                if len(v) == 2 and isinstance(v[0], str)
+            }
+        self.start(checkpoint["target"], bool(checkpoint.get("force")))
+
+    def _checkpoint(self, force: bool) -> None:
+        with self.lock:
+            vectors = {k: (digest, v.tolist()) for k, (digest, v) in self.pending.items()}
+        _write_pickle(REEMBED_CHECKPOINT_PATH, {"target": self.target, "force": force, "vectors": vectors})
+
+    def _embed_batch(
+        self, embedder: Embedder, batch: List[Tuple[str, str]]
+    ) -> Tuple[Dict[str, Tuple[str, np.ndarray]], Dict[str, str]]:
+        """(id -> (digest, vector), id -> error); one bad photo does not sink the batch."""
+        images, decoded, failed = [], [], {}
+        for sid, digest in batch:
+            try:
+                images.append(_decode_image(_read_photo(digest)))
+                decoded.append((sid, digest))
+            except Exception as exc:
+                failed[sid] = f"photo unreadable: {exc}"
+        if not images:
+            return {}, failed
+        try:
+            vectors = embedder.embed_batch(images)
+        except Exception as exc:
+            failed.update({sid: f"embedding failed: {exc}" for sid, _ in decoded})
+            return {}, failed
+        return {sid: (digest, vector) for (sid, digest), vector in zip(decoded, vectors)}, failed
+
+    def _current(self) -> Dict[str, np.ndarray]:
+        """Pending vectors whose entry still has the photo they were computed from. Caller holds both locks."""
+        return {
+            sid: vector
+            for sid, (digest, vector) in self.pending.items()
+            if sid in _embeddings and _photos.get(sid) == digest
+        }
+
+    def _todo(self) -> Tuple[List[Tuple[str, str]], List[str]]:
+        """Entries lacking a current vector, and entries that have no usable photo."""
+        with self.lock, _lock:
+            done = self._current()
+            todo = [
+                (sid, _photos[sid])
+                for sid in _embeddings
+                if sid not in done and sid in _photos and sid not in self.failed
+            ]
+            missing = [sid for sid in _embeddings if sid not in done and (sid not in _photos or sid in self.failed)]
+        return todo, missing
+
+    def forget(self, student_id: str) -> None:
+        """Drop a computed vector whose photo has since been replaced."""
+        with self.lock:
+            self.pending.pop(student_id, None)
+            self.failed.pop(student_id, None)
+
+    def _run(self, embedder: Embedder, force: bool) -> None:
+        global _embedder, _gallery_version
+        try:
+            todo, _ = self._todo()
+            while True:
+                batches = [todo[i:i + REEMBED_BATCH_SIZE] for i in range(0, len(todo), REEMBED_BATCH_SIZE)]
+                with ThreadPoolExecutor(max_workers=REEMBED_WORKERS) as pool:
+                    for vectors, failed in pool.map(lambda batch: self._embed_batch(embedder, batch), batches):
+                        with self.lock, _lock:
+                            # A photo replaced while this batch ran makes its vector stale.
+                            self.pending.update(
+                                (sid, entry) for sid, entry in vectors.items() if _photos.get(sid) == entry[0]
+                            )
+                            self.failed.update(failed)
+                        self._checkpoint(force)
+                todo, missing = self._todo()
+                if todo:
+                    continue  # enrolled or re-enrolled while the batches ran
+
+                if missing and not force:
+                    with self.lock:
+                        self.missing = missing
+                        self.status = "blocked"
+                    return
+
+                with self.lock, _lock:
+                    live = self._current()
+                    # Students enrolled or re-enrolled since _todo() need a pass of their own first.
+                    if any(
+                        sid not in live and sid in _photos and sid not in self.failed for sid in _embeddings
+                    ):
+                        todo = []
+                        continue
+                    dropped = [sid for sid in _embeddings if sid not in live]
+                    _embeddings.clear()
+                    _embeddings.update(live)
+                    _embedders.clear()
+                    _embedders.update({sid: embedder.name for sid in live})
+                    for sid in dropped:
+                        _photos.pop(sid, None)
+                        _origins.pop(sid, None)
+                    _embedder = embedder
+                    _gallery_version += 1
+                    for sid in live:
+                        _log_change(sid)
+                    for sid in dropped:
+                        _log_change(sid, deleted=True)
+                    self.missing = missing
+                    self.pending = {}
+                    self.status = "complete"
+                    self.finished_at = time.time()
+                break
+            _save_embeddings()
+            if os.path.exists(REEMBED_CHECKPOINT_PATH):
+                os.remove(REEMBED_CHECKPOINT_PATH)
+        except Exception as e:
+            with self.lock:
+                self.status = "failed"
+                self.error = str(e)
+
+
+_reembed_job = _ReembedJob()
+
+
+@app.get("/gallery/reembed")
+def reembed_status():
+    return jsonify(_reembed_job.snapshot())
+
+
+@app.post("/gallery/reembed")
+def reembed_start():
+    """
+    Start re-embedding the gallery.
+    Accepts JSON: { "embedder": "<name>" (default EMBEDDER), "force": bool }
+    force drops entries that have no stored photo instead of blocking the switch.
+    """
+    payload = request.get_json(force=True, silent=True) or {}
+    target = (payload.get("embedder") or EMBEDDER).strip().lower()
+    try:
+        started = _reembed_job.start(target, bool(payload.get("force")))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not started:
+        return jsonify({"error": "re-embed already running", **_reembed_job.snapshot()}), 409
+    return jsonify(_reembed_job.snapshot()), 202
+
+
+# -----------------------------
+# Gallery sync
+# -----------------------------
+# Binary gallery format used by /gallery/export, /gallery/import and the bootstrap:
+#   b"GAL1" | uint32 LE header length | JSON header | float32 LE matrix (len(ids) x dim)
+# header: {"version", "embedder", "dim", "ids": [...], "photos": [...], "deleted": [...], "origin"}
+# where photos[i] is the SHA-256 of the enrollment photo behind ids[i] (or null).
+GALLERY_MAGIC = b"GAL1"
+GALLERY_CHUNK_ROWS = 4096
+
+
+def _gallery_blob_chunks(header: dict, matrix: np.ndarray):
+    header_bytes = json.dumps(header).encode("utf-8")
+    yield GALLERY_MAGIC + struct.pack("<I", len(header_bytes)) + header_bytes
+    for start in range(0, len(matrix), GALLERY_CHUNK_ROWS):
+        yield np.ascontiguousarray(matrix[start:start + GALLERY_CHUNK_ROWS], dtype="<f4").tobytes()
+
+
+def _read_exact(stream, size: int) -> bytearray:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    filled = 0
+    while filled < size:
+        chunk = stream.read(min(size - filled, 1 << 20))
+        if not chunk:
+            raise ValueError("truncated gallery blob")
+        view[filled:filled + len(chunk)] = chunk
+        filled += len(chunk)
+    return buffer
+
+
+def _read_gallery_blob(stream) -> Tuple[dict, np.ndarray]:
+    if bytes(_read_exact(stream, 4)) != GALLERY_MAGIC:
+        raise ValueError("not a gallery blob")
+    (header_len,) = struct.unpack("<I", _read_exact(stream, 4))
+    header = json.loads(bytes(_read_exact(stream, header_len)).decode("utf-8"))
+    count = len(header.get("ids") or [])
+    dim = int(header.get("dim") or 0)
+    matrix = np.frombuffer(_read_exact(stream, count * dim * 4), dtype="<f4").reshape(count, dim)
+    return header, matrix
+
+
+def _apply_gallery_import(header: dict, matrix: np.ndarray, replace: bool) -> Tuple[int, int]:
+    """Merge (or, with replace, swap in) an imported gallery; returns (new gallery version, ids deleted)."""
+    global _gallery_version
+    ids = [str(sid) for sid in header.get("ids") or []]
+    photos = list(header.get("photos") or [])
+    photos += [None] * (len(ids) - len(photos))
+    deleted = [str(sid) for sid in header.get("deleted") or []]
+    embedder = header.get("embedder") or (
+        _legacy_embedder_name(matrix[0]) if len(matrix) else _embedder.name
+    )
+    origin = header.get("origin")
+    with _lock:
+        if replace:
+            incoming = set(ids)
+            deleted += [sid for sid in _embeddings if sid not in incoming]
+        # Small merges (one registration) extend the search index in place.
+        index_current = (
+            not deleted
+            and _gallery_index.version == _gallery_version
+            and _gallery_index.embedder == embedder
+        )
+        _gallery_version += 1
+        for sid, row, photo in zip(ids, matrix, photos):
+            vector = np.array(row, dtype="float32")
+            _embeddings[sid] = vector
+            _embedders[sid] = embedder
+            # The digest of the photo the vector came from; without one the old
+            # photo no longer describes the vector and cannot be re-embedded.
+            if photo:
+                _photos[sid] = str(photo)
+            else:
+                _photos.pop(sid, None)
+            if origin:
+                _origins[sid] = origin
+            else:
+                _origins.pop(sid, None)
+            _log_change(sid)
+            if index_current:
+                _gallery_index.upsert(sid, vector)
+        for sid in deleted:
+            _embeddings.pop(sid, None)
+            _embedders.pop(sid, None)
+            _photos.pop(sid, None)
+            _origins.pop(sid, None)
+            _log_change(sid, deleted=True)
+        if index_current:
+            _gallery_index.version = _gallery_version
+        version = _gallery_version
+    for sid in ids + deleted:
+        _reembed_job.forget(sid)
+    _save_embeddings()
+    return version, len(deleted)
+
+
+def _gallery_changes_since(since: int, exclude_origin: Optional[str] = None) -> Tuple[int, List[dict]]:
+    """(current version, latest write per entry after `since`); embeddings stay arrays."""
+    changes: List[dict] = []
+    with _lock:
+        start = bisect.bisect_right(_change_log, since, key=lambda entry: entry[0])
+        seen = set()
+        for version, sid in _change_log[start:]:
+            if sid in seen:
+                continue
+            if _entry_versions.get(sid) == version:
+                seen.add(sid)
+                if exclude_origin and _origins.get(sid) == exclude_origin:
+                    continue
+                changes.append(
+                    {
+                        "studentId": sid,
+                        "version": version,
+                        "embedder": _embedders.get(sid),
+                        "origin": _origins.get(sid),
+                        "photo": _photos.get(sid),
+                        "embedding": _embeddings[sid],
+                    }
+                )
+            elif _tombstones.get(sid) == version:
+                seen.add(sid)
+                changes.append({"studentId": sid, "version": version, "deleted": True})
+        current = _gallery_version
+    return current, changes
+
+
+@app.get("/gallery/changes")
+def gallery_changes():
+    """
+    Entries written after `since` (a version from a previous response).
+    Query: since=<int>, exclude_origin=<origin> to skip writes a peer pushed itself.
+    Returns:
+      { "version": int, "changes": [{studentId, version, embedder, origin, photo, embedding} | {studentId, version, deleted}] }
+    `photo` is the SHA-256 of the enrollment photo (fetch it from /gallery/photos/<photo>), or null.
+    """
+    try:
+        since = int(request.args.get("since", "0"))
+    except ValueError:
+        return jsonify({"error": "since must be an integer"}), 400
+    current, changes = _gallery_changes_since(since, request.args.get("exclude_origin"))
+    for change in changes:
+        if "embedding" in change:
+            change["embedding"] = change["embedding"].tolist()
+    return jsonify({"version": current, "since": since, "changes": changes})
+
+
+@app.get("/gallery/photos/<digest>")
+def gallery_photo(digest: str):
+    """A stored enrollment photo by the SHA-256 reported in /gallery/changes."""
+    if len(digest) != 64 or not set(digest) <= set("0123456789abcdef"):
+        return jsonify({"error": "not a photo digest"}), 400
+    try:
+        blob = _read_photo(digest)
+    except OSError:
+        return jsonify({"error": "photo not found"}), 404
+    return Response(blob, mimetype="application/octet-stream")
+
+
+@app.get("/gallery/export")
+def gallery_export():
+    """Stream the active embedder's gallery as one binary snapshot."""
+    ids, matrix, embedder = _gallery_snapshot()
+    with _lock:
+        version = _gallery_version
+    header = {
+        "version": version,
+        "embedder": embedder,
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+        "ids": ids[: len(matrix)],
+    }
+    with _lock:
+        header["photos"] = [_photos.get(sid) for sid in header["ids"]]
+    return Response(_gallery_blob_chunks(header, matrix), mimetype="application/octet-stream")
+
+
+@app.post("/gallery/import")
+def gallery_import():
+    """
+    Apply a binary gallery blob (see GALLERY_MAGIC).
+    Query: mode=merge (default; upsert ids, drop `deleted`) or mode=replace (the blob becomes the gallery).
+    """
+    mode = (request.args.get("mode") or "merge").lower()
+    if mode not in ("merge", "replace"):
+        return jsonify({"error": "mode must be merge or replace"}), 400
+    try:
+        header, matrix = _read_gallery_blob(request.stream)
+    except (ValueError, struct.error) as e:
+        return jsonify({"error": f"invalid gallery blob: {e}"}), 400
+    version, deleted = _apply_gallery_import(header, matrix, mode == "replace")
+    return jsonify({"ok": True, "version": version, "imported": len(matrix), "deleted": deleted})
+
+
+def _bootstrap_gallery() -> None:
+    """Seed an empty gallery from GALLERY_BOOTSTRAP_URL in one streamed snapshot."""
+    if not GALLERY_BOOTSTRAP_URL:
+        return
+    with _lock:
+        if _embeddings:
+            return
+    try:
+        with urllib.request.urlopen(GALLERY_BOOTSTRAP_URL, timeout=60) as response:
+            header, matrix = _read_gallery_blob(response)
+        _apply_gallery_import(header, matrix, replace=False)
+        print(f"bootstrapped {len(matrix)} embeddings from {GALLERY_BOOTSTRAP_URL}", flush=True)
+    except Exception as e:
+        print(f"gallery bootstrap from {GALLERY_BOOTSTRAP_URL} failed: {e}", flush=True)
+
+
+def _select_active_embedder() -> None:
+    """Keep matching on the gallery's own embedder until it has been re-embedded."""
+    global _embedder
+    with _lock:
+        generations = Counter(_embedders.values())
+    if not generations or _embedder.name in generations:
+        return
+    for name, _count in generations.most_common():
+        try:
+            _embedder = _make_embedder(name)
+        except ValueError:
+            continue
+        print(f"gallery is on {name}; POST /gallery/reembed to migrate to {EMBEDDER}", flush=True)
+        return
 
 # -----------------------------
 # Bootstrap
 # -----------------------------
-_load_embeddings()
+if GALLERY_ENABLED:
+    _load_embeddings()
+    _bootstrap_gallery()
+    _select_active_embedder()
+    _reembed_job.resume_from_checkpoint()
 
 if __name__ == "__main__":
+    # HTTP/1.1 lets run.py's pooled client reuse connections across frames.
+    WSGIRequestHandler.protocol_version = "HTTP/1.1"
     app.run(host="0.0.0.0", port=PORT)
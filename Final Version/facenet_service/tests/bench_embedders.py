@@ -0,0 +1,74 @@
+"""Compare embedder backends on the photos in this folder.
+
+Usage (from facenet_service/):
+    python tests/bench_embedders.py
+
+For each person, <name>.jpg is enrolled (golu has none, so golutest1.jpg is
+used) and every other <name>*.jpg is a probe. Reports embed time per image in
+a batch, gallery bytes per student, and top-1 identification accuracy.
+"""
+import glob
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from facenet_service import EMBEDDER_BACKENDS, _decode_image  # noqa: E402
+
+PEOPLE = ["anuj", "golu", "harsh", "kathansh", "nishant"]
+ENROLL_OVERRIDES = {"golu": "golutest1.jpg"}
+
+
+def _load_sets():
+    gallery, probes = [], []
+    for path in sorted(glob.glob(os.path.join(HERE, "*.jpg"))):
+        filename = os.path.basename(path)
+        match = re.match(r"([a-z]+?)(test\d*|\d+|curr)?\.jpg$", filename)
+        person = match.group(1) if match else None
+        if person not in PEOPLE:
+            continue
+        with open(path, "rb") as handle:
+            image = _decode_image(handle.read())
+        if filename == ENROLL_OVERRIDES.get(person, f"{person}.jpg"):
+            gallery.append((person, image))
+        else:
+            probes.append((person, image))
+    return gallery, probes
+
+
+def main() -> None:
+    gallery, probes = _load_sets()
+    print(f"{len(gallery)} enrolled, {len(probes)} probes\n")
+    print(f"{'embedder':<10} {'dims':>6} {'ms/img':>8} {'bytes/student':>14} {'top-1':>7} {'gap':>7}")
+    for key, backend in EMBEDDER_BACKENDS.items():
+        embedder = backend()
+        images = [image for _, image in gallery + probes]
+        embedder.embed_batch(images[:1])  # warm-up
+        started = time.perf_counter()
+        vectors = embedder.embed_batch(images)
+        elapsed_ms = (time.perf_counter() - started) * 1000.0 / len(images)
+
+        enrolled = vectors[: len(gallery)]
+        probe_vectors = vectors[len(gallery):]
+        names = np.array([person for person, _ in gallery])
+        distances = np.linalg.norm(probe_vectors[:, None, :] - enrolled[None, :, :], axis=-1)
+        order = np.argsort(distances, axis=1)
+        hits = names[order[:, 0]] == np.array([person for person, _ in probes])
+        # Mean distance gap between the best impostor and the genuine match; higher separates better.
+        genuine = distances[np.arange(len(probes)), [list(names).index(p) for p, _ in probes]]
+        impostor = np.where(names[None, :] == np.array([p for p, _ in probes])[:, None], np.inf, distances).min(axis=1)
+        gap = float(np.mean(impostor - genuine))
+
+        print(
+            f"{key:<10} {embedder.dim:>6} {elapsed_ms:>8.2f} {embedder.dim * 4:>14} "
+            f"{hits.mean():>7.0%} {gap:>7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()